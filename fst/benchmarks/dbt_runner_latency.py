@@ -0,0 +1,65 @@
+import statistics
+import time
+import logging
+from typing import Dict
+
+from fst.benchmarks import percentile
+from fst.db_utils import (
+    execute_query,
+    get_duckdb_file_path,
+    hand_target_to_dbt,
+    release_connections,
+)
+from fst.dbt_runner import create_dbt_runner
+from fst.file_utils import find_compiled_sql_file, get_model_name_from_file
+
+logger = logging.getLogger(__name__)
+
+
+def measure_dbt_runner_latency(
+    mode: str, model_file: str, iterations: int = 5
+) -> Dict[str, float]:
+    """Edit `model_file` and time `dbt build` plus the preview query for each edit.
+
+    The first iteration is reported separately because it includes the one-off
+    cost of loading dbt for the in-process runner.
+    """
+    runner = create_dbt_runner(mode)
+    model_name = get_model_name_from_file(model_file)
+    with open(model_file, "r") as file:
+        original_content = file.read()
+
+    latencies = []
+    failures = 0
+    try:
+        for i in range(iterations + 1):
+            with open(model_file, "w") as file:
+                file.write(f"{original_content}\n-- fst bench {mode} {i} {time.time()}\n")
+            start_time = time.perf_counter()
+            # as run_dbt does, the preview's connection lets go of the DuckDB file first,
+            # so subprocess builds don't measure lock contention
+            with hand_target_to_dbt():
+                result = runner.invoke(["build", "--select", model_name])
+            compiled_sql_file = find_compiled_sql_file(model_file)
+            if compiled_sql_file:
+                with open(compiled_sql_file, "r") as file:
+                    compiled_query = file.read()
+                execute_query(compiled_query, get_duckdb_file_path())
+            latencies.append(time.perf_counter() - start_time)
+            if result.returncode != 0:
+                failures += 1
+    finally:
+        release_connections()
+        with open(model_file, "w") as file:
+            file.write(original_content)
+
+    warm_latencies = latencies[1:] or latencies
+    return {
+        "mode": runner.mode,
+        "iterations": iterations,
+        "failures": failures,
+        "first_s": latencies[0],
+        "p50_s": percentile(warm_latencies, 50),
+        "p95_s": percentile(warm_latencies, 95),
+        "mean_s": statistics.mean(warm_latencies),
+    }
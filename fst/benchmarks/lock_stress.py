@@ -0,0 +1,131 @@
+import logging
+import os
+import secrets
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+from fst.benchmarks import percentile
+from fst.config_defaults import METRICS_IDLE_CLOSE_SECONDS
+from fst.db_utils import snapshot_target, target_write_lock
+from fst.dbt_runner import run_dbt
+from fst.file_utils import get_model_name_from_file
+from fst.metrics_writer import close_metrics_writer, configure_metrics_writer, save_metrics
+from fst.read_server import METRICS_DATABASE, TARGET_DATABASE, ReadClient, ReadServer
+
+logger = logging.getLogger(__name__)
+
+# the reads a workbench rerun makes: the watermark, the model list and a target query
+DASHBOARD_READS = [
+    (METRICS_DATABASE, "SELECT max(seq), count(*) FROM metrics"),
+    (METRICS_DATABASE, "SELECT DISTINCT modified_sql_file FROM metrics"),
+    (TARGET_DATABASE, "SELECT count(*) FROM information_schema.tables"),
+]
+
+
+def measure_lock_stress(
+    mode: str, model_file: str, builds: int = 5, readers: int = 4
+) -> Dict[str, Any]:
+    """Rebuild `model_file` and write metrics while `readers` threads read both databases.
+
+    In "server" mode the readers go through a read server, as the workbench does
+    while the watcher runs. In "direct" mode they open the files read-only
+    themselves, which is how the workbench read before there was a read server.
+    Metrics go to a scratch database, so the project's metrics are left alone.
+    """
+    model_name = get_model_name_from_file(model_file)
+    with open(model_file, "r") as file:
+        original_content = file.read()
+    scratch_dir = tempfile.mkdtemp(prefix="fst-lock-stress-")
+    metrics_db_file = os.path.join(scratch_dir, "metrics.duckdb")
+    address = os.path.join(scratch_dir, "read.sock")
+    authkey = secrets.token_hex(16).encode() if mode == "server" else None
+
+    configure_metrics_writer(
+        metrics_db_file,
+        idle_close_seconds=None if mode == "server" else METRICS_IDLE_CLOSE_SECONDS,
+    )
+    server = None
+    if mode == "server":
+        server = ReadServer(address, authkey)
+        server.start()
+    client = ReadClient(address, authkey, metrics_db_file=metrics_db_file)
+
+    done = threading.Event()
+    results_lock = threading.Lock()
+    read_latencies: List[float] = []
+    read_errors: List[str] = []
+    build_times: List[float] = []
+    build_failures = 0
+
+    def read_loop() -> None:
+        while not done.is_set():
+            for database, query in DASHBOARD_READS:
+                start_time = time.perf_counter()
+                try:
+                    client.execute(database, query)
+                except Exception as e:
+                    with results_lock:
+                        read_errors.append(f"{database}: {e}")
+                    continue
+                with results_lock:
+                    read_latencies.append(time.perf_counter() - start_time)
+
+    reader_threads = [
+        threading.Thread(target=read_loop, name=f"fst-lock-stress-{i}", daemon=True)
+        for i in range(readers)
+    ]
+    if mode == "server":
+        # as the watcher does, so target reads during builds have the last build to read
+        snapshot_target()
+    try:
+        for thread in reader_threads:
+            thread.start()
+        for i in range(builds):
+            with open(model_file, "w") as file:
+                file.write(f"{original_content}\n-- fst bench lock-stress {i} {time.time()}\n")
+            start_time = time.perf_counter()
+            with target_write_lock():
+                result = run_dbt(["build", "--select", model_name])
+                if mode == "server":
+                    snapshot_target()
+            build_time = time.perf_counter() - start_time
+            build_times.append(build_time)
+            if result.returncode != 0:
+                build_failures += 1
+            save_metrics(
+                {
+                    "modified_sql_file": model_file,
+                    "dbt_build_status": "success" if result.returncode == 0 else "failure",
+                    "dbt_build_time": build_time,
+                    "iteration_id": uuid.uuid4().hex,
+                }
+            )
+    finally:
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+        with open(model_file, "w") as file:
+            file.write(original_content)
+        if server is not None:
+            server.close()
+        close_metrics_writer()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    for error in sorted(set(read_errors))[:5]:
+        logger.debug(f"Read failed during lock stress: {error}")
+    return {
+        "mode": mode,
+        "builds": builds,
+        "build_failures": build_failures,
+        "mean_build_s": statistics.mean(build_times),
+        "readers": readers,
+        "reads": len(read_latencies),
+        "read_errors": len(read_errors),
+        "p50_read_ms": percentile(read_latencies, 50) * 1000 if read_latencies else None,
+        "p95_read_ms": percentile(read_latencies, 95) * 1000 if read_latencies else None,
+    }
@@ -0,0 +1,454 @@
+import logging
+import math
+import os
+import platform
+import random
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from multiprocessing.connection import Client
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import duckdb
+import psutil
+
+from fst.benchmarks import percentile
+from fst.config_defaults import (
+    BENCH_EDIT_TIMEOUT_SECONDS,
+    BENCH_REGRESSION_THRESHOLD,
+    BENCH_SAMPLE_INTERVAL_SECONDS,
+    BENCH_STARTUP_TIMEOUT_SECONDS,
+    METRICS_DB_FILE,
+    READ_SERVER_AUTHKEY_ENV,
+    get_read_server_address,
+)
+from fst.read_server import METRICS_DATABASE, ReadClient
+from fst.spans import ITERATION_SPAN, PREVIEW_QUERY_SPAN, to_epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+# lower is better for all of them
+REGRESSION_METRICS = [
+    "p50_save_to_preview_s",
+    "p95_save_to_preview_s",
+    "p99_save_to_preview_s",
+    "p95_save_to_recorded_s",
+    "cpu_seconds",
+    "peak_rss_mb",
+]
+BENCH_RUNS_TABLE = """
+    CREATE TABLE IF NOT EXISTS bench_runs (
+        run_id VARCHAR,
+        timestamp TIMESTAMP,
+        fst_version VARCHAR,
+        dbt_version VARCHAR,
+        python_version VARCHAR,
+        platform VARCHAR,
+        scenario VARCHAR,
+        models INTEGER,
+        depth INTEGER,
+        rows_per_source BIGINT,
+        edits INTEGER,
+        dbt_runner VARCHAR,
+        completed INTEGER,
+        missed INTEGER,
+        failures INTEGER,
+        p50_save_to_preview_s DOUBLE,
+        p95_save_to_preview_s DOUBLE,
+        p99_save_to_preview_s DOUBLE,
+        p50_save_to_recorded_s DOUBLE,
+        p95_save_to_recorded_s DOUBLE,
+        p99_save_to_recorded_s DOUBLE,
+        cpu_seconds DOUBLE,
+        cpu_percent DOUBLE,
+        peak_rss_mb DOUBLE,
+        mean_rss_mb DOUBLE
+    )
+"""
+
+
+class Edit(NamedTuple):
+    file_path: str
+    saved_at: float
+    iteration_id: Optional[str]
+
+
+class ResourceSampler:
+    """Samples CPU time and RSS of a process and all of its children on a background thread.
+
+    dbt subprocesses come and go between samples, so CPU time is summed over the
+    last sample of every process seen. A short-lived process loses at most the CPU
+    time it used after its last sample.
+    """
+
+    def __init__(self, pid: int, interval: float = BENCH_SAMPLE_INTERVAL_SECONDS):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.cpu_times: Dict[int, float] = {}
+        self.cpu_baseline = 0.0
+        self.rss_samples: List[int] = []
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="fst-bench-sampler", daemon=True)
+
+    def sample(self) -> int:
+        rss = 0
+        try:
+            processes = [self.process, *self.process.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return rss
+        for process in processes:
+            try:
+                with process.oneshot():
+                    cpu_times = process.cpu_times()
+                    self.cpu_times[process.pid] = cpu_times.user + cpu_times.system
+                    rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+        return rss
+
+    def reset(self) -> None:
+        """Start measuring from here, leaving out the watcher's startup."""
+        self.sample()
+        self.cpu_baseline = sum(self.cpu_times.values())
+        self.rss_samples = []
+
+    def run(self) -> None:
+        while not self.done.wait(self.interval):
+            self.rss_samples.append(self.sample())
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.done.set()
+        self.thread.join()
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(self.cpu_times.values()) - self.cpu_baseline
+
+
+def get_fst_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        fst_version = version("fst")
+    except Exception:
+        fst_version = "unknown"
+    # builds from a checkout are told apart by their commit
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        return f"{fst_version}+{commit}"
+    except (OSError, subprocess.CalledProcessError):
+        return fst_version
+
+
+def get_dbt_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("dbt-core")
+    except Exception:
+        return "unknown"
+
+
+def wait_for_read_server(
+    address: str, authkey: bytes, process: subprocess.Popen, timeout: float
+) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"`fst start` exited with code {process.returncode} during startup."
+            )
+        try:
+            Client(address, authkey=authkey).close()
+            return
+        except (OSError, EOFError):
+            time.sleep(0.2)
+    raise TimeoutError(f"`fst start` didn't start its read server within {timeout} seconds.")
+
+
+def stop_watcher(process: subprocess.Popen, timeout: float = 30.0) -> None:
+    if process.poll() is not None:
+        return
+    # like Ctrl+C, so the watcher flushes its metrics on the way out
+    if os.name == "nt":
+        process.send_signal(signal.CTRL_BREAK_EVENT)
+    else:
+        os.killpg(process.pid, signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_edits(
+    client: ReadClient,
+    file_paths: List[str],
+    num_edits: int,
+    seed: int,
+    timeout: float,
+) -> List[Edit]:
+    """Append a comment to a model, wait for fst to record the iteration, repeat."""
+    rng = random.Random(seed)
+    last_seq = client.execute(
+        METRICS_DATABASE, "SELECT coalesce(max(seq), 0) AS seq FROM metrics"
+    ).to_pylist()[0]["seq"]
+    edits = []
+    for i in range(num_edits):
+        file_path = rng.choice(file_paths)
+        saved_at = time.time()
+        with open(file_path, "a") as file:
+            file.write(f"-- fst bench edit {i} {uuid.uuid4().hex}\n")
+        iteration_id = None
+        deadline = saved_at + timeout
+        while time.time() < deadline:
+            rows = client.execute(
+                METRICS_DATABASE,
+                """
+                SELECT iteration_id, seq FROM metrics
+                WHERE modified_sql_file = ? AND seq > ?
+                ORDER BY seq
+                LIMIT 1
+                """,
+                [file_path, last_seq],
+            ).to_pylist()
+            if rows:
+                iteration_id, last_seq = rows[0]["iteration_id"], rows[0]["seq"]
+                break
+            time.sleep(0.2)
+        if iteration_id is None:
+            logger.warning(
+                f"No iteration recorded for edit {i} of {file_path} within {timeout} seconds."
+            )
+        edits.append(Edit(file_path, saved_at, iteration_id))
+    return edits
+
+
+def get_edit_latencies(metrics_db_file: str, edits: List[Edit]) -> List[Dict[str, Any]]:
+    """Save-to-preview and save-to-recorded seconds of each edit, from the spans fst recorded."""
+    iteration_ids = [edit.iteration_id for edit in edits if edit.iteration_id]
+    if not iteration_ids:
+        return []
+    with duckdb.connect(metrics_db_file, read_only=True) as duckdb_conn:
+        rows = (
+            duckdb_conn.execute(
+                """
+                SELECT spans.iteration_id, spans.name, spans.start_time, spans.duration,
+                       metrics.dbt_build_status
+                FROM spans
+                JOIN metrics ON spans.iteration_id = metrics.iteration_id
+                WHERE spans.iteration_id IN (SELECT unnest(?::VARCHAR[]))
+                AND spans.name IN (?, ?)
+                """,
+                [iteration_ids, ITERATION_SPAN, PREVIEW_QUERY_SPAN],
+            )
+            .fetch_arrow_table()
+            .to_pylist()
+        )
+    ends: Dict[str, Dict[str, float]] = {}
+    statuses: Dict[str, str] = {}
+    for row in rows:
+        end = to_epoch_seconds(row["start_time"]) + (row["duration"] or 0.0)
+        # a preview rerun after the build replaces one that failed before it
+        iteration_ends = ends.setdefault(row["iteration_id"], {})
+        iteration_ends[row["name"]] = max(end, iteration_ends.get(row["name"], end))
+        statuses[row["iteration_id"]] = row["dbt_build_status"]
+
+    latencies = []
+    for edit in edits:
+        edit_ends = ends.get(edit.iteration_id)
+        if not edit_ends:
+            continue
+        latencies.append(
+            {
+                "status": statuses[edit.iteration_id],
+                "save_to_preview": edit_ends.get(PREVIEW_QUERY_SPAN, math.nan) - edit.saved_at,
+                "save_to_recorded": edit_ends.get(ITERATION_SPAN, math.nan) - edit.saved_at,
+            }
+        )
+    return latencies
+
+
+def summarize(values: List[float], prefix: str) -> Dict[str, Optional[float]]:
+    # edits whose preview never ran have no save-to-preview time
+    values = [value for value in values if not math.isnan(value)]
+    return {
+        f"p{pct}_{prefix}_s": percentile(values, pct) if values else None
+        for pct in (50, 95, 99)
+    }
+
+
+def run_suite(
+    project_dir: str,
+    file_paths: List[str],
+    num_edits: int = 20,
+    warmup_edits: int = 1,
+    dbt_runner: str = "auto",
+    seed: int = 42,
+    edit_timeout: float = BENCH_EDIT_TIMEOUT_SECONDS,
+) -> Dict[str, Any]:
+    """Run `fst start --no-workbench` on a project, edit its models and measure each save.
+
+    The watcher runs in its own process, exactly as `fst start` runs it, and is
+    sampled for CPU time and RSS while the edits run. Warmup edits (where the
+    in-process dbt runner loads dbt) are left out of the results.
+    """
+    project_dir = os.path.realpath(project_dir)
+    authkey = secrets.token_hex(16)
+    address = get_read_server_address(project_dir)
+    log_path = os.path.join(project_dir, "fst_bench_watcher.log")
+    logger.info(f"Starting `fst start` on {project_dir} (log: {log_path})")
+    # dbt can't build while fst holds the file, so everything is built before fst starts
+    subprocess.run(
+        ["dbt", "build", "--quiet"], cwd=project_dir, check=True, stdout=subprocess.DEVNULL
+    )
+    command = [
+        sys.executable,
+        "-m",
+        "fst",
+        "start",
+        "--no-workbench",
+        "--path",
+        project_dir,
+        "--dbt-runner",
+        dbt_runner,
+    ]
+    with open(log_path, "w") as log_file:
+        process = subprocess.Popen(
+            command,
+            cwd=project_dir,
+            env={**os.environ, READ_SERVER_AUTHKEY_ENV: authkey},
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            # lets stop_watcher interrupt fst and every process it started
+            start_new_session=os.name != "nt",
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == "nt" else 0,
+        )
+        sampler = ResourceSampler(process.pid)
+        try:
+            wait_for_read_server(
+                address, authkey.encode(), process, BENCH_STARTUP_TIMEOUT_SECONDS
+            )
+            client = ReadClient(address, authkey.encode())
+            # the observer starts right after the read server
+            time.sleep(1.0)
+            sampler.start()
+            run_edits(client, file_paths, warmup_edits, seed, edit_timeout)
+            sampler.reset()
+            started_at = time.time()
+            edits = run_edits(client, file_paths, num_edits, seed + 1, edit_timeout)
+            wall_seconds = time.time() - started_at
+        finally:
+            sampler.stop()
+            stop_watcher(process)
+
+    latencies = get_edit_latencies(os.path.join(project_dir, METRICS_DB_FILE), edits)
+    rss_samples = sampler.rss_samples or [0]
+    return {
+        "completed": len(latencies),
+        "missed": sum(1 for edit in edits if edit.iteration_id is None),
+        "failures": sum(1 for latency in latencies if latency["status"] != "success"),
+        **summarize([latency["save_to_preview"] for latency in latencies], "save_to_preview"),
+        **summarize([latency["save_to_recorded"] for latency in latencies], "save_to_recorded"),
+        "cpu_seconds": sampler.cpu_seconds,
+        "cpu_percent": sampler.cpu_seconds / wall_seconds * 100 if wall_seconds else None,
+        "peak_rss_mb": max(rss_samples) / 1024 / 1024,
+        "mean_rss_mb": sum(rss_samples) / len(rss_samples) / 1024 / 1024,
+    }
+
+
+def save_bench_run(results_db_file: str, run: Dict[str, Any]) -> None:
+    with duckdb.connect(results_db_file) as duckdb_conn:
+        duckdb_conn.execute(BENCH_RUNS_TABLE)
+        duckdb_conn.execute(
+            f"INSERT INTO bench_runs ({', '.join(run.keys())}) "
+            f"VALUES ({', '.join('?' for _ in run)})",
+            list(run.values()),
+        )
+
+
+def find_regressions(
+    results_db_file: str, run: Dict[str, Any], threshold: float = BENCH_REGRESSION_THRESHOLD
+) -> List[Dict[str, Any]]:
+    """Metrics of `run` more than `threshold` worse than the baseline run of its scenario.
+
+    The baseline is the latest earlier run of the same scenario on another fst
+    version, or the latest earlier run of the scenario when there is none.
+    """
+    with duckdb.connect(results_db_file) as duckdb_conn:
+        duckdb_conn.execute(BENCH_RUNS_TABLE)
+        baselines = (
+            duckdb_conn.execute(
+                f"""
+                SELECT fst_version, {', '.join(REGRESSION_METRICS)}
+                FROM bench_runs
+                WHERE scenario = ? AND run_id != ?
+                ORDER BY fst_version = ?, timestamp DESC
+                LIMIT 1
+                """,
+                [run["scenario"], run["run_id"], run["fst_version"]],
+            )
+            .fetch_arrow_table()
+            .to_pylist()
+        )
+    if not baselines:
+        return []
+    baseline = baselines[0]
+    regressions = []
+    for metric in REGRESSION_METRICS:
+        baseline_value, value = baseline[metric], run[metric]
+        if not baseline_value or value is None:
+            continue
+        change = (value - baseline_value) / baseline_value
+        if change > threshold:
+            regressions.append(
+                {
+                    "metric": metric,
+                    "baseline_version": baseline["fst_version"],
+                    "baseline": baseline_value,
+                    "current": value,
+                    "change_percent": change * 100,
+                }
+            )
+    return regressions
+
+
+def describe_run(
+    num_models: int,
+    depth: int,
+    rows_per_source: int,
+    num_edits: int,
+    dbt_runner: str,
+    results: Dict[str, Any],
+) -> Dict[str, Any]:
+    """A `bench_runs` row for the results of `run_suite`."""
+    return {
+        "run_id": uuid.uuid4().hex,
+        "timestamp": datetime.utcnow(),
+        "fst_version": get_fst_version(),
+        "dbt_version": get_dbt_version(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        # runs are only compared with runs of the same scenario
+        "scenario": f"models={num_models},depth={depth},rows={rows_per_source},runner={dbt_runner}",
+        "models": num_models,
+        "depth": depth,
+        "rows_per_source": rows_per_source,
+        "edits": num_edits,
+        "dbt_runner": dbt_runner,
+        **results,
+    }
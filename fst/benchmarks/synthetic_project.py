@@ -0,0 +1,156 @@
+import os
+import random
+from typing import Dict, List
+
+import duckdb
+import yaml
+
+SYNTHETIC_PROJECT_NAME = "fst_synthetic"
+SYNTHETIC_DB_FILE = "fst_synthetic.duckdb"
+SOURCE_SCHEMA = "raw"
+
+
+def get_level_sizes(num_models: int, depth: int) -> List[int]:
+    """Models per DAG level, spread as evenly as the model count allows."""
+    depth = max(1, min(depth, num_models))
+    return [
+        num_models // depth + (1 if level < num_models % depth else 0) for level in range(depth)
+    ]
+
+
+def write_yaml(file_path: str, content: Dict) -> None:
+    with open(file_path, "w") as file:
+        yaml.safe_dump(content, file, sort_keys=False)
+
+
+def create_sources(db_file: str, num_sources: int, rows_per_source: int) -> None:
+    with duckdb.connect(db_file) as duckdb_conn:
+        duckdb_conn.execute(f"CREATE SCHEMA IF NOT EXISTS {SOURCE_SCHEMA}")
+        for i in range(num_sources):
+            duckdb_conn.execute(
+                f"""
+                CREATE OR REPLACE TABLE {SOURCE_SCHEMA}.source_{i} AS
+                SELECT
+                    range AS id,
+                    range % 97 AS category_id,
+                    (hash(range + {i}) % 100000) / 100.0 AS amount,
+                    DATE '2020-01-01' + CAST(range % 1000 AS INTEGER) AS created_at
+                FROM range(?)
+                """,
+                [rows_per_source],
+            )
+
+
+def render_model(level: int, index: int, parents: List[str], source: str) -> str:
+    if level == 0:
+        return (
+            "select id, category_id, amount, created_at\n"
+            f"from {{{{ source('{SOURCE_SCHEMA}', '{source}') }}}}\n"
+            f"where amount >= {index % 10}\n"
+        )
+    first_parent, *other_parents = parents
+    joins = "".join(
+        f"left join {{{{ ref('{parent}') }}}} as p{i} on p0.id = p{i}.id\n"
+        for i, parent in enumerate(other_parents, start=1)
+    )
+    amount = " + ".join(
+        ["p0.amount", *(f"coalesce(p{i}.amount, 0)" for i in range(1, len(parents)))]
+    )
+    return (
+        f"select p0.id, p0.category_id, {amount} as amount, p0.created_at\n"
+        f"from {{{{ ref('{first_parent}') }}}} as p0\n"
+        f"{joins}"
+    )
+
+
+def generate_project(
+    project_dir: str,
+    num_models: int = 50,
+    depth: int = 5,
+    rows_per_source: int = 10_000,
+    num_sources: int = 3,
+    seed: int = 42,
+) -> List[str]:
+    """Write a DuckDB-backed dbt project and return the paths of its model files.
+
+    Models are laid out in `depth` levels. Level 0 selects from the sources, and every
+    model of a later level joins one or two models of the level before it, so an edit
+    rebuilds a realistic slice of the DAG. Every model has `unique` and `not_null`
+    tests on its id, so fst never has to generate tests of its own during a benchmark.
+    """
+    rng = random.Random(seed)
+    project_dir = os.path.realpath(project_dir)
+    models_dir = os.path.join(project_dir, "models")
+    os.makedirs(models_dir, exist_ok=True)
+
+    write_yaml(
+        os.path.join(project_dir, "dbt_project.yml"),
+        {
+            "name": SYNTHETIC_PROJECT_NAME,
+            "version": "1.0.0",
+            "config-version": 2,
+            "profile": SYNTHETIC_PROJECT_NAME,
+            "model-paths": ["models"],
+            "models": {SYNTHETIC_PROJECT_NAME: {"+materialized": "table"}},
+        },
+    )
+    db_file = os.path.join(project_dir, SYNTHETIC_DB_FILE)
+    write_yaml(
+        os.path.join(project_dir, "profiles.yml"),
+        {
+            SYNTHETIC_PROJECT_NAME: {
+                "target": "dev",
+                "outputs": {"dev": {"type": "duckdb", "path": db_file, "threads": 4}},
+            }
+        },
+    )
+
+    create_sources(db_file, num_sources, rows_per_source)
+    sources = [f"source_{i}" for i in range(num_sources)]
+    write_yaml(
+        os.path.join(models_dir, "sources.yml"),
+        {
+            "version": 2,
+            "sources": [
+                {
+                    "name": SOURCE_SCHEMA,
+                    "schema": SOURCE_SCHEMA,
+                    "tables": [{"name": source} for source in sources],
+                }
+            ],
+        },
+    )
+
+    file_paths = []
+    previous_level: List[str] = []
+    for level, level_size in enumerate(get_level_sizes(num_models, depth)):
+        level_dir = os.path.join(models_dir, f"level_{level}")
+        os.makedirs(level_dir, exist_ok=True)
+        level_models = []
+        for index in range(level_size):
+            model_name = f"level_{level}_model_{index}"
+            parents = (
+                rng.sample(previous_level, min(len(previous_level), rng.randint(1, 2)))
+                if previous_level
+                else []
+            )
+            file_path = os.path.join(level_dir, f"{model_name}.sql")
+            with open(file_path, "w") as file:
+                file.write(render_model(level, index, parents, sources[index % num_sources]))
+            file_paths.append(file_path)
+            level_models.append(model_name)
+        write_yaml(
+            os.path.join(level_dir, "schema.yml"),
+            {
+                "version": 2,
+                "models": [
+                    {
+                        "name": model_name,
+                        "columns": [{"name": "id", "tests": ["unique", "not_null"]}],
+                    }
+                    for model_name in level_models
+                ],
+            },
+        )
+        previous_level = level_models
+    return file_paths
@@ -0,0 +1,98 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+import psutil
+from watchdog.events import FileSystemEvent
+
+from fst.benchmarks import percentile
+from fst.directory_watcher import start_observer
+from fst.query_handler import DynamicQueryHandler
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyProbeHandler(DynamicQueryHandler):
+    """Records when `on_modified` fires instead of running dbt."""
+
+    def __init__(self, models_dir: str):
+        super().__init__(callback=lambda *args: None, models_dir=models_dir)
+        self.fired = threading.Event()
+        self.fired_at: Optional[float] = None
+        self.expected_path: Optional[str] = None
+
+    def on_modified(self, event: FileSystemEvent) -> None:
+        if event.src_path == self.expected_path and not self.fired.is_set():
+            self.fired_at = time.perf_counter()
+            self.fired.set()
+
+
+def create_dummy_models(models_dir: str, num_files: int) -> List[str]:
+    file_paths = []
+    for i in range(num_files):
+        # spread the files over subdirectories like a real project would
+        sub_dir = os.path.join(models_dir, f"folder_{i % 20}")
+        os.makedirs(sub_dir, exist_ok=True)
+        file_path = os.path.join(sub_dir, f"model_{i}.sql")
+        with open(file_path, "w") as file:
+            file.write(f"select {i} as id\n")
+        file_paths.append(file_path)
+    return file_paths
+
+
+def measure_watcher_latency(
+    backend: str,
+    num_files: int = 2000,
+    iterations: int = 20,
+    timeout: float = 10.0,
+    idle_seconds: float = 3.0,
+) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory(prefix="fst_watcher_bench_") as project_dir:
+        models_dir = os.path.join(project_dir, "models")
+        file_paths = create_dummy_models(models_dir, num_files)
+        handler = LatencyProbeHandler(models_dir)
+        observer = start_observer(handler, models_dir, backend)
+        process = psutil.Process()
+        try:
+            # let the observer take its initial snapshot before measuring
+            time.sleep(1.0)
+            cpu_start = sum(process.cpu_times()[:2])
+            time.sleep(idle_seconds)
+            idle_cpu_percent = (
+                (sum(process.cpu_times()[:2]) - cpu_start) / idle_seconds * 100
+            )
+
+            latencies = []
+            missed = 0
+            for i in range(iterations):
+                file_path = file_paths[(i * 7919) % len(file_paths)]
+                handler.fired.clear()
+                handler.expected_path = file_path
+                written_at = time.perf_counter()
+                with open(file_path, "a") as file:
+                    file.write(f"-- edit {i}\n")
+                if handler.fired.wait(timeout):
+                    latencies.append(handler.fired_at - written_at)
+                else:
+                    missed += 1
+        finally:
+            observer.stop()
+            observer.join()
+
+    latencies = latencies or [float("nan")]
+    return {
+        "backend": type(observer).__name__,
+        "files": num_files,
+        "iterations": iterations,
+        "missed": missed,
+        "min_ms": min(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "idle_cpu_percent": idle_cpu_percent,
+    }
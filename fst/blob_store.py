@@ -0,0 +1,41 @@
+import hashlib
+import zlib
+from typing import Any, Dict, Optional, Union
+
+SQL_MEDIA_TYPE = "text/sql"
+LOG_MEDIA_TYPE = "text/plain"
+JSON_MEDIA_TYPE = "application/json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+ZLIB_CODEC = "zlib"
+# payloads that are compressed already, like the zstd Arrow previews
+IDENTITY_CODEC = "identity"
+
+
+def hash_content(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_blob(content: Union[str, bytes], media_type: str) -> Dict[str, Any]:
+    """A `blobs` row for `content`, keyed by the hash of its uncompressed bytes."""
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    codec = IDENTITY_CODEC if media_type == ARROW_MEDIA_TYPE else ZLIB_CODEC
+    return {
+        "hash": hash_content(data),
+        "media_type": media_type,
+        "codec": codec,
+        "raw_size": len(data),
+        "content": zlib.compress(data) if codec == ZLIB_CODEC else data,
+    }
+
+
+def decode_blob(content: bytes, codec: str) -> bytes:
+    if codec == ZLIB_CODEC:
+        return zlib.decompress(content)
+    return bytes(content)
+
+
+def decode_text_blob(content: Optional[bytes], codec: str) -> Optional[str]:
+    if content is None:
+        return None
+    return decode_blob(content, codec).decode("utf-8")
@@ -0,0 +1,142 @@
+import logging
+import signal
+import subprocess
+import time
+from threading import Event, Lock, Timer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fst.file_utils import get_model_name_from_file
+from fst.spans import DEBOUNCE_SPAN, FILE_EVENT_SPAN, Trace
+
+logger = logging.getLogger(__name__)
+
+
+class BuildJob:
+    """One batch of modified files, pinned to the revision of each file it was started with."""
+
+    def __init__(self, revisions: Dict[str, int], is_latest: Callable[[str, int], bool]):
+        self.revisions = revisions
+        self.is_latest = is_latest
+        self.cancelled = Event()
+        self.lock = Lock()
+        self.process: Optional[subprocess.Popen] = None
+        self.trace = Trace()
+
+    @property
+    def file_paths(self) -> List[str]:
+        return list(self.revisions.keys())
+
+    def is_current(self, file_path: str) -> bool:
+        return not self.cancelled.is_set() and self.is_latest(
+            file_path, self.revisions[file_path]
+        )
+
+    def attach_process(self, process: Optional[subprocess.Popen]) -> None:
+        with self.lock:
+            self.process = process
+            if process is not None and self.cancelled.is_set():
+                terminate_process(process)
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancelled.set()
+            if self.process is not None:
+                terminate_process(self.process)
+
+
+def terminate_process(process: subprocess.Popen, timeout: float = 5.0) -> None:
+    if process.poll() is not None:
+        return
+    # SIGINT lets dbt cancel its open queries and release the database lock cleanly
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+class BuildQueue:
+    """Coalesces file saves into batches handed to `callback` as one `BuildJob`.
+
+    Every save restarts the window timer, and saves of the same model inside the
+    window collapse into one entry. Batches run one at a time: saves that arrive
+    while a batch is building are collected into the next one.
+
+    Every save also bumps the file's revision. An in-flight job holding an older
+    revision of the file is cancelled, and the other files of that job are put
+    back into the queue so they are rebuilt together with the new revision.
+    """
+
+    def __init__(self, callback: Callable[[BuildJob], None], window: float = 1.5):
+        self.callback = callback
+        self.window = window
+        self.pending: Dict[str, str] = {}
+        self.revisions: Dict[str, int] = {}
+        self.in_flight: Dict[str, BuildJob] = {}
+        self.lock = Lock()
+        self.build_lock = Lock()
+        self.timer: Optional[Timer] = None
+        # (saved at, detected at) of the latest save of each pending file
+        self.saves: Dict[str, Tuple[float, float]] = {}
+
+    def submit(self, file_path: str, saved_at: Optional[float] = None) -> None:
+        model_name = get_model_name_from_file(file_path)
+        detected_at = time.time()
+        with self.lock:
+            self.saves[file_path] = (min(saved_at or detected_at, detected_at), detected_at)
+            self.revisions[file_path] = self.revisions.get(file_path, 0) + 1
+            self.pending[model_name] = file_path
+            superseded_job = self.in_flight.get(file_path)
+            if superseded_job is not None:
+                self.cancel_job(superseded_job)
+            self.restart_timer()
+
+    def cancel_job(self, job: BuildJob) -> None:
+        logger.info(
+            f"Cancelling the in-flight build of {', '.join(job.file_paths)} for a newer save."
+        )
+        job.cancel()
+        for file_path in job.file_paths:
+            if self.in_flight.get(file_path) is job:
+                del self.in_flight[file_path]
+            self.pending.setdefault(get_model_name_from_file(file_path), file_path)
+
+    def restart_timer(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = Timer(self.window, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def is_latest(self, file_path: str, revision: int) -> bool:
+        with self.lock:
+            return self.revisions.get(file_path) == revision
+
+    def finish(self, job: BuildJob) -> None:
+        with self.lock:
+            for file_path in job.file_paths:
+                if self.in_flight.get(file_path) is job:
+                    del self.in_flight[file_path]
+
+    def flush(self) -> None:
+        with self.build_lock:
+            with self.lock:
+                batch = list(self.pending.values())
+                self.pending = {}
+                self.timer = None
+                if not batch:
+                    return
+                job = BuildJob(
+                    {file_path: self.revisions[file_path] for file_path in batch},
+                    self.is_latest,
+                )
+                flushed_at = time.time()
+                for file_path in batch:
+                    self.in_flight[file_path] = job
+                    # files put back by a cancelled job keep no save of their own
+                    if file_path in self.saves:
+                        saved_at, detected_at = self.saves.pop(file_path)
+                        job.trace.add(FILE_EVENT_SPAN, saved_at, detected_at, file_path=file_path)
+                        job.trace.add(DEBOUNCE_SPAN, detected_at, flushed_at, file_path=file_path)
+            logger.info(f"Coalesced {len(batch)} modified model(s) into one batch.")
+            self.callback(job)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import re
+import logging
+from threading import Lock
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SKIPPED_UNCHANGED_STATUS = "skipped: unchanged"
+
+SQL_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/|\{#.*?#\}", re.DOTALL)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_sql(query: str) -> str:
+    query = SQL_COMMENT_PATTERN.sub(" ", query)
+    return WHITESPACE_PATTERN.sub(" ", query).strip()
+
+
+class ContentHashCache:
+    """Persistent per-file content hashes used to skip saves that change nothing.
+
+    With `normalize=True`, comments and whitespace are ignored, so reformatting a
+    model or editing a comment doesn't trigger a rebuild either.
+    """
+
+    def __init__(self, cache_path: str, normalize: bool = False):
+        self.cache_path = cache_path
+        self.normalize = normalize
+        self.lock = Lock()
+        self.hashes: Dict[str, str] = self.load()
+
+    def load(self) -> Dict[str, str]:
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r") as file:
+                cache = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable content hash cache {self.cache_path}: {e}")
+            return {}
+        # hashes taken with a different normalization setting can't be compared
+        if cache.get("normalize") != self.normalize:
+            return {}
+        return cache.get("hashes", {})
+
+    def save(self) -> None:
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"normalize": self.normalize, "hashes": self.hashes}, file)
+        os.replace(temp_path, self.cache_path)
+
+    def compute_hash(self, file_path: str) -> Optional[str]:
+        try:
+            with open(file_path, "r") as file:
+                content = file.read()
+        except OSError:
+            return None
+        if self.normalize:
+            content = normalize_sql(content)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def has_changed(self, file_path: str) -> bool:
+        """Compare the file against its last seen hash and remember the new one."""
+        content_hash = self.compute_hash(file_path)
+        if content_hash is None:
+            return True
+        with self.lock:
+            if self.hashes.get(file_path) == content_hash:
+                return False
+            self.hashes[file_path] = content_hash
+            self.save()
+        return True
+
+    def forget(self, file_path: str) -> None:
+        """Drop a file's hash so its next save is rebuilt even if the content is identical."""
+        with self.lock:
+            if self.hashes.pop(file_path, None) is not None:
+                self.save()
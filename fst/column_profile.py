@@ -0,0 +1,144 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from fst.db_utils import QUERY_SUCCESS, run_bounded_query
+from fst.preview import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+# types DuckDB can't order, so min/max are skipped for them
+UNORDERED_TYPE_PREFIXES = ("STRUCT", "MAP", "UNION")
+PROFILE_TIMEOUT_SECONDS = 60.0
+# columns with more distinct values than this get no top values without approx_top_k
+TOP_K_MAX_DISTINCT = 10000
+
+
+def has_approx_top_k(db_file: str) -> bool:
+    result = run_bounded_query(
+        "SELECT 1 FROM duckdb_functions() WHERE function_name = 'approx_top_k' LIMIT 1",
+        db_file,
+    )
+    return result.table.num_rows > 0
+
+
+def is_unordered(column_type: str) -> bool:
+    return column_type.endswith("[]") or column_type.startswith(UNORDERED_TYPE_PREFIXES)
+
+
+def build_profile_query(
+    relation_name: str, columns: List[Dict[str, str]], top_k: Optional[int]
+) -> str:
+    """One aggregate over the relation computing every statistic of every column."""
+    select_list = ["count(*) AS row_count"]
+    for i, column in enumerate(columns):
+        name = quote_identifier(column["column_name"])
+        select_list.append(f"count(*) - count({name}) AS c{i}_null_count")
+        select_list.append(f"approx_count_distinct({name}) AS c{i}_approx_distinct")
+        if is_unordered(column["column_type"].upper()):
+            select_list.append(f"NULL::VARCHAR AS c{i}_min_value")
+            select_list.append(f"NULL::VARCHAR AS c{i}_max_value")
+        else:
+            select_list.append(f"min({name})::VARCHAR AS c{i}_min_value")
+            select_list.append(f"max({name})::VARCHAR AS c{i}_max_value")
+        if top_k:
+            select_list.append(f"approx_top_k({name}, {top_k})::VARCHAR[] AS c{i}_top_k")
+        else:
+            select_list.append(f"NULL::VARCHAR[] AS c{i}_top_k")
+    return f"SELECT {', '.join(select_list)} FROM {relation_name}"
+
+
+def build_top_k_query(relation_name: str, columns: Dict[int, str], top_k: int) -> str:
+    """Exact top-k values of the given columns (by index), from one histogram aggregate."""
+    histograms = ", ".join(
+        f"histogram({quote_identifier(name)}) AS c{i}_histogram" for i, name in columns.items()
+    )
+    # most frequent first, ties in value order
+    top_values = ", ".join(
+        f"""list_transform(
+            list_slice(
+                list_sort(
+                    list_transform(
+                        map_entries(c{i}_histogram),
+                        entry -> {{'frequency': -entry.value, 'value': entry.key::VARCHAR}}
+                    )
+                ),
+                1,
+                {top_k}
+            ),
+            entry -> entry.value
+        ) AS c{i}_top_k"""
+        for i in columns
+    )
+    return f"SELECT {top_values} FROM (SELECT {histograms} FROM {relation_name})"
+
+
+def get_top_k(
+    relation_name: str,
+    columns: List[Dict[str, str]],
+    stats: Dict[str, Any],
+    db_file: str,
+    top_k: int,
+) -> Dict[str, Any]:
+    """Top values of the columns with few enough distinct values, for DuckDBs without approx_top_k.
+
+    A histogram holds every distinct value, so columns past TOP_K_MAX_DISTINCT (ids,
+    hashes, timestamps) get no top values rather than a scan costing seconds each.
+    """
+    top_k_columns = {
+        i: column["column_name"]
+        for i, column in enumerate(columns)
+        if not is_unordered(column["column_type"].upper())
+        and stats[f"c{i}_approx_distinct"] <= TOP_K_MAX_DISTINCT
+    }
+    if not top_k_columns:
+        return {}
+    result = run_bounded_query(
+        build_top_k_query(relation_name, top_k_columns, top_k), db_file, PROFILE_TIMEOUT_SECONDS
+    )
+    if result.status != QUERY_SUCCESS:
+        logger.warning(f"Top values of {relation_name} timed out.")
+        return {}
+    return result.table.to_pylist()[0]
+
+
+def profile_relation(
+    relation_name: str, db_file: str, top_k: int = 5
+) -> List[Dict[str, Any]]:
+    """Null counts, approximate distinct counts, min/max and top-k values for every column, in one scan.
+
+    Without approx_top_k, the top values of low-cardinality columns take a second one.
+    """
+    describe = run_bounded_query(f"DESCRIBE SELECT * FROM {relation_name}", db_file)
+    columns = describe.table.select(["column_name", "column_type"]).to_pylist()
+    if not columns:
+        return []
+
+    approx_top_k = has_approx_top_k(db_file)
+    profile_query = build_profile_query(
+        relation_name, columns, top_k if approx_top_k else None
+    )
+    result = run_bounded_query(profile_query, db_file, PROFILE_TIMEOUT_SECONDS)
+    if result.table.num_rows == 0:
+        logger.warning(f"Column profile of {relation_name} timed out.")
+        return []
+
+    stats = result.table.to_pylist()[0]
+    if not approx_top_k:
+        stats.update(get_top_k(relation_name, columns, stats, db_file, top_k))
+    return [
+        {
+            "column_name": column["column_name"],
+            "column_type": column["column_type"],
+            "row_count": stats["row_count"],
+            "null_count": stats[f"c{i}_null_count"],
+            "approx_distinct": stats[f"c{i}_approx_distinct"],
+            "min_value": stats[f"c{i}_min_value"],
+            "max_value": stats[f"c{i}_max_value"],
+            # SQL NULL when there are no top values, not the JSON string 'null'
+            "top_k": json.dumps(stats[f"c{i}_top_k"])
+            if stats[f"c{i}_top_k"] is not None
+            else None,
+        }
+        for i, column in enumerate(columns)
+    ]
@@ -1,9 +1,74 @@
+import hashlib
 import os
+import tempfile
 import yaml
 
 CURRENT_WORKING_DIR = os.getcwd()
 
 # Load profiles.yml only once
 profiles_path = os.path.join(CURRENT_WORKING_DIR, "profiles.yml")
-with open(profiles_path, "r") as file:
-    PROFILES = yaml.safe_load(file)
\ No newline at end of file
+if os.path.exists(profiles_path):
+    with open(profiles_path, "r") as file:
+        PROFILES = yaml.safe_load(file)
+else:
+    # commands like `fst bench suite` don't run from inside a dbt project
+    PROFILES = {}
+
+CONTENT_HASH_CACHE_FILE = os.path.join(CURRENT_WORKING_DIR, "fst_content_hashes.json")
+
+METRICS_DB_FILE = "fst_metrics.duckdb"
+METRICS_FLUSH_INTERVAL_SECONDS = 0.5
+METRICS_FLUSH_BATCH_SIZE = 100
+METRICS_IDLE_CLOSE_SECONDS = 2.0
+METRICS_CLOSE_RETRIES = 10
+BLOB_CACHE_ENTRIES = 256
+WORKBENCH_CACHE_ENTRIES = 8
+
+
+def get_read_server_address(project_dir: str) -> str:
+    # one socket per project, outside the project so the path stays short enough for AF_UNIX
+    project_id = hashlib.sha1(project_dir.encode()).hexdigest()[:12]
+    if os.name == "nt":
+        return rf"\\.\pipe\fst-read-server-{project_id}"
+    return os.path.join(tempfile.gettempdir(), f"fst-{project_id}.sock")
+
+
+READ_SERVER_ADDRESS = get_read_server_address(CURRENT_WORKING_DIR)
+READ_SERVER_AUTHKEY_ENV = "FST_READ_SERVER_AUTHKEY"
+METRICS_ARCHIVE_DIR = "fst_metrics_archive"
+METRICS_RETENTION_DAYS = 30
+METRICS_COMPACTION_INTERVAL_SECONDS = 24 * 60 * 60
+
+# weight of the newest iteration in a model's EWMA baseline
+BASELINE_EWMA_ALPHA = 0.2
+REGRESSION_MIN_OBSERVATIONS = 5
+REGRESSION_Z_SCORE = 3.0
+# slowdowns smaller than this fraction of the baseline are never flagged
+REGRESSION_MIN_CHANGE = 0.2
+ROLLING_AVERAGE_ITERATIONS = 5
+
+# reads wait this long for a dbt invocation (e.g. a save's compile) to hand the target back
+TARGET_BUSY_WAIT_SECONDS = 10.0
+# DuckDB targets up to this size are copied after every build, for reads while dbt runs
+TARGET_SNAPSHOT_MAX_BYTES = 512 * 1024 * 1024
+# kept under the same file name, which DuckDB takes the catalog name from
+TARGET_SNAPSHOT_DIR = ".fst_snapshot"
+
+PREVIEW_CACHE_MAX_BYTES = 64 * 1024 * 1024
+PREVIEW_ROWS = 1000
+PREVIEW_LOG_ROWS = 5
+PREVIEW_TIMEOUT_SECONDS = 10.0
+PREVIEW_SEED = 42
+PREVIEW_SAMPLE_PERCENT = 10.0
+AD_HOC_PAGE_ROWS = 100
+AD_HOC_MAX_ROWS = 100_000
+AD_HOC_CACHE_MAX_BYTES = 128 * 1024 * 1024
+AD_HOC_CACHE_TTL_SECONDS = 300.0
+AD_HOC_DEBOUNCE_SECONDS = 0.75
+AD_HOC_POLL_SECONDS = 0.05
+
+BENCH_RESULTS_DB_FILE = "fst_bench_results.duckdb"
+BENCH_EDIT_TIMEOUT_SECONDS = 120.0
+BENCH_STARTUP_TIMEOUT_SECONDS = 60.0
+BENCH_SAMPLE_INTERVAL_SECONDS = 0.25
+BENCH_REGRESSION_THRESHOLD = 0.10
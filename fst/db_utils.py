@@ -1,23 +1,303 @@
+import os
+import shutil
+import struct
+import time
 import duckdb
+import pyarrow as pa
+from contextlib import contextmanager, nullcontext
 from functools import lru_cache
-from fst.config_defaults import PROFILES
+from threading import Condition, Event, RLock, Timer
+from fst.config_defaults import (
+    PROFILES,
+    PREVIEW_CACHE_MAX_BYTES,
+    PREVIEW_ROWS,
+    PREVIEW_TIMEOUT_SECONDS,
+    TARGET_BUSY_WAIT_SECONDS,
+    TARGET_SNAPSHOT_MAX_BYTES,
+    TARGET_SNAPSHOT_DIR,
+)
+from fst.result_cache import BoundedCache
+from fst.preview import PreviewStrategy, build_preview_query, build_schema_query
 import logging
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, ContextManager, Dict, Iterator, NamedTuple, Optional
 
 logger = logging.getLogger(__name__)
 
-@lru_cache(maxsize=128)
-def execute_query(query: str, db_file: str) -> Tuple[List[Tuple[Any]], List[str]]:
-    connection = duckdb.connect(database=db_file, read_only=False)
-    result = connection.execute(query).fetchmany(5)
-    column_names = [desc[0] for desc in connection.description]
-    connection.close()
-    return result, column_names
+QUERY_SUCCESS = "success"
+QUERY_TIMEOUT = "timeout"
+FETCH_CHUNK_ROWS = 100
+
+# DuckDB allows one writer per database file, so dbt and preview queries take turns
+target_lock = RLock()
+
+def target_write_lock() -> ContextManager:
+    if get_target_config().get("type") == "duckdb":
+        return target_lock
+    # warehouse targets take concurrent writers
+    return nullcontext()
+
+preview_cache = BoundedCache(
+    PREVIEW_CACHE_MAX_BYTES, sizeof=lambda result: result.table.nbytes
+)
+connections: Dict[str, duckdb.DuckDBPyConnection] = {}
+connections_lock = RLock()
+
+def get_data_version(db_file: str) -> Tuple[Any, ...]:
+    """Changes whenever anything writes to the database file or its write-ahead log."""
+    version = []
+    for path in [db_file, f"{db_file}.wal"]:
+        try:
+            stat = os.stat(path)
+            version.extend([stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            version.extend([None, None])
+    return tuple(version)
+
+# DuckDB files start with a checksum, these magic bytes and the storage format version
+STORAGE_MAGIC = b"DUCK"
+# the storage version of the pinned DuckDB 0.9, which reads no other
+STORAGE_VERSION = 64
+# the last release writing each older storage version
+STORAGE_RELEASES = {33: "0.4.0", 38: "0.5.1", 39: "0.6.1", 43: "0.7.1", 51: "0.8.1"}
+TARGET_STORAGE_REMEDY = (
+    "dbt recreates it: move {db_file} aside and rerun `dbt build` (or `fst start`)."
+)
+
+class StorageVersionError(Exception):
+    """The DuckDB file was written by a DuckDB release whose storage format this one can't read."""
+
+def get_storage_version(db_file: str) -> Optional[int]:
+    try:
+        with open(db_file, "rb") as file:
+            header = file.read(20)
+    except FileNotFoundError:
+        return None
+    if len(header) < 20 or header[8:12] != STORAGE_MAGIC:
+        # empty, or not a database DuckDB can tell us anything useful about
+        return None
+    return struct.unpack("<Q", header[12:20])[0]
+
+def check_storage_version(db_file: str, remedy: str) -> None:
+    """Fail with `remedy` rather than DuckDB's serialization error for a file in another format.
+
+    `remedy` may refer to {db_file} and to {release}, the DuckDB release that reads the file.
+    """
+    version = get_storage_version(db_file)
+    if version is None or version == STORAGE_VERSION:
+        return
+    if version > STORAGE_VERSION:
+        raise StorageVersionError(
+            f"{db_file} was written by a DuckDB newer than {duckdb.__version__} "
+            f"(storage version {version}), upgrade fst to read it."
+        )
+    release = next(
+        (STORAGE_RELEASES[known] for known in sorted(STORAGE_RELEASES) if known >= version),
+        STORAGE_RELEASES[max(STORAGE_RELEASES)],
+    )
+    raise StorageVersionError(
+        f"{db_file} was written by DuckDB {release} or older (storage version {version}), "
+        f"which DuckDB {duckdb.__version__} can't read. "
+        + remedy.format(db_file=db_file, release=release)
+    )
+
+# dbt invocations that currently have the DuckDB file to themselves
+dbt_invocations = 0
+dbt_finished = Condition(connections_lock)
+
+class TargetBusyError(Exception):
+    """dbt has the DuckDB file, so it can't be read until the invocation finishes."""
+
+def get_snapshot_path(db_file: str) -> str:
+    directory, file_name = os.path.split(os.path.abspath(db_file))
+    return os.path.join(directory, TARGET_SNAPSHOT_DIR, file_name)
+
+def refresh_target_snapshot(db_file: str) -> None:
+    """Copy the DuckDB file for reads to use while dbt has it.
+
+    Called between dbt invocations, under the target lock. Files over
+    TARGET_SNAPSHOT_MAX_BYTES aren't copied, and reads wait for dbt instead.
+    """
+    snapshot_path = get_snapshot_path(db_file)
+    with connections_lock:
+        snapshot = connections.pop(snapshot_path, None)
+        if snapshot is not None:
+            snapshot.close()
+        if not os.path.exists(db_file) or os.path.getsize(db_file) > TARGET_SNAPSHOT_MAX_BYTES:
+            for path in [snapshot_path, f"{snapshot_path}.wal"]:
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        # with our connection open (and the lock held), nothing checkpoints the
+        # write-ahead log between copying it and the file
+        get_connection(db_file)
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        for source, destination in [(db_file, snapshot_path), (f"{db_file}.wal", f"{snapshot_path}.wal")]:
+            if os.path.exists(source):
+                shutil.copyfile(source, f"{destination}.tmp")
+                os.replace(f"{destination}.tmp", destination)
+            elif os.path.exists(destination):
+                os.remove(destination)
+
+def snapshot_target() -> None:
+    """Refresh the snapshot of a DuckDB target, for reads made during the next dbt invocation."""
+    if get_target_config().get("type") == "duckdb":
+        refresh_target_snapshot(get_duckdb_file_path())
+
+def get_snapshot_connection(db_file: str) -> Optional[duckdb.DuckDBPyConnection]:
+    snapshot_path = get_snapshot_path(db_file)
+    if snapshot_path not in connections:
+        if not os.path.exists(snapshot_path):
+            return None
+        connections[snapshot_path] = duckdb.connect(database=snapshot_path, read_only=True)
+    return connections[snapshot_path]
+
+def get_connection(db_file: str) -> duckdb.DuckDBPyConnection:
+    """A cursor onto the DuckDB file, or onto its snapshot from the last build while dbt has it.
+
+    Without a snapshot, the read waits up to TARGET_BUSY_WAIT_SECONDS for dbt to
+    finish (long enough for a save's compile) before giving up with TargetBusyError.
+    """
+    with connections_lock:
+        if db_file not in connections and dbt_invocations:
+            snapshot = get_snapshot_connection(db_file)
+            if snapshot is not None:
+                return snapshot.cursor()
+            if not dbt_finished.wait_for(lambda: not dbt_invocations, TARGET_BUSY_WAIT_SECONDS):
+                raise TargetBusyError(f"dbt is writing to {db_file}, try again once it's done.")
+        if db_file not in connections:
+            check_storage_version(db_file, TARGET_STORAGE_REMEDY)
+            connections[db_file] = duckdb.connect(database=db_file, read_only=False)
+        # a cursor is a thread-safe handle onto the shared database instance
+        return connections[db_file].cursor()
+
+def release_connections() -> None:
+    """Close cached connections so another process (e.g. dbt) can take the DuckDB file lock."""
+    with connections_lock:
+        for connection in connections.values():
+            connection.close()
+        connections.clear()
+
+@contextmanager
+def hand_target_to_dbt() -> Iterator[None]:
+    """Close cached connections and keep the DuckDB file closed while dbt runs.
+
+    Reads that come in meanwhile go to the snapshot of the last build, or wait for
+    the invocation, instead of reopening the file under dbt.
+    """
+    global dbt_invocations
+    with connections_lock:
+        release_connections()
+        dbt_invocations += 1
+    try:
+        yield
+    finally:
+        with connections_lock:
+            dbt_invocations -= 1
+            dbt_finished.notify_all()
+
+class QueryResult(NamedTuple):
+    table: pa.Table
+    status: str
+    elapsed: float
+    strategy: Optional[str] = None
+
+    @property
+    def column_names(self) -> List[str]:
+        return self.table.column_names
+
+def run_bounded_query(
+    query: str, db_file: str, timeout: Optional[float] = None
+) -> QueryResult:
+    """Run `query` into an Arrow table, interrupting it once `timeout` seconds have passed.
+
+    On timeout the record batches fetched so far are returned with status "timeout".
+    """
+    start_time = time.time()
+    batches: List[pa.RecordBatch] = []
+    timed_out = Event()
+    # the lock only guards handing out the cursor, other reads run alongside this one
+    connection = get_connection(db_file)
+
+    def interrupt() -> None:
+        timed_out.set()
+        try:
+            connection.interrupt()
+        except duckdb.Error:
+            # the query finished and closed its cursor just as the deadline passed
+            pass
+
+    deadline = None
+    if timeout is not None:
+        deadline = Timer(timeout, interrupt)
+        deadline.daemon = True
+        deadline.start()
+    schema = None
+    try:
+        reader = connection.execute(query).fetch_record_batch(FETCH_CHUNK_ROWS)
+        schema = reader.schema
+        status = QUERY_SUCCESS
+        for batch in reader:
+            batches.append(batch)
+            # an interrupt that came between two batches doesn't raise
+            if timed_out.is_set():
+                status = QUERY_TIMEOUT
+                break
+    except (duckdb.InterruptException, pa.ArrowException, duckdb.Error):
+        if not timed_out.is_set():
+            raise
+        status = QUERY_TIMEOUT
+    finally:
+        if deadline is not None:
+            deadline.cancel()
+        connection.close()
+
+    if schema is None:
+        table = pa.table({})
+    else:
+        table = pa.Table.from_batches(batches, schema=schema)
+    return QueryResult(table, status, time.time() - start_time)
+
+def execute_query(
+    query: str,
+    db_file: str,
+    limit: int = PREVIEW_ROWS,
+    timeout: Optional[float] = PREVIEW_TIMEOUT_SECONDS,
+    strategy: PreviewStrategy = PreviewStrategy(),
+) -> QueryResult:
+    # a rebuilt model keeps its SQL, so the data version has to be part of the key
+    cache_key = (query, db_file, limit, strategy, get_data_version(db_file))
+    cached_result = preview_cache.get(cache_key)
+    if cached_result is not None:
+        return cached_result
+
+    if strategy.name == "stratified" and strategy.key_column not in describe_query(
+        query, db_file, timeout
+    ):
+        logger.info(
+            f"Preview has no `{strategy.key_column}` column to stratify by, sampling instead."
+        )
+        strategy = strategy._replace(name="reservoir")
+    result = run_bounded_query(
+        build_preview_query(query, limit, strategy), db_file, timeout
+    )._replace(strategy=strategy.describe())
+    # a timed out preview should be retried next time, not served from the cache
+    if result.status == QUERY_SUCCESS:
+        preview_cache.put(cache_key, result)
+    return result
+
+def describe_query(
+    query: str, db_file: str, timeout: Optional[float] = PREVIEW_TIMEOUT_SECONDS
+) -> List[str]:
+    return run_bounded_query(build_schema_query(query), db_file, timeout).column_names
+
+@lru_cache(maxsize=1)
+def get_target_config() -> Dict[str, Any]:
+    profile = PROFILES[get_project_name()]
+    return profile["outputs"][profile["target"]]
 
 @lru_cache(maxsize=1)
 def get_duckdb_file_path() -> str:
-    target = PROFILES["jaffle_shop"]["target"]
-    db_path = PROFILES["jaffle_shop"]["outputs"][target]["path"]
+    db_path = get_target_config()["path"]
     return db_path
 
 @lru_cache(maxsize=1)
@@ -0,0 +1,259 @@
+import json
+import os
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fst.config_defaults import CURRENT_WORKING_DIR
+from fst.spans import TESTS_SPAN
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET_DIR = "target"
+# footprint of a selection the manifest can't resolve; conflicts with every other job
+ALL_NODES = "*"
+
+cached_manifest: Optional[Dict[str, Any]] = None
+cached_manifest_mtime: Optional[float] = None
+
+
+def get_target_path(file_name: str, target_dir: str = DEFAULT_TARGET_DIR) -> str:
+    return os.path.join(CURRENT_WORKING_DIR, target_dir, file_name)
+
+
+def get_worker_target_dir(worker_slot: Optional[int]) -> str:
+    # concurrent dbt invocations would overwrite each other's artifacts in one target path
+    if not worker_slot:
+        return DEFAULT_TARGET_DIR
+    return os.path.join(DEFAULT_TARGET_DIR, f"fst_worker_{worker_slot}")
+
+
+def load_artifact(
+    file_name: str,
+    newer_than: Optional[float] = None,
+    target_dir: str = DEFAULT_TARGET_DIR,
+) -> Optional[Dict[str, Any]]:
+    artifact_path = get_target_path(file_name, target_dir)
+    if not os.path.exists(artifact_path):
+        return None
+    # dbt leaves the previous artifact in place when it fails before writing a new one
+    if newer_than is not None and os.path.getmtime(artifact_path) < newer_than:
+        return None
+    with open(artifact_path, "r") as file:
+        return json.load(file)
+
+
+def find_node_id_for_file(manifest: Dict[str, Any], file_path: str) -> Optional[str]:
+    relative_file_path = os.path.relpath(file_path, CURRENT_WORKING_DIR)
+    for unique_id, node in manifest.get("nodes", {}).items():
+        if node.get("resource_type") == "model" and os.path.normpath(
+            node.get("original_file_path", "")
+        ) == os.path.normpath(relative_file_path):
+            return unique_id
+    return None
+
+
+def load_manifest() -> Optional[Dict[str, Any]]:
+    """The last manifest.json in the default target path, re-read only when it changes."""
+    global cached_manifest, cached_manifest_mtime
+    manifest_path = get_target_path("manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    mtime = os.path.getmtime(manifest_path)
+    if mtime != cached_manifest_mtime:
+        try:
+            cached_manifest = load_artifact("manifest.json")
+            cached_manifest_mtime = mtime
+        except ValueError:
+            # dbt is still writing it
+            return cached_manifest
+    return cached_manifest
+
+
+def get_selection_footprint(file_paths: List[str]) -> Tuple[Set[str], Set[str]]:
+    """Nodes a `dbt build` of `file_paths` writes (models and their tests) and reads (ancestors)."""
+    manifest = load_manifest()
+    if manifest is None:
+        return {ALL_NODES}, set()
+    parent_map = manifest.get("parent_map", {})
+    child_map = manifest.get("child_map", {})
+
+    writes = set()
+    for file_path in file_paths:
+        model_id = find_node_id_for_file(manifest, file_path)
+        if model_id is None:
+            # a new model isn't in the manifest yet, so its dependencies are unknown
+            return {ALL_NODES}, set()
+        writes.add(model_id)
+        writes.update(
+            child_id for child_id in child_map.get(model_id, []) if child_id.startswith("test.")
+        )
+
+    reads = set()
+    stack = [parent_id for node_id in writes for parent_id in parent_map.get(node_id, [])]
+    while stack:
+        node_id = stack.pop()
+        if node_id not in reads:
+            reads.add(node_id)
+            stack.extend(parent_map.get(node_id, []))
+    return writes, reads - writes
+
+
+def split_node_results_by_file(
+    file_paths: List[str],
+    node_results: Dict[str, Dict[str, Any]],
+    succeeded: bool,
+    wall_time: float,
+    invoked_at: float,
+    target_dir: str = DEFAULT_TARGET_DIR,
+) -> Dict[str, Dict[str, Any]]:
+    """Split one `dbt build` invocation back into a result per modified file.
+
+    `node_results` come from the structured events dbt streamed during the
+    build; run_results.json is only read when there are none. Each file gets
+    the status of its model and the tests attached to it, and a build time made
+    of its own node timings plus an equal share of the time dbt spent outside of
+    nodes (startup, parse, compile of the whole selection).
+    """
+    run_results = load_artifact("run_results.json", invoked_at, target_dir)
+    if not node_results:
+        if run_results is not None:
+            node_results = {
+                result["unique_id"]: {
+                    "resource_type": result["unique_id"].split(".")[0],
+                    "status": result["status"],
+                    "execution_time": result.get("execution_time", 0.0),
+                }
+                for result in run_results["results"]
+            }
+    manifest = load_artifact("manifest.json", invoked_at, target_dir) or load_manifest()
+    fallback = {
+        "status": "success" if succeeded else "failure",
+        "tests_ran": False,
+        "build_time": wall_time / max(len(file_paths), 1),
+        "node_timings": [],
+        "node_spans": [],
+        "relation_name": None,
+    }
+    if not node_results or manifest is None:
+        return {file_path: dict(fallback) for file_path in file_paths}
+
+    child_map = manifest.get("child_map", {})
+    node_time = sum(result.get("execution_time", 0.0) for result in node_results.values())
+    overhead_share = max(wall_time - node_time, 0.0) / max(len(file_paths), 1)
+
+    split_results = {}
+    for file_path in file_paths:
+        model_id = find_node_id_for_file(manifest, file_path)
+        model_result = node_results.get(model_id)
+        if model_result is None:
+            split_results[file_path] = dict(fallback)
+            continue
+        test_results = [
+            node_results[child_id]
+            for child_id in child_map.get(model_id, [])
+            if child_id in node_results and node_results[child_id]["resource_type"] == "test"
+        ]
+        failed = model_result["status"] != "success" or any(
+            result["status"] in ("fail", "error") for result in test_results
+        )
+        split_results[file_path] = {
+            "status": "failure" if failed else "success",
+            "tests_ran": len(test_results) > 0,
+            "build_time": model_result.get("execution_time", 0.0)
+            + sum(result.get("execution_time", 0.0) for result in test_results)
+            + overhead_share,
+            "node_timings": get_node_timings(
+                run_results, [model_id, *child_map.get(model_id, [])]
+            ),
+            "node_spans": get_node_spans(
+                run_results, [model_id, *child_map.get(model_id, [])]
+            ),
+            "relation_name": manifest["nodes"][model_id].get("relation_name"),
+        }
+    return split_results
+
+
+def get_timing_seconds(result: Dict[str, Any], step: str) -> Optional[float]:
+    for timing in result.get("timing", []):
+        if timing.get("name") == step and timing.get("started_at") and timing.get("completed_at"):
+            started_at = datetime.fromisoformat(timing["started_at"].rstrip("Z"))
+            completed_at = datetime.fromisoformat(timing["completed_at"].rstrip("Z"))
+            return (completed_at - started_at).total_seconds()
+    return None
+
+
+def parse_timing_time(timestamp: str) -> float:
+    # run_results.json times are UTC
+    return (
+        datetime.fromisoformat(timestamp.rstrip("Z"))
+        .replace(tzinfo=timezone.utc)
+        .timestamp()
+    )
+
+
+def get_node_spans(
+    run_results: Optional[Dict[str, Any]], unique_ids: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """Compile and execute steps of the nodes in run_results.json, with a single span per test."""
+    if run_results is None:
+        return []
+    node_spans = []
+    for result in run_results.get("results", []):
+        unique_id = result["unique_id"]
+        if unique_ids is not None and unique_id not in unique_ids:
+            continue
+        steps = [
+            (
+                timing["name"],
+                parse_timing_time(timing["started_at"]),
+                parse_timing_time(timing["completed_at"]),
+            )
+            for timing in result.get("timing", [])
+            if timing.get("started_at") and timing.get("completed_at")
+        ]
+        if not steps:
+            continue
+        if unique_id.startswith("test."):
+            steps = [(TESTS_SPAN, steps[0][1], steps[-1][2])]
+        for name, start_time, end_time in steps:
+            node_spans.append(
+                {
+                    "name": name,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "unique_id": unique_id,
+                }
+            )
+    return node_spans
+
+
+def get_node_timings(
+    run_results: Optional[Dict[str, Any]], unique_ids: List[str]
+) -> List[Dict[str, Any]]:
+    """Rows for the `node_timings` table from run_results.json, one per node in `unique_ids`."""
+    if run_results is None:
+        return []
+    invocation_id = run_results.get("metadata", {}).get("invocation_id")
+    node_timings = []
+    for result in run_results.get("results", []):
+        if result["unique_id"] not in unique_ids:
+            continue
+        adapter_response = result.get("adapter_response") or {}
+        node_timings.append(
+            {
+                "invocation_id": invocation_id,
+                "unique_id": result["unique_id"],
+                "resource_type": result["unique_id"].split(".")[0],
+                "status": result.get("status"),
+                "thread_id": result.get("thread_id"),
+                "execution_time": result.get("execution_time"),
+                "compile_time": get_timing_seconds(result, "compile"),
+                "execute_time": get_timing_seconds(result, "execute"),
+                "rows_affected": adapter_response.get("rows_affected"),
+                "failures": result.get("failures"),
+                "adapter_response": json.dumps(adapter_response),
+                "message": result.get("message"),
+            }
+        )
+    return node_timings
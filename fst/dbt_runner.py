@@ -0,0 +1,377 @@
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from fst.db_utils import hand_target_to_dbt
+from fst.spans import DBT_STARTUP_SPAN, PARSE_SPAN
+
+logger = logging.getLogger(__name__)
+dbt_logger = logging.getLogger("dbt")
+
+DBT_RUNNER_MODES = ["auto", "inprocess", "subprocess"]
+
+LOG_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warn": logging.WARNING,
+    "error": logging.ERROR,
+}
+# info-level events dbt fires once per finished node
+NODE_RESULT_EVENTS = {
+    "LogModelResult",
+    "LogTestResult",
+    "LogSeedResult",
+    "LogSnapshotResult",
+    "LogNodeResult",
+    "SkippingDetails",
+}
+# fired once the project is parsed ("Found 5 models, 20 tests, ...")
+PARSE_FINISHED_EVENT = "FoundStats"
+# files dbt reads when it parses a project, besides the ones under its search paths
+PROJECT_FILES = ("dbt_project.yml", "packages.yml", "dependencies.yml")
+PROJECT_SEARCH_DIRS = ("models", "macros", "seeds", "snapshots", "tests", "analyses")
+PARSED_FILE_EXTENSIONS = (".sql", ".py", ".yml", ".yaml", ".csv", ".md")
+# what dbt says when a node refs something its parsed dependencies don't include
+STALE_MANIFEST_MESSAGE = "unable to infer all dependencies"
+JINJA_BLOCK = re.compile(r"{{.*?}}|{%.*?%}", re.DOTALL)
+
+
+class DbtResult(NamedTuple):
+    returncode: int
+    stdout: str
+    events: List[Dict[str, Any]] = []
+    # (name, start, end) of the stages dbt goes through before it runs nodes
+    phases: List[Tuple[str, float, float]] = []
+
+    @property
+    def node_results(self) -> Dict[str, Dict[str, Any]]:
+        return get_node_results(self.events)
+
+
+def get_node_results(events: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Status, resource type and execution time of every node, keyed by unique id."""
+    node_results = {}
+    for event in events:
+        if event.get("info", {}).get("name") not in NODE_RESULT_EVENTS:
+            continue
+        data = event.get("data", {})
+        node_info = data.get("node_info", {})
+        unique_id = node_info.get("unique_id")
+        if not unique_id:
+            continue
+        # node_status matches run_results.json ("success", "pass", "fail", ...), while
+        # the event's own status is the adapter's message, e.g. "OK" or "CREATE TABLE"
+        if event["info"]["name"] == "SkippingDetails":
+            status = "skipped"
+        else:
+            status = str(node_info.get("node_status", "")).lower()
+        node_results[unique_id] = {
+            "resource_type": node_info.get("resource_type", unique_id.split(".")[0]),
+            "status": status,
+            "message": data.get("status"),
+            "execution_time": data.get("execution_time", 0.0),
+        }
+    return node_results
+
+
+def get_event_time(event: Dict[str, Any]) -> Optional[float]:
+    timestamp = event.get("info", {}).get("ts")
+    if not timestamp:
+        return None
+    try:
+        # dbt writes UTC timestamps like 2023-04-12T18:30:15.123456Z
+        return (
+            datetime.fromisoformat(timestamp.rstrip("Z")[:26])
+            .replace(tzinfo=timezone.utc)
+            .timestamp()
+        )
+    except ValueError:
+        return None
+
+
+def get_phases(
+    events: List[Dict[str, Any]], started_at: float, parsed: bool = False
+) -> List[Tuple[str, float, float]]:
+    """Startup (until dbt's first event) and, unless `parsed` already, parse (until FoundStats)."""
+    event_times = []
+    for event in events:
+        event_time = get_event_time(event)
+        if event_time is not None:
+            event_times.append((event["info"].get("name"), event_time))
+    if not event_times:
+        return []
+    first_event_at = event_times[0][1]
+    phases = [(DBT_STARTUP_SPAN, started_at, max(first_event_at, started_at))]
+    parse_finished_at = next(
+        (event_time for name, event_time in event_times if name == PARSE_FINISHED_EVENT), None
+    )
+    if not parsed and parse_finished_at is not None:
+        phases.append((PARSE_SPAN, max(first_event_at, started_at), parse_finished_at))
+    return phases
+
+
+class EventStream:
+    """Collects structured dbt events and forwards their messages to the logger as they arrive."""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.lines: List[str] = []
+        self.started_at = time.time()
+        self.phases: List[Tuple[str, float, float]] = []
+        # whether the parse (if any) is already in `phases` rather than inside the command
+        self.parsed = False
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        info = event.get("info", {})
+        level = info.get("level", "info")
+        if level == "debug":
+            return
+        message = info.get("msg", "")
+        self.events.append(event)
+        self.lines.append(message)
+        dbt_logger.log(LOG_LEVELS.get(level, logging.INFO), message)
+
+    def add_line(self, line: str) -> None:
+        line = line.rstrip("\n")
+        if not line:
+            return
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # tracebacks and anything else dbt prints before its logger is set up
+            self.lines.append(line)
+            dbt_logger.info(line)
+            return
+        if isinstance(event, dict):
+            self.add_event(event)
+
+    def result(self, returncode: int) -> DbtResult:
+        phases = self.phases + get_phases(self.events, self.started_at, self.parsed)
+        return DbtResult(returncode, "\n".join(self.lines), self.events, phases)
+
+
+class SubprocessDbtRunner:
+    """Runs every dbt command in a fresh `dbt` process, streaming its JSON logs."""
+
+    mode = "subprocess"
+
+    def invoke(self, args: List[str], job: Optional[Any] = None) -> DbtResult:
+        stream = EventStream()
+        process = subprocess.Popen(
+            ["dbt", "--log-format", "json", *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        if job is not None:
+            # lets a newer save terminate this build
+            job.attach_process(process)
+        for line in process.stdout:
+            stream.add_line(line)
+        process.wait()
+        if job is not None:
+            job.attach_process(None)
+        return stream.result(process.returncode)
+
+
+def get_parsed_files(manifest: Any) -> Dict[str, Any]:
+    """The files a manifest was parsed from, keyed by absolute path."""
+    return {
+        source_file.path.absolute_path: source_file
+        for source_file in manifest.files.values()
+        if hasattr(source_file.path, "project_root")
+    }
+
+
+def stat_project_files(parsed_files: Dict[str, Any]) -> Dict[str, Tuple[int, int]]:
+    """(mtime, size) of every file dbt would parse, including files added since the parse."""
+    project_roots = {source_file.path.project_root for source_file in parsed_files.values()}
+    search_dirs = {
+        os.path.join(source_file.path.project_root, source_file.path.searched_path)
+        for source_file in parsed_files.values()
+    }
+    search_dirs.update(
+        os.path.join(project_root, search_dir)
+        for project_root in project_roots
+        for search_dir in PROJECT_SEARCH_DIRS
+    )
+    paths = [
+        os.path.join(project_root, file_name)
+        for project_root in project_roots
+        for file_name in PROJECT_FILES
+    ]
+    for search_dir in search_dirs:
+        for root, _, file_names in os.walk(search_dir):
+            paths.extend(
+                os.path.join(root, file_name)
+                for file_name in file_names
+                if file_name.endswith(PARSED_FILE_EXTENSIONS)
+            )
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats[os.path.abspath(path)] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+class InProcessDbtRunner:
+    """Keeps dbt and the adapter imported in the watcher process between invocations.
+
+    The project is parsed once and the manifest is handed to every command, so the
+    interpreter startup, adapter import and project parse are only paid once per
+    `fst start`. Saves that only change the SQL around a model's Jinja are patched
+    into the manifest; any other change to the project's files (a new ref(), a
+    schema file, a macro, a new model) re-parses it, partially against dbt's state
+    from the previous parse. So does dbt reporting a ref the manifest doesn't know.
+    """
+
+    mode = "inprocess"
+
+    def __init__(self):
+        from dbt.cli.main import dbtRunner
+        from dbt.contracts.files import FileHash
+
+        try:
+            from dbt.events.functions import msg_to_dict
+        except ImportError:
+            # dbt>=1.8 moved the event helpers to dbt-common
+            from dbt_common.events.functions import msg_to_dict
+
+        self.dbt_runner_class = dbtRunner
+        self.file_hash_class = FileHash
+        self.msg_to_dict = msg_to_dict
+        # dbt keeps global invocation state, so only one command may run at a time
+        self.lock = Lock()
+        self.manifest: Optional[Any] = None
+        # (mtime, size) of the project's files as the manifest has them
+        self.file_stats: Dict[str, Tuple[int, int]] = {}
+
+    def parse(self) -> None:
+        parse_result = self.dbt_runner_class().invoke(["--quiet", "parse"])
+        if parse_result.success:
+            self.manifest = parse_result.result
+            self.file_stats = stat_project_files(get_parsed_files(self.manifest))
+        else:
+            # fall back to letting the command parse on its own
+            self.manifest = None
+            self.file_stats = {}
+
+    def patch_model(self, source_file: Any, path: str) -> bool:
+        """Put a model's new SQL into the manifest, if it calls the same Jinja as before."""
+        if source_file is None or not path.endswith(".sql") or len(source_file.nodes) != 1:
+            return False
+        node = self.manifest.nodes.get(source_file.nodes[0])
+        if node is None or node.resource_type != "model":
+            return False
+        try:
+            with open(path, "r") as file:
+                raw_code = file.read()
+        except OSError:
+            return False
+        # refs, sources and configs are only known after a parse
+        if JINJA_BLOCK.findall(raw_code) != JINJA_BLOCK.findall(node.raw_code):
+            return False
+        node.raw_code = raw_code
+        node.checksum = self.file_hash_class.from_contents(raw_code)
+        source_file.contents = raw_code
+        source_file.checksum = node.checksum
+        return True
+
+    def is_manifest_current(self) -> bool:
+        """Bring the manifest up to date with the project's files without a parse, if possible."""
+        if self.manifest is None:
+            return False
+        parsed_files = get_parsed_files(self.manifest)
+        file_stats = stat_project_files(parsed_files)
+        changed_paths = {
+            path
+            for path in file_stats.keys() | self.file_stats.keys()
+            if file_stats.get(path) != self.file_stats.get(path)
+        }
+        for path in changed_paths:
+            if path not in file_stats or not self.patch_model(parsed_files.get(path), path):
+                return False
+            self.file_stats[path] = file_stats[path]
+        return True
+
+    def run(self, args: List[str], parse: bool) -> Tuple[Any, EventStream]:
+        stream = EventStream()
+        # a parse only happens here, never inside the command
+        stream.parsed = True
+        if parse:
+            parse_started_at = time.time()
+            self.parse()
+            stream.phases.append((PARSE_SPAN, parse_started_at, time.time()))
+
+        def capture_event(event: Any) -> None:
+            stream.add_event(self.msg_to_dict(event))
+
+        # startup is what's left between here and dbt's first event
+        stream.started_at = time.time()
+        runner = self.dbt_runner_class(manifest=self.manifest, callbacks=[capture_event])
+        return runner.invoke(["--quiet", *args]), stream
+
+    def invoke(self, args: List[str], job: Optional[Any] = None) -> DbtResult:
+        # dbt can't be interrupted mid-command in-process, so a cancelled job's
+        # result is discarded by the caller instead
+        with self.lock:
+            stream = EventStream()
+            try:
+                result, stream = self.run(args, parse=not self.is_manifest_current())
+                if not result.success and any(
+                    STALE_MANIFEST_MESSAGE in line for line in stream.lines
+                ):
+                    logger.info("dbt found the manifest out of date, re-parsing the project.")
+                    result, stream = self.run(args, parse=True)
+            except Exception as e:
+                stream.add_line(f"dbt raised an exception: {e}")
+                return stream.result(2)
+
+            if result.exception is not None:
+                stream.add_line(str(result.exception))
+            return stream.result(0 if result.success else 1)
+
+
+dbt_runner = None
+
+
+def create_dbt_runner(mode: str = "auto"):
+    if mode == "subprocess":
+        return SubprocessDbtRunner()
+    try:
+        return InProcessDbtRunner()
+    except ImportError as e:
+        # dbt < 1.5 has no programmatic runner
+        if mode == "inprocess":
+            raise
+        logger.warning(f"In-process dbt runner unavailable ({e}), using subprocess mode.")
+        return SubprocessDbtRunner()
+
+
+def configure_dbt_runner(mode: str = "auto") -> None:
+    global dbt_runner
+    dbt_runner = create_dbt_runner(mode)
+    logger.info(f"Using the {dbt_runner.mode} dbt runner.")
+
+
+def get_dbt_runner():
+    global dbt_runner
+    if dbt_runner is None:
+        dbt_runner = create_dbt_runner()
+    return dbt_runner
+
+
+def run_dbt(args: List[str], job: Optional[Any] = None) -> DbtResult:
+    # dbt opens the DuckDB file itself, so our cached preview connection has to let go of it
+    with hand_target_to_dbt():
+        return get_dbt_runner().invoke(args, job)
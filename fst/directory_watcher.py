@@ -1,22 +1,68 @@
+import sys
 import time
+from watchdog.observers.api import BaseObserver
 from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
 import logging
 
 logger = logging.getLogger(__name__)
 
-observer: PollingObserver = None
+OBSERVER_BACKENDS = ["auto", "inotify", "polling"]
+
+observer: BaseObserver = None
+
+
+def create_observer(backend: str = "auto") -> BaseObserver:
+    if backend == "polling":
+        return PollingObserver()
+    if backend == "inotify":
+        from watchdog.observers.inotify import InotifyObserver
+
+        return InotifyObserver()
+    if sys.platform.startswith("linux"):
+        try:
+            from watchdog.observers.inotify import InotifyObserver
+
+            return InotifyObserver()
+        except (ImportError, OSError) as e:
+            logger.warning(f"inotify is unavailable ({e}), falling back to polling.")
+            return PollingObserver()
+    # watchdog picks the native backend for the platform (FSEvents, kqueue, ReadDirectoryChangesW)
+    from watchdog.observers import Observer
+
+    return Observer()
+
+
+def start_observer(
+    event_handler: FileSystemEventHandler, file_path: str, backend: str = "auto"
+) -> BaseObserver:
+    new_observer = create_observer(backend)
+    try:
+        new_observer.schedule(event_handler, path=file_path, recursive=True)
+        new_observer.start()
+    except OSError as e:
+        # e.g. the inotify watch limit is exhausted on very large projects
+        if backend != "auto" or isinstance(new_observer, PollingObserver):
+            raise
+        logger.warning(
+            f"{type(new_observer).__name__} failed to start ({e}), falling back to polling."
+        )
+        new_observer = PollingObserver()
+        new_observer.schedule(event_handler, path=file_path, recursive=True)
+        new_observer.start()
+    return new_observer
 
 
 def watch_directory(
     event_handler: FileSystemEventHandler,
     file_path: str,
+    backend: str = "auto",
 ) -> None:
     global observer
-    logger.info(f"Started watching directory: {file_path}")
-    observer = PollingObserver()
-    observer.schedule(event_handler, path=file_path, recursive=True)
-    observer.start()
+    observer = start_observer(event_handler, file_path, backend)
+    logger.info(
+        f"Started watching directory: {file_path} ({type(observer).__name__})"
+    )
 
     try:
         while True:
@@ -1,12 +1,52 @@
-import os
-from functools import cached_property, lru_cache
-from typing import List, Optional, Tuple
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import duckdb
 import pandas as pd
+import pyarrow as pa
 import plotly.express as px
 import streamlit as st
 import streamlit_ace
-from fst.db_utils import get_duckdb_file_path
+from fst.config_defaults import (
+    AD_HOC_CACHE_MAX_BYTES,
+    AD_HOC_CACHE_TTL_SECONDS,
+    AD_HOC_DEBOUNCE_SECONDS,
+    AD_HOC_MAX_ROWS,
+    AD_HOC_PAGE_ROWS,
+    AD_HOC_POLL_SECONDS,
+    BLOB_CACHE_ENTRIES,
+    READ_SERVER_ADDRESS,
+    ROLLING_AVERAGE_ITERATIONS,
+    WORKBENCH_CACHE_ENTRIES,
+)
+from fst.db_utils import TargetBusyError, get_data_version, get_duckdb_file_path
+from fst.result_cache import BoundedCache
+from fst.blob_store import ARROW_MEDIA_TYPE, JSON_MEDIA_TYPE, decode_blob
+from fst.read_server import (
+    METRICS_DATABASE,
+    TARGET_DATABASE,
+    ReadClient,
+    ReadServerError,
+    get_authkey,
+)
+from fst.change_detection import SKIPPED_UNCHANGED_STATUS
+from fst.performance_baselines import BASELINE_METRICS
+from fst.spans import (
+    ITERATION_SPAN,
+    SPAN_ROWS_QUERY,
+    TRACE_EXPORT_FORMATS,
+    get_span_rows_params,
+    to_trace_json,
+)
+from fst.preview import (
+    DUPLICATE_FLAG_PREFIX,
+    NULL_FLAG_PREFIX,
+    build_page_query,
+    deserialize_preview,
+    number_rows,
+)
 import diff_viewer
 import pytz
 import sqlglot
@@ -19,7 +59,6 @@ from typing import Any, List
 
 # TODO: get every component in the main function
 # TODO: make everything an expander
-# TODO: fix build vs. compile time for more accurate stats
 # TODO: what would be so killer about this is if it persists information and average performance of production models along with the dev models for slider options. You continue to progress and see what's been done before!
 # TODO: fix a bug where when dbt build fails with candidate bindings that it doesn't finish the rest of the metrics collection
 # TODO: add fst logo
@@ -28,40 +67,184 @@ from typing import Any, List
 # TODO: add a way to see something like dbt audit helper between iterations to see what changed
 
 
-@lru_cache(maxsize=1)
-def get_duckdb_conn() -> duckdb.DuckDBPyConnection:
-    return duckdb.connect(get_duckdb_file_path())
+@st.cache_resource
+def get_read_client() -> ReadClient:
+    # the watcher owns both DuckDB files, so reads go through its read server
+    return ReadClient(READ_SERVER_ADDRESS, get_authkey())
 
 
-@st.cache_data
-def run_query(query: str) -> pd.DataFrame:
-    with get_duckdb_conn() as conn:
-        result = conn.execute(query).fetchdf()
+def read_metrics(query: str, params: Optional[List[Any]] = None) -> pd.DataFrame:
+    return get_read_client().execute(METRICS_DATABASE, query, params).to_pandas()
+
+
+def read_target(
+    query: str, max_rows: Optional[int] = None, request_id: Optional[str] = None
+) -> pa.Table:
+    return get_read_client().execute(
+        TARGET_DATABASE, query, max_rows=max_rows, request_id=request_id
+    )
+
+
+class QueryPage(NamedTuple):
+    dataframe: pd.DataFrame
+    null_flags: pd.DataFrame
+    duplicate_flags: pd.DataFrame
+    offset: int
+    total_rows: int
+
+
+def split_flag_columns(page_df: pd.DataFrame, prefix: str, columns: pd.Index) -> pd.DataFrame:
+    flag_columns = [column for column in page_df.columns if column.startswith(prefix)]
+    if not flag_columns:
+        return pd.DataFrame(False, index=page_df.index, columns=columns)
+    return pd.DataFrame(
+        page_df[flag_columns].fillna(False).to_numpy(dtype=bool),
+        index=page_df.index,
+        columns=columns,
+    )
+
+
+@st.cache_resource
+def get_ad_hoc_cache() -> BoundedCache:
+    return BoundedCache(
+        AD_HOC_CACHE_MAX_BYTES,
+        ttl_seconds=AD_HOC_CACHE_TTL_SECONDS,
+        sizeof=lambda query_page: sum(
+            int(df.memory_usage(deep=True).sum())
+            for df in (query_page.dataframe, query_page.null_flags, query_page.duplicate_flags)
+        ),
+    )
+
+
+@st.cache_resource
+def get_ad_hoc_result_cache() -> BoundedCache:
+    return BoundedCache(
+        AD_HOC_CACHE_MAX_BYTES,
+        ttl_seconds=AD_HOC_CACHE_TTL_SECONDS,
+        sizeof=lambda table: table.nbytes,
+    )
+
+
+@st.cache_resource
+def get_ad_hoc_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="fst-ad-hoc")
+
+
+def wait_for_typing_pause(status: Any) -> None:
+    """Sleep out the debounce window in small steps.
+
+    Every Streamlit call is a point where a rerun for newer editor input stops this
+    script run, so a keystroke inside the window abandons the stale query before it starts.
+    """
+    deadline = time.time() + AD_HOC_DEBOUNCE_SECONDS
+    while time.time() < deadline:
+        status.caption("Waiting for typing to pause...")
+        time.sleep(AD_HOC_POLL_SECONDS)
+
+
+def run_ad_hoc_query(query: str, page: int, highlight_options: List[str]) -> QueryPage:
+    cache = get_ad_hoc_cache()
+    # a rebuilt model keeps its name, so the data version has to be part of the key
+    cache_key = (query, page, tuple(highlight_options), get_data_version(get_duckdb_file_path()))
+    query_page = cache.get(cache_key)
+    if query_page is not None:
+        return query_page
+
+    status = st.empty()
+    if st.session_state.get("ad_hoc_last_query") != query:
+        wait_for_typing_pause(status)
+    st.session_state["ad_hoc_last_query"] = query
+
+    request_id = uuid.uuid4().hex
+    future = get_ad_hoc_executor().submit(
+        fetch_query_page, request_id, query, page, highlight_options
+    )
+    try:
+        # the query runs off the script thread, so a rerun for new input can
+        # stop this run while DuckDB is still busy
+        while not future.done():
+            status.caption("Running query...")
+            time.sleep(AD_HOC_POLL_SECONDS)
+        query_page = future.result()
+    finally:
+        if not future.done():
+            get_read_client().cancel(request_id)
+        status.empty()
+    cache.put(cache_key, query_page)
+    return query_page
+
+
+def fetch_query_result(request_id: str, query: str) -> pa.Table:
+    """The query's result up to AD_HOC_MAX_ROWS, fetched once per query and data version."""
+    cache = get_ad_hoc_result_cache()
+    cache_key = (query, get_data_version(get_duckdb_file_path()))
+    result = cache.get(cache_key)
+    if result is None:
+        # run as written, so its ORDER BY holds and SHOW, DESCRIBE and PRAGMA work too
+        result = read_target(query, max_rows=AD_HOC_MAX_ROWS, request_id=request_id)
+        cache.put(cache_key, result)
     return result
 
 
+def get_display_names(column_names: List[str]) -> List[str]:
+    """Column names made unique for the styled table, e.g. `id` and `id (2)` for `a.id, b.id`."""
+    display_names = []
+    seen: Dict[str, int] = {}
+    for column_name in column_names:
+        seen[column_name] = seen.get(column_name, 0) + 1
+        display_names.append(
+            column_name if seen[column_name] == 1 else f"{column_name} ({seen[column_name]})"
+        )
+    return display_names
+
+
+def fetch_query_page(
+    request_id: str, query: str, page: int, highlight_options: List[str]
+) -> QueryPage:
+    """One page of the query's result, with its null and duplicate flags.
+
+    Pages are cut from the one fetched result rather than queried one by one, so
+    moving between pages never repeats or skips a row, ordered or not.
+    """
+    offset = (page - 1) * AD_HOC_PAGE_ROWS
+    result = fetch_query_result(request_id, query)
+    page_query = build_page_query(
+        "fst_result",
+        result.num_columns,
+        offset,
+        AD_HOC_PAGE_ROWS,
+        flag_nulls="nulls" in highlight_options,
+        flag_duplicates="duplicates" in highlight_options,
+    )
+    with duckdb.connect() as duckdb_conn:
+        duckdb_conn.register("fst_result", number_rows(result))
+        page_df = duckdb_conn.execute(page_query).arrow().to_pandas()
+    df = page_df.iloc[:, : result.num_columns]
+    df.columns = get_display_names(result.column_names)
+    return QueryPage(
+        df,
+        split_flag_columns(page_df, NULL_FLAG_PREFIX, df.columns),
+        split_flag_columns(page_df, DUPLICATE_FLAG_PREFIX, df.columns),
+        offset,
+        result.num_rows,
+    )
+
+
 class DataFrameHighlighter:
-    def __init__(self, dataframe: pd.DataFrame, highlight_options: List[str]):
+    def __init__(
+        self, dataframe: pd.DataFrame, null_flags: pd.DataFrame, duplicate_flags: pd.DataFrame
+    ):
         self.dataframe = dataframe
-        self.highlight_options = highlight_options
+        self.null_flags = null_flags
+        self.duplicate_flags = duplicate_flags
 
     @cached_property
     def highlight(self) -> pd.io.formats.style.Styler:
-        def column_style(column: pd.Series) -> List[str]:
-            is_duplicate = column.duplicated(keep=False)
-            is_null = column.isna()
-            styles = []
-
-            for dup, null in zip(is_duplicate, is_null):
-                style = ""
-                if null and "nulls" in self.highlight_options:
-                    style = "background-color: lightyellow"
-                elif dup and "duplicates" in self.highlight_options:
-                    style = "background-color: lightpink"
-                styles.append(style)
-            return styles
-
-        return self.dataframe.style.apply(column_style, axis=0)
+        styles = pd.DataFrame("", index=self.dataframe.index, columns=self.dataframe.columns)
+        styles = styles.mask(self.duplicate_flags, "background-color: lightpink")
+        # nulls win over duplicates, like before
+        styles = styles.mask(self.null_flags, "background-color: lightyellow")
+        return self.dataframe.style.apply(lambda _: styles, axis=None)
 
 def get_fst_header_info() -> None:
     col1, col2, col3 = st.columns(3)
@@ -70,37 +253,133 @@ def get_fst_header_info() -> None:
 def main() -> None:
     st.set_page_config(layout="wide")
     get_fst_header_info()
-    metrics_df = fetch_metrics_data()
-    if metrics_df.empty:
+    watermark = fetch_metrics_watermark()
+    if watermark[1] == 0:
         st.info("Modify a dbt SQL model to see the fst workbench")
-    else: 
-        filtered_metrics_df, selected_row = show_metrics(metrics_df)
-        compare_two_iterations(filtered_metrics_df)
-        show_compiled_code_latest(selected_row)
-        show_compiled_code_selected(selected_row)
+    else:
+        filtered_metrics_df, selected_row = show_metrics(watermark)
+        if selected_row is not None:
+            compare_two_iterations(filtered_metrics_df)
+            show_compiled_code_latest(selected_row)
+            show_compiled_code_selected(selected_row)
         dbt_cloud_workbench()
         display_query_section()
         # transpile_sql_util() # TODO add this back in if it's useful
 
 
-def fetch_metrics_data() -> pd.DataFrame:
-    with duckdb.connect("fst_metrics.duckdb") as duckdb_conn:
-        create_metrics_table = """
-            CREATE TABLE IF NOT EXISTS metrics (
-                timestamp TIMESTAMP,
-                modified_sql_file TEXT,
-                compiled_sql_file TEXT,
-                compiled_query VARCHAR,
-                dbt_build_status TEXT,
-                duckdb_file_name TEXT,
-                dbt_build_time REAL,
-                query_time REAL,
-                result_preview_json TEXT
-            )
+def fetch_metrics_watermark() -> Tuple[Optional[int], int]:
+    """Latest seq and row count of `metrics`, which change whenever the watcher records or compacts."""
+    # the watcher's metrics writer owns the schema, so there's nothing to show until it has run
+    try:
+        watermark_df = read_metrics("SELECT max(seq) AS seq, count(*) AS row_count FROM metrics")
+    except (ReadServerError, duckdb.Error):
+        return None, 0
+    seq, row_count = watermark_df.iloc[0]
+    return (None if pd.isna(seq) else int(seq)), int(row_count)
+
+
+@st.cache_data(max_entries=WORKBENCH_CACHE_ENTRIES)
+def fetch_model_options(watermark: Tuple[Optional[int], int]) -> List[str]:
+    return read_metrics(
         """
-        duckdb_conn.execute(create_metrics_table)
-        metrics_df = duckdb_conn.execute("SELECT * FROM metrics").fetchdf()
-    return metrics_df
+        SELECT DISTINCT modified_sql_file FROM metrics
+        WHERE dbt_build_status != ?
+        ORDER BY modified_sql_file
+        """,
+        [SKIPPED_UNCHANGED_STATUS],
+    )["modified_sql_file"].tolist()
+
+
+def query_model_iterations(model: str, after_seq: int) -> pd.DataFrame:
+    # the window runs over the model's whole history so new rows get the right average
+    return read_metrics(
+        f"""
+        SELECT iterations.*, regressions.build_time_regression, regressions.query_time_regression
+        FROM (
+            SELECT
+                *,
+                avg(dbt_build_time) OVER (
+                    ORDER BY seq
+                    ROWS BETWEEN {ROLLING_AVERAGE_ITERATIONS - 1} PRECEDING AND CURRENT ROW
+                ) AS rolling_average
+            FROM metrics
+            WHERE modified_sql_file = ? AND dbt_build_status != ?
+        ) AS iterations
+        LEFT JOIN (
+            SELECT
+                iteration_id,
+                max(change_percent) FILTER (WHERE metric = 'dbt_build_time')
+                    AS build_time_regression,
+                max(change_percent) FILTER (WHERE metric = 'query_time')
+                    AS query_time_regression
+            FROM performance_regressions
+            GROUP BY iteration_id
+        ) AS regressions ON iterations.iteration_id = regressions.iteration_id
+        WHERE iterations.seq > ?
+        ORDER BY iterations.seq
+        """,
+        [model, SKIPPED_UNCHANGED_STATUS, after_seq],
+    )
+
+
+def fetch_model_iterations(model: str) -> pd.DataFrame:
+    """Built iterations of one model, only fetching the rows recorded since the last rerun."""
+    cached_iterations = st.session_state.setdefault("model_iterations", {})
+    iterations_df = cached_iterations.get(model)
+    row_count = read_metrics(
+        """
+        SELECT count(*) AS row_count FROM metrics
+        WHERE modified_sql_file = ? AND dbt_build_status != ?
+        """,
+        [model, SKIPPED_UNCHANGED_STATUS],
+    )["row_count"].iloc[0]
+    if iterations_df is not None and not iterations_df.empty:
+        new_iterations_df = query_model_iterations(model, int(iterations_df["seq"].max()))
+        iterations_df = pd.concat([iterations_df, new_iterations_df], ignore_index=True)
+    # compaction removed rows this session had already loaded, start over
+    if iterations_df is None or len(iterations_df) != row_count:
+        iterations_df = query_model_iterations(model, -1)
+    cached_iterations[model] = iterations_df
+    return iterations_df
+
+
+@st.cache_data(max_entries=BLOB_CACHE_ENTRIES)
+def fetch_blob(blob_hash: str) -> Tuple[Optional[str], Optional[bytes]]:
+    """Media type and content of one blob. Blobs never change, so caching them is always safe."""
+    rows = get_read_client().execute(
+        METRICS_DATABASE,
+        "SELECT media_type, content, codec FROM blobs WHERE hash = ?",
+        [blob_hash],
+    ).to_pylist()
+    if not rows:
+        return None, None
+    return rows[0]["media_type"], decode_blob(rows[0]["content"], rows[0]["codec"])
+
+
+def fetch_text_blob(blob_hash: Any) -> str:
+    if not isinstance(blob_hash, str):
+        return ""
+    _, content = fetch_blob(blob_hash)
+    return content.decode("utf-8") if content is not None else ""
+
+
+def get_compiled_query(selected_row: pd.Series) -> str:
+    return fetch_text_blob(selected_row.get("compiled_query_hash"))
+
+
+NO_COMPILED_SQL_MESSAGE = "No compiled SQL for this iteration: dbt didn't compile the model."
+
+
+def read_compiled_sql_file(selected_row: pd.Series) -> Optional[str]:
+    """The model's compiled SQL as it is on disk now, or None if dbt never compiled it."""
+    compiled_sql_file = selected_row.get("compiled_sql_file")
+    if not isinstance(compiled_sql_file, str):
+        return None
+    try:
+        with open(compiled_sql_file, "r") as f:
+            return f.read()
+    except OSError:
+        return None
 
 
 def display_query_section() -> None:
@@ -133,24 +412,55 @@ def display_query_section() -> None:
         )
 
         if query.strip():
+            page = st.number_input(
+                "Page:",
+                min_value=1,
+                value=1,
+                step=1,
+                help=f"Results are paged {AD_HOC_PAGE_ROWS} rows at a time, up to {AD_HOC_MAX_ROWS:,} rows",
+            )
             try:
-                df = run_query(query)
-                highlighted_df = DataFrameHighlighter(df, highlight_options).highlight
-                st.dataframe(highlighted_df)
+                query_page = run_ad_hoc_query(query, int(page), highlight_options)
+                if query_page.dataframe.empty and query_page.offset > 0:
+                    st.info(f"The result only has {query_page.total_rows:,} rows.")
+                else:
+                    highlighted_df = DataFrameHighlighter(
+                        query_page.dataframe,
+                        query_page.null_flags,
+                        query_page.duplicate_flags,
+                    ).highlight
+                    st.dataframe(highlighted_df)
+                    capped = " (capped)" if query_page.total_rows >= AD_HOC_MAX_ROWS else ""
+                    st.caption(
+                        f"Rows {query_page.offset + 1:,}-{query_page.offset + len(query_page.dataframe):,}"
+                        f" of {query_page.total_rows:,}{capped}"
+                    )
+            except TargetBusyError:
+                # dbt is building and there's no snapshot to read, which passes on its own
+                st.info("dbt is still writing to the database, run the query again once it's done.")
             except Exception as e:
                 st.error(f"Error running query: {e}")
         else:
             st.error("Query is empty.")
 
 
-def show_metrics(metrics_df: pd.DataFrame) -> None:
-    sorted_metrics_df = metrics_df.sort_values(by="timestamp", ascending=True)
-
-    model_options = sorted_metrics_df["modified_sql_file"].unique()
+def show_metrics(
+    watermark: Tuple[Optional[int], int]
+) -> Tuple[pd.DataFrame, Optional[pd.Series]]:
+    model_options = fetch_model_options(watermark)
+    filtered_metrics_df = pd.DataFrame()
+    selected_row = None
     expander_single_dbt_model = st.expander(
         "**Iterate your dbt models!**", expanded=True
     )
     with expander_single_dbt_model:
+        # saves skipped as unchanged have no build or preview to iterate over
+        if not model_options:
+            st.warning(
+                "No iterations found for any dbt models. Modify a dbt model to see results here."
+            )
+            return filtered_metrics_df, selected_row
+
         selected_model = st.selectbox(
             "**Focus on a dbt model to work on:**",
             options=model_options,
@@ -158,53 +468,40 @@ def show_metrics(metrics_df: pd.DataFrame) -> None:
             help="Only models that have been modified at least once are shown here with the full file path",
         )
 
-        filtered_metrics_df = sorted_metrics_df.loc[
-            sorted_metrics_df["modified_sql_file"] == selected_model
-        ].copy()
-        filtered_metrics_df = filtered_metrics_df.reset_index()
+        filtered_metrics_df = fetch_model_iterations(selected_model)
 
         iteration_options = filtered_metrics_df["timestamp"].tolist()
         num_iterations = len(iteration_options)
-        if len(iteration_options) > 0:
-            if num_iterations > 1:
-                min_iteration_index = 0
-                max_iteration_index = num_iterations - 1
-                slider_label = "**Move the slider left to right viewing model changes in code/data/performance compared to the latest iteration:**"
-
-                selected_iteration_index = st.slider(
-                    slider_label,
-                    min_value=min_iteration_index,
-                    max_value=max_iteration_index,
-                    value=max_iteration_index,
-                    format="%d",
-                    help="The slider starts at zero and adds options for this model as you modify it",
-                )
-
-                selected_iteration = iteration_options[selected_iteration_index]
-            else:
-                selected_iteration = iteration_options[0]
-                st.write("*No Slider Options: There is only one iteration available*")
-
-            selected_row = filtered_metrics_df.loc[
-                filtered_metrics_df["timestamp"] == selected_iteration
-            ].iloc[0]
-            selected_iteration_index = filtered_metrics_df.index[
-                filtered_metrics_df["timestamp"] == selected_iteration
-            ].tolist()[0]
-
-            old_code = selected_row["compiled_query"]
-            with open(selected_row["compiled_sql_file"], "r") as f:
-                latest_code = f.read()
-            selected_timestamp(selected_iteration)
-            show_selected_data_preview(selected_row)
-            view_code_diffs(old_code, latest_code, key="compare_old_latest")
-            show_performance_metrics(
-                selected_row, sorted_metrics_df, selected_iteration_index
+        if num_iterations > 1:
+            slider_label = "**Move the slider left to right viewing model changes in code/data/performance compared to the latest iteration:**"
+
+            selected_iteration_index = st.slider(
+                slider_label,
+                min_value=0,
+                max_value=num_iterations - 1,
+                value=num_iterations - 1,
+                format="%d",
+                help="The slider starts at zero and adds options for this model as you modify it",
             )
         else:
-            st.warning(
-                "No iterations found for any dbt models. Modify a dbt model to see results here."
-            )
+            selected_iteration_index = 0
+            st.write("*No Slider Options: There is only one iteration available*")
+
+        selected_row = filtered_metrics_df.iloc[selected_iteration_index]
+        selected_iteration = selected_row["timestamp"]
+
+        old_code = get_compiled_query(selected_row)
+        latest_code = read_compiled_sql_file(selected_row)
+        selected_timestamp(selected_iteration)
+        show_selected_data_preview(selected_row)
+        if latest_code is None:
+            st.info(NO_COMPILED_SQL_MESSAGE)
+        else:
+            view_code_diffs(old_code, latest_code, key="compare_old_latest")
+        show_performance_metrics(filtered_metrics_df, selected_iteration_index, watermark)
+        show_node_timings(selected_row)
+        show_spans(selected_row)
+        show_build_log(selected_row)
     return filtered_metrics_df, selected_row
 
 
@@ -223,41 +520,247 @@ def selected_timestamp(selected_iteration: pd.Series) -> None:
 
 
 def show_selected_data_preview(selected_row: pd.Series) -> None:
-    result_preview_df = pd.read_json(selected_row["result_preview_json"])
-    st.write(result_preview_df)
+    if selected_row.get("preview_status") == "timeout":
+        st.warning(
+            f"The preview query timed out after {selected_row['query_time']:.2f} seconds, "
+            "only the rows fetched before the deadline are shown."
+        )
+    elif selected_row.get("preview_status") == "error":
+        st.error("The preview query failed for this iteration.")
+    result_preview_hash = selected_row.get("result_preview_hash")
+    if isinstance(result_preview_hash, str):
+        media_type, content = fetch_blob(result_preview_hash)
+        if media_type == ARROW_MEDIA_TYPE:
+            # Arrow IPC reads back without a copy and keeps the column types
+            st.dataframe(deserialize_preview(content))
+        elif media_type == JSON_MEDIA_TYPE:
+            # iterations recorded before previews were stored as Arrow
+            st.write(pd.read_json(content.decode("utf-8")))
+    if isinstance(selected_row.get("preview_strategy"), str):
+        st.caption(f"Preview rows: {selected_row['preview_strategy']}")
 
 
 def show_performance_metrics(
-    selected_row: pd.Series,
-    metrics_df: pd.DataFrame,
-    selected_iteration_index: Optional[int] = None,
+    filtered_metrics_df: pd.DataFrame,
+    selected_iteration_index: int,
+    watermark: Tuple[Optional[int], int],
 ) -> None:
-    filtered_metrics_df = metrics_df.loc[
-        metrics_df["modified_sql_file"] == selected_row["modified_sql_file"]
-    ].copy()
+    fig = create_line_chart(filtered_metrics_df.reset_index(), selected_iteration_index)
+
+    st.write(fig)
+    show_performance_regressions(filtered_metrics_df.iloc[selected_iteration_index], watermark)
 
-    if selected_iteration_index is None:
-        selected_iteration_index = metrics_df["index"].min()
+    show_file_modifications_and_performance_metrics(watermark)
 
-    filtered_metrics_df.loc[:, "rolling_average"] = calculate_rolling_average(
-        filtered_metrics_df, "dbt_build_time"
+
+@st.cache_data(max_entries=WORKBENCH_CACHE_ENTRIES)
+def fetch_performance_regressions(iteration_id: str) -> pd.DataFrame:
+    # regressions are written with their iteration and never change afterwards
+    return read_metrics(
+        "SELECT * FROM performance_regressions WHERE iteration_id = ? ORDER BY metric",
+        [iteration_id],
+    )
+
+
+@st.cache_data(max_entries=WORKBENCH_CACHE_ENTRIES)
+def fetch_model_baselines(
+    model: str, watermark: Tuple[Optional[int], int]
+) -> pd.DataFrame:
+    return read_metrics(
+        """
+        SELECT metric, observations, ewma, p50, p95, sqrt(ewm_variance) AS ewm_std_dev
+        FROM model_baselines
+        WHERE modified_sql_file = ?
+        ORDER BY metric
+        """,
+        [model],
     )
 
-    filtered_metrics_df = filtered_metrics_df.reset_index()
 
-    # Pass the selected_iteration_index as the second argument
-    fig = create_line_chart(filtered_metrics_df, selected_iteration_index)
+def show_performance_regressions(
+    selected_row: pd.Series, watermark: Tuple[Optional[int], int]
+) -> None:
+    if pd.isna(selected_row.get("iteration_id")):
+        return
+    regressions_df = fetch_performance_regressions(selected_row["iteration_id"])
+    for regression in regressions_df.to_dict("records"):
+        label = BASELINE_METRICS.get(regression["metric"], regression["metric"])
+        st.warning(
+            f"{label} regressed in this iteration: {regression['value']:.2f} seconds, "
+            f"+{regression['change_seconds']:.2f} seconds "
+            f"(+{regression['change_percent']:.0f}%) over the "
+            f"{regression['baseline_ewma']:.2f} second baseline "
+            f"(p50 {regression['baseline_p50']:.2f}, p95 {regression['baseline_p95']:.2f})"
+        )
+
+    baselines_df = fetch_model_baselines(selected_row["modified_sql_file"], watermark)
+    if not baselines_df.empty:
+        st.write("*Current performance baselines of this model (EWMA and percentiles)*")
+        st.write(baselines_df)
+
+
+def fetch_node_timings(iteration_id: str) -> pd.DataFrame:
+    return read_metrics(
+        """
+        SELECT unique_id, resource_type, status, execution_time, compile_time,
+               execute_time, rows_affected, failures, adapter_response
+        FROM node_timings
+        WHERE iteration_id = ?
+        ORDER BY execution_time DESC
+        """,
+        [iteration_id],
+    )
+
+
+def fetch_profile_drift(left_iteration_id: str, right_iteration_id: str) -> pd.DataFrame:
+    return read_metrics(
+        """
+        WITH left_profile AS (
+            SELECT * FROM column_profiles WHERE iteration_id = ?
+        ), right_profile AS (
+            SELECT * FROM column_profiles WHERE iteration_id = ?
+        )
+        SELECT
+            coalesce(r.column_name, l.column_name) AS column_name,
+            CASE
+                WHEN l.column_name IS NULL THEN 'added'
+                WHEN r.column_name IS NULL THEN 'removed'
+                WHEN l.column_type != r.column_type THEN 'type changed'
+                ELSE ''
+            END AS change,
+            l.column_type AS left_type,
+            r.column_type AS right_type,
+            r.row_count - l.row_count AS row_count_change,
+            r.null_count / nullif(r.row_count, 0)
+                - l.null_count / nullif(l.row_count, 0) AS null_rate_change,
+            r.approx_distinct - l.approx_distinct AS distinct_change,
+            l.min_value AS left_min,
+            r.min_value AS right_min,
+            l.max_value AS left_max,
+            r.max_value AS right_max,
+            l.top_k AS left_top_k,
+            r.top_k AS right_top_k
+        FROM left_profile AS l
+        FULL OUTER JOIN right_profile AS r ON l.column_name = r.column_name
+        ORDER BY column_name
+        """,
+        [left_iteration_id, right_iteration_id],
+    )
+
 
+def show_profile_drift(first_row: pd.Series, second_row: pd.Series) -> None:
+    if pd.isna(first_row.get("iteration_id")) or pd.isna(second_row.get("iteration_id")):
+        return
+    profile_drift_df = fetch_profile_drift(
+        first_row["iteration_id"], second_row["iteration_id"]
+    )
+    if profile_drift_df.empty:
+        st.info("No column profiles recorded for these iterations.")
+        return
+    st.markdown("**Column Profile Drift:**")
+    st.dataframe(profile_drift_df, use_container_width=True)
+
+
+def show_build_log(selected_row: pd.Series) -> None:
+    if not isinstance(selected_row.get("dbt_log_hash"), str):
+        return
+    # only fetched on demand, logs are the largest blobs
+    if st.checkbox("Show `dbt build` log", key="show_build_log"):
+        st.code(fetch_text_blob(selected_row["dbt_log_hash"]), language="text")
+
+
+def show_node_timings(selected_row: pd.Series) -> None:
+    if pd.isna(selected_row.get("iteration_id")):
+        return
+    node_timings_df = fetch_node_timings(selected_row["iteration_id"])
+    if node_timings_df.empty:
+        return
+
+    st.write("*Where the `dbt build` time went for this iteration*")
+    phases_df = node_timings_df.melt(
+        id_vars=["unique_id", "status"],
+        value_vars=["compile_time", "execute_time"],
+        var_name="phase",
+        value_name="seconds",
+    )
+    fig = px.bar(
+        phases_df,
+        x="seconds",
+        y="unique_id",
+        color="phase",
+        orientation="h",
+        hover_data=["status"],
+        labels={"unique_id": "Node", "seconds": "Time in Seconds"},
+    )
     st.write(fig)
+    st.write(node_timings_df)
 
-    show_file_modifications_and_performance_metrics(metrics_df)
 
+def fetch_spans(iteration_id: str) -> pa.Table:
+    return get_read_client().execute(
+        METRICS_DATABASE, SPAN_ROWS_QUERY, get_span_rows_params(iteration_id=iteration_id)
+    )
 
-@st.cache_data
-def calculate_rolling_average(df: pd.DataFrame, column: str) -> pd.Series:
-    return df[column].rolling(window=len(df), min_periods=1).mean()
 
+def get_span_depths(spans_df: pd.DataFrame) -> List[int]:
+    parents = dict(zip(spans_df["span_id"], spans_df["parent_span_id"]))
+    depths = []
+    for span_id in spans_df["span_id"]:
+        depth = 0
+        parent_span_id = parents.get(span_id)
+        while isinstance(parent_span_id, str) and parent_span_id in parents:
+            depth += 1
+            parent_span_id = parents[parent_span_id]
+        depths.append(depth)
+    return depths
+
+
+def show_spans(selected_row: pd.Series) -> None:
+    if pd.isna(selected_row.get("iteration_id")):
+        return
+    span_table = fetch_spans(selected_row["iteration_id"])
+    if span_table.num_rows == 0:
+        return
+
+    st.write("*Where the time from save to recorded iteration went*")
+    spans_df = span_table.to_pandas()
+    spans_df["depth"] = get_span_depths(spans_df)
+    # a flame graph laid out on the clock: each stage sits below the stage it ran in
+    fig = px.bar(
+        spans_df,
+        x="duration",
+        base="start_offset",
+        y="depth",
+        color="name",
+        orientation="h",
+        text="name",
+        hover_data=["start_offset", "attributes"],
+        labels={"duration": "Time in Seconds", "depth": "Stage Depth"},
+    )
+    fig.update_layout(barmode="overlay")
+    fig.update_yaxes(autorange="reversed", dtick=1)
+    st.write(fig)
+
+    stage_totals_df = (
+        spans_df[spans_df["name"] != ITERATION_SPAN]
+        .groupby("name", as_index=False)["duration"]
+        .sum()
+        .sort_values("duration", ascending=False)
+    )
+    st.dataframe(stage_totals_df, use_container_width=True)
+
+    span_rows = span_table.to_pylist()
+    for trace_format in TRACE_EXPORT_FORMATS:
+        st.download_button(
+            f"Download {trace_format} trace",
+            to_trace_json(span_rows, trace_format),
+            file_name=f"fst_trace_{selected_row['iteration_id'][:8]}.{trace_format}.json",
+            mime="application/json",
+            key=f"download_{trace_format}_trace",
+        )
 
+
+@st.cache_data
 def create_line_chart(df: pd.DataFrame, selected_iteration_index: int) -> px.line:
     fig = px.line(
         df,
@@ -270,7 +773,9 @@ def create_line_chart(df: pd.DataFrame, selected_iteration_index: int) -> px.lin
     )
 
     fig.update_traces(
-        line=dict(color="orange", width=2), name="Rolling Average", showlegend=True
+        line=dict(color="orange", width=2),
+        name=f"Rolling Average (last {ROLLING_AVERAGE_ITERATIONS})",
+        showlegend=True,
     )
 
     status_colors = {"success": "#AEC6CF", "failure": "#FF6961"}
@@ -284,6 +789,20 @@ def create_line_chart(df: pd.DataFrame, selected_iteration_index: int) -> px.lin
             name=status.capitalize(),
         )
 
+    regressed = df["build_time_regression"].notna()
+    if regressed.any():
+        fig.add_scatter(
+            x=df.loc[regressed, "index"],
+            y=df.loc[regressed, "dbt_build_time"],
+            mode="markers",
+            marker=dict(color="#FF6961", symbol="triangle-up", size=12),
+            name="Build Regression",
+            hovertext=[
+                f"+{change:.0f}% over baseline"
+                for change in df.loc[regressed, "build_time_regression"]
+            ],
+        )
+
     if not df.empty:
         selected_row = df.loc[selected_iteration_index]
         fig.add_shape(
@@ -302,40 +821,38 @@ def create_line_chart(df: pd.DataFrame, selected_iteration_index: int) -> px.lin
     return fig
 
 
-def show_file_modifications_and_performance_metrics(metrics_df: pd.DataFrame) -> None:
-    metrics_df["base_modified_sql_file"] = metrics_df["modified_sql_file"].apply(
-        os.path.basename
-    )
-
+def show_file_modifications_and_performance_metrics(
+    watermark: Tuple[Optional[int], int]
+) -> None:
     file_modifications_and_performance = get_file_modifications_and_performance_metrics(
-        metrics_df
+        watermark
     )
 
     st.write("*All File Modifications and Average Performance Stats*")
     st.write(file_modifications_and_performance)
 
 
+@st.cache_data(max_entries=WORKBENCH_CACHE_ENTRIES)
 def get_file_modifications_and_performance_metrics(
-    metrics_df: pd.DataFrame,
+    watermark: Tuple[Optional[int], int],
 ) -> pd.DataFrame:
-    modifications_per_file = (
-        metrics_df.groupby("base_modified_sql_file")
-        .size()
-        .reset_index(name="num_modifications")
-    )
-    average_performance_stats = (
-        metrics_df.groupby("base_modified_sql_file")[["dbt_build_time", "query_time"]]
-        .mean()
-        .reset_index()
-    )
-    average_performance_stats = average_performance_stats.rename(
-        columns={"dbt_build_time": "avg_dbt_build_time", "query_time": "avg_query_time"}
+    built = "dbt_build_status != ?"
+    return read_metrics(
+        f"""
+        SELECT
+            regexp_extract(modified_sql_file, '[^/\\\\]+$') AS base_modified_sql_file,
+            count(*) AS num_modifications,
+            count(*) FILTER (WHERE NOT ({built})) AS num_skipped_unchanged,
+            avg(compile_time) FILTER (WHERE {built}) AS avg_compile_time,
+            avg(preview_time) FILTER (WHERE {built}) AS avg_preview_time,
+            avg(dbt_build_time) FILTER (WHERE {built}) AS avg_dbt_build_time,
+            avg(query_time) FILTER (WHERE {built}) AS avg_query_time
+        FROM metrics
+        GROUP BY base_modified_sql_file
+        ORDER BY base_modified_sql_file
+        """,
+        [SKIPPED_UNCHANGED_STATUS] * 5,
     )
-    file_modifications_and_performance = pd.merge(
-        modifications_per_file, average_performance_stats
-    )
-
-    return file_modifications_and_performance
 
 
 def show_compiled_code_latest(selected_row: pd.Series) -> None:
@@ -346,10 +863,11 @@ def show_compiled_code_latest(selected_row: pd.Series) -> None:
         "**Latest Compiled Code**", expanded=show_code
     )
     with expander:
+        compiled_sql_file_contents = read_compiled_sql_file(selected_row)
+        if compiled_sql_file_contents is None:
+            st.info(NO_COMPILED_SQL_MESSAGE)
+            return
         st.code(f"{selected_row['compiled_sql_file']}", language="text")
-
-        with open(selected_row["compiled_sql_file"], "r") as f:
-            compiled_sql_file_contents = f.read()
         st.code(compiled_sql_file_contents, language="sql")
 
 
@@ -362,7 +880,7 @@ def show_compiled_code_selected(selected_row: pd.Series) -> None:
         expanded=show_code,
     )
     with expander:
-        compiled_query = selected_row["compiled_query"]
+        compiled_query = get_compiled_query(selected_row)
         st.code(compiled_query, language="sql")
 
 
@@ -476,9 +994,10 @@ def compare_two_iterations(filtered_metrics_df: pd.DataFrame) -> None:
         with col2:
             show_selected_data_preview(second_row)
 
-        old_code = first_row["compiled_query"]
-        new_code = second_row["compiled_query"]
+        old_code = get_compiled_query(first_row)
+        new_code = get_compiled_query(second_row)
         view_code_diffs(old_code, new_code, key="compare_two_iterations")
+        show_profile_drift(first_row, second_row)
 
 
 # dbt Cloud Metrics Dashboard. This dashboard is designed to help you understand your workbench progress in the aim of improving your dbt Cloud deployment experience(read: you're confident about what you're shipping works)
@@ -509,8 +1028,7 @@ def dbt_cloud_workbench() -> None:
             get_models_per_job_widget()
             model_runs_df = get_model_past_runs_widget()
             selected_run_id = compare_selected_runs(model_runs_df)
-            metrics_df = fetch_metrics_data()
-            compare_dev_to_deployed(metrics_df, model_runs_df, selected_run_id)
+            compare_dev_to_deployed(model_runs_df, selected_run_id)
         except AttributeError:
             st.info("Enter a valid service token to get started!")
         except UnboundLocalError: 
@@ -940,9 +1458,9 @@ def compare_selected_runs(model_runs_df: pd.DataFrame):
 
 # create a function to read from fst_metrics.duckdb and create a dataframe specific to any modified model and compare it to the rawCode and compiled code in the model_runs_df
 # step 1 read in the fst_metrics.duckdb doing select * from metrics
-def compare_dev_to_deployed(metrics_df: pd.DataFrame, model_runs_df: pd.DataFrame, selected_run_id: int):
+def compare_dev_to_deployed(model_runs_df: pd.DataFrame, selected_run_id: int):
     # Step 1: Create a selectbox that shows all the models that have been modified
-    model_options = metrics_df["modified_sql_file"].unique()
+    model_options = fetch_model_options(fetch_metrics_watermark())
     selected_dev_model_to_compare = st.selectbox(
         "**Focus on a development dbt model to compare to a deployed dbt model:**",
         options=model_options,
@@ -951,8 +1469,8 @@ def compare_dev_to_deployed(metrics_df: pd.DataFrame, model_runs_df: pd.DataFram
         key='selected_dev_model_to_compare'
     )
 
-    dev_code_row = metrics_df[metrics_df["modified_sql_file"] == selected_dev_model_to_compare].iloc[0]
-    dev_code = str(dev_code_row["compiled_query"])
+    dev_code_row = fetch_model_iterations(selected_dev_model_to_compare).iloc[0]
+    dev_code = get_compiled_query(dev_code_row)
 
     # Assuming that model_runs_df has a column named 'compiledCode' containing the deployed code
     filtered_model_runs_df = model_runs_df[model_runs_df["runId"] == str(selected_run_id)]
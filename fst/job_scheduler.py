@@ -0,0 +1,91 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Deque, List, Optional, Set
+
+from fst.dbt_artifacts import ALL_NODES
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    def __init__(self, fn: Callable, writes: Set[str], reads: Set[str], args: tuple):
+        self.fn = fn
+        self.writes = writes
+        self.reads = reads
+        self.args = args
+        self.future: Future = Future()
+        self.worker_slot: Optional[int] = None
+
+    def conflicts_with(self, other: "ScheduledJob") -> bool:
+        if ALL_NODES in self.writes or ALL_NODES in other.writes:
+            return True
+        return bool(
+            self.writes & (other.writes | other.reads) or other.writes & self.reads
+        )
+
+
+class JobScheduler:
+    """Runs build jobs on a worker pool, serializing jobs whose DAG footprints overlap.
+
+    A job writes the nodes it selects and reads their ancestors. Two jobs may run
+    at the same time only if neither writes a node the other reads or writes.
+    Jobs are started in submission order, so a job never overtakes an earlier
+    one it conflicts with. Each running job gets a worker slot, which callers use
+    to keep dbt artifacts of concurrent invocations apart.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="fst-build")
+        self.lock = Lock()
+        self.pending: Deque[ScheduledJob] = deque()
+        self.running: List[ScheduledJob] = []
+        self.free_slots = list(range(max_workers))
+
+    def submit(self, fn: Callable, writes: Set[str], reads: Set[str], *args: Any) -> Future:
+        job = ScheduledJob(fn, writes, reads, args)
+        with self.lock:
+            self.pending.append(job)
+            self.dispatch()
+        return job.future
+
+    def dispatch(self) -> None:
+        waiting: List[ScheduledJob] = []
+        for job in list(self.pending):
+            if not self.free_slots:
+                break
+            blocked = any(job.conflicts_with(other) for other in self.running + waiting)
+            if blocked:
+                waiting.append(job)
+                continue
+            self.pending.remove(job)
+            job.worker_slot = self.free_slots.pop(0)
+            self.running.append(job)
+            self.executor.submit(self.run, job)
+
+    def run(self, job: ScheduledJob) -> None:
+        try:
+            job.future.set_result(job.fn(*job.args, worker_slot=job.worker_slot))
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            job.future.set_exception(e)
+        finally:
+            with self.lock:
+                self.running.remove(job)
+                self.free_slots.append(job.worker_slot)
+                self.free_slots.sort()
+                self.dispatch()
+
+
+def get_default_worker_count(dbt_runner_mode: str, target_type: Optional[str]) -> int:
+    """Builds only run in parallel with a dbt process per build against a warehouse target.
+
+    The in-process runner runs one dbt command at a time, and a DuckDB target takes one
+    writer, so more workers would only add a target path per worker slot.
+    """
+    if dbt_runner_mode != "subprocess" or target_type == "duckdb":
+        return 1
+    return min(4, os.cpu_count() or 1)
@@ -1,14 +1,52 @@
 import click
 import os
+import secrets
 import subprocess
 import multiprocessing
 import logging
+from typing import List, Optional
+from tabulate import tabulate
 
 from fst.file_utils import get_models_directory
-from fst.query_handler import handle_query, DynamicQueryHandler
-from fst.directory_watcher import watch_directory
+from fst.query_handler import (
+    handle_queries,
+    DynamicQueryHandler,
+    configure_build_scheduler,
+    configure_preview_timeout,
+    configure_preview_strategy,
+)
+from fst.job_scheduler import get_default_worker_count
+from fst.directory_watcher import watch_directory, OBSERVER_BACKENDS
 from fst.logger import setup_logger
-from fst.config_defaults import CURRENT_WORKING_DIR
+from fst.dbt_runner import configure_dbt_runner, get_dbt_runner, DBT_RUNNER_MODES
+from fst.db_utils import (
+    TARGET_STORAGE_REMEDY,
+    StorageVersionError,
+    check_storage_version,
+    get_duckdb_file_path,
+    get_target_config,
+    snapshot_target,
+)
+from fst.preview import PreviewStrategy, PREVIEW_STRATEGIES
+from fst.metrics_writer import (
+    METRICS_STORAGE_REMEDY,
+    configure_metrics_writer,
+    close_metrics_writer,
+)
+from fst.read_server import start_read_server, stop_read_server
+from fst.spans import TRACE_EXPORT_FORMATS
+from fst.config_defaults import (
+    BENCH_REGRESSION_THRESHOLD,
+    BENCH_RESULTS_DB_FILE,
+    CURRENT_WORKING_DIR,
+    METRICS_ARCHIVE_DIR,
+    METRICS_DB_FILE,
+    METRICS_RETENTION_DAYS,
+    READ_SERVER_AUTHKEY_ENV,
+    PREVIEW_SAMPLE_PERCENT,
+    PREVIEW_SEED,
+    PREVIEW_TIMEOUT_SECONDS,
+)
 
 
 @click.group()
@@ -21,12 +59,43 @@ def start_streamlit() -> None:
     streamlit_app_path = os.path.join(current_dir, "fst_workbench.py")
     subprocess.run(["streamlit", "run", streamlit_app_path])
 
-def start_directory_watcher(path: str, log_queue: multiprocessing.Queue) -> None:
+def start_directory_watcher(
+    path: str,
+    log_queue: multiprocessing.Queue,
+    observer_backend: str = "auto",
+    normalize_sql: bool = False,
+    dbt_runner_mode: str = "auto",
+    workers: Optional[int] = None,
+    preview_timeout: float = PREVIEW_TIMEOUT_SECONDS,
+    preview_strategy: PreviewStrategy = PreviewStrategy(),
+    metrics_retention_days: Optional[int] = None,
+) -> None:
     setup_logger(log_queue)
+    configure_dbt_runner(dbt_runner_mode)
+    if workers is None:
+        workers = get_default_worker_count(
+            get_dbt_runner().mode, get_target_config().get("type")
+        )
+    configure_build_scheduler(workers)
+    configure_preview_timeout(preview_timeout if preview_timeout > 0 else None)
+    configure_preview_strategy(preview_strategy)
+    # the workbench reads through the read server, so the writer can keep its connection
+    configure_metrics_writer(
+        retention_days=metrics_retention_days, idle_close_seconds=None
+    )
+    # reads made during the first build see the target as it was at start
+    snapshot_target()
+    start_read_server()
     project_dir = path
     models_dir = get_models_directory(project_dir)
-    event_handler = DynamicQueryHandler(handle_query, models_dir)
-    watch_directory(event_handler, models_dir)
+    event_handler = DynamicQueryHandler(
+        handle_queries, models_dir, normalize_sql=normalize_sql
+    )
+    try:
+        watch_directory(event_handler, models_dir, observer_backend)
+    finally:
+        stop_read_server()
+        close_metrics_writer()
 
 def listener_process(queue: multiprocessing.Queue) -> None:
     setup_logger()
@@ -48,23 +117,450 @@ def listener_process(queue: multiprocessing.Queue) -> None:
     type=click.Path(exists=True, dir_okay=True, readable=True, resolve_path=True),
     help="dbt project root directory. Defaults to current working directory.",
 )
-def start(path: str) -> None:
+@click.option(
+    "--observer",
+    "observer_backend",
+    default="auto",
+    type=click.Choice(OBSERVER_BACKENDS),
+    help="File watcher backend. `auto` uses inotify on Linux and falls back to polling.",
+)
+@click.option(
+    "--normalize-sql",
+    is_flag=True,
+    default=False,
+    help="Ignore comment and whitespace-only edits when deciding whether a save needs a rebuild.",
+)
+@click.option(
+    "--dbt-runner",
+    "dbt_runner_mode",
+    default="auto",
+    type=click.Choice(DBT_RUNNER_MODES),
+    help="`inprocess` keeps dbt loaded between saves (dbt>=1.5), `subprocess` starts dbt on every save. `auto` prefers in-process.",
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of builds that may run at once. Defaults to min(4, CPUs) with `--dbt-runner subprocess` and a warehouse target, and to 1 otherwise: the in-process runner and DuckDB targets run one build at a time.",
+)
+@click.option(
+    "--preview-timeout",
+    default=PREVIEW_TIMEOUT_SECONDS,
+    type=click.FloatRange(min=0),
+    help="Seconds before a preview query is interrupted. 0 disables the deadline.",
+)
+@click.option(
+    "--preview-strategy",
+    default="first_n",
+    type=click.Choice(PREVIEW_STRATEGIES),
+    help="Rows the preview shows: the first rows, a reservoir sample, rows spread across `--preview-key` values, or a system TABLESAMPLE.",
+)
+@click.option(
+    "--preview-key",
+    default=None,
+    help="Column to stratify `--preview-strategy stratified` by. Models without it are reservoir sampled.",
+)
+@click.option(
+    "--preview-seed",
+    default=PREVIEW_SEED,
+    type=int,
+    help="Seed for the sampling preview strategies, so the same data gives the same preview.",
+)
+@click.option(
+    "--preview-sample-percent",
+    default=PREVIEW_SAMPLE_PERCENT,
+    type=click.FloatRange(min=0, max=100, min_open=True),
+    help="Share of the model scanned by `--preview-strategy tablesample`.",
+)
+@click.option(
+    "--metrics-retention-days",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Compact iterations older than this many days into the Parquet archive once a day, like `fst metrics compact`. Off by default.",
+)
+@click.option(
+    "--no-workbench",
+    is_flag=True,
+    default=False,
+    help="Only run the file watcher, e.g. for benchmarks or when the workbench runs elsewhere.",
+)
+def start(
+    path: str,
+    observer_backend: str,
+    normalize_sql: bool,
+    dbt_runner_mode: str,
+    workers: Optional[int],
+    preview_timeout: float,
+    preview_strategy: str,
+    preview_key: str,
+    preview_seed: int,
+    preview_sample_percent: float,
+    metrics_retention_days: Optional[int],
+    no_workbench: bool,
+) -> None:
+    if preview_strategy == "stratified" and not preview_key:
+        raise click.UsageError("`--preview-strategy stratified` needs a `--preview-key` column.")
+    # the watcher would only fail on these in its own process, after the workbench is up
+    try:
+        check_storage_version(METRICS_DB_FILE, METRICS_STORAGE_REMEDY)
+        if get_target_config().get("type") == "duckdb":
+            check_storage_version(get_duckdb_file_path(), TARGET_STORAGE_REMEDY)
+    except StorageVersionError as e:
+        raise click.ClickException(str(e))
+    # shared with the watcher and the workbench through the environment they inherit
+    os.environ.setdefault(READ_SERVER_AUTHKEY_ENV, secrets.token_hex(16))
     log_queue = multiprocessing.Queue()
     dir_watcher_process = multiprocessing.Process(
-        target=start_directory_watcher, args=(path, log_queue)
+        target=start_directory_watcher,
+        args=(
+            path,
+            log_queue,
+            observer_backend,
+            normalize_sql,
+            dbt_runner_mode,
+            workers,
+            preview_timeout,
+            PreviewStrategy(
+                preview_strategy, preview_key, preview_seed, preview_sample_percent
+            ),
+            metrics_retention_days,
+        ),
     )
     streamlit_process = multiprocessing.Process(target=start_streamlit)
     listener = multiprocessing.Process(target=listener_process, args=(log_queue,))
 
     listener.start()
     dir_watcher_process.start()
-    streamlit_process.start()
+    if not no_workbench:
+        streamlit_process.start()
 
     dir_watcher_process.join()
-    streamlit_process.join()
+    if not no_workbench:
+        streamlit_process.join()
 
     log_queue.put(None)
     listener.join()
 
+@main.group()
+def bench() -> None:
+    pass
+
+@bench.command("watcher")
+@click.option(
+    "--backend",
+    "-b",
+    "backends",
+    multiple=True,
+    default=["auto", "polling"],
+    type=click.Choice(OBSERVER_BACKENDS),
+    help="Observer backend(s) to benchmark. Repeat to compare several.",
+)
+@click.option("--files", default=2000, help="Number of dummy SQL models to watch.")
+@click.option("--iterations", default=20, help="Number of file writes to time.")
+def bench_watcher(backends: List[str], files: int, iterations: int) -> None:
+    """Time from a file write to `DynamicQueryHandler.on_modified` firing."""
+    from fst.benchmarks.watcher_latency import measure_watcher_latency
+
+    results = [
+        measure_watcher_latency(backend, num_files=files, iterations=iterations)
+        for backend in backends
+    ]
+    logging.getLogger(__name__).info(
+        "Watcher latency\n"
+        + tabulate(results, headers="keys", tablefmt="grid", floatfmt=".2f")
+    )
+
+@bench.command("dbt-runner")
+@click.option(
+    "--model",
+    "-m",
+    "model_file",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+    help="SQL model file to edit and rebuild.",
+)
+@click.option(
+    "--mode",
+    "modes",
+    multiple=True,
+    default=["subprocess", "inprocess"],
+    type=click.Choice(DBT_RUNNER_MODES[1:]),
+    help="dbt runner mode(s) to benchmark.",
+)
+@click.option("--iterations", default=5, help="Number of edits to time per mode.")
+def bench_dbt_runner(model_file: str, modes: List[str], iterations: int) -> None:
+    """Save-to-result latency of the in-process and subprocess dbt runners."""
+    from fst.benchmarks.dbt_runner_latency import measure_dbt_runner_latency
+
+    results = [
+        measure_dbt_runner_latency(mode, model_file, iterations=iterations)
+        for mode in modes
+    ]
+    logging.getLogger(__name__).info(
+        "dbt runner latency\n"
+        + tabulate(results, headers="keys", tablefmt="grid", floatfmt=".2f")
+    )
+
+@bench.command("lock-stress")
+@click.option(
+    "--model",
+    "-m",
+    "model_file",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+    help="SQL model file to edit and rebuild.",
+)
+@click.option(
+    "--mode",
+    "modes",
+    multiple=True,
+    default=["server", "direct"],
+    type=click.Choice(["server", "direct"]),
+    help="How readers reach the databases: through a read server, or by opening them directly.",
+)
+@click.option("--builds", default=5, help="Number of rebuilds to run.")
+@click.option("--readers", default=4, help="Number of concurrent dashboard readers.")
+def bench_lock_stress(model_file: str, modes: List[str], builds: int, readers: int) -> None:
+    """Read errors and latency of dashboard reads while builds and metrics writes run."""
+    from fst.benchmarks.lock_stress import measure_lock_stress
+
+    results = [
+        measure_lock_stress(mode, model_file, builds=builds, readers=readers)
+        for mode in modes
+    ]
+    logging.getLogger(__name__).info(
+        "Lock stress\n"
+        + tabulate(results, headers="keys", tablefmt="grid", floatfmt=".2f")
+    )
+
+@bench.command("generate-project")
+@click.argument("project_dir", type=click.Path(file_okay=False, resolve_path=True))
+@click.option("--models", "num_models", default=50, help="Number of models.")
+@click.option("--depth", default=5, help="Number of levels in the model DAG.")
+@click.option("--rows", "rows_per_source", default=10_000, help="Rows per source table.")
+@click.option("--sources", "num_sources", default=3, help="Number of source tables.")
+@click.option("--seed", default=42, help="Seed for the shape of the model DAG.")
+def bench_generate_project(
+    project_dir: str,
+    num_models: int,
+    depth: int,
+    rows_per_source: int,
+    num_sources: int,
+    seed: int,
+) -> None:
+    """Generate a synthetic DuckDB-backed dbt project to try fst on."""
+    from fst.benchmarks.synthetic_project import generate_project
+
+    file_paths = generate_project(
+        project_dir, num_models, depth, rows_per_source, num_sources, seed
+    )
+    logging.getLogger(__name__).info(
+        f"Generated {len(file_paths)} model(s) in {depth} level(s) in {project_dir}"
+    )
+
+@bench.command("suite")
+@click.option("--models", "num_models", default=50, help="Number of models.")
+@click.option("--depth", default=5, help="Number of levels in the model DAG.")
+@click.option("--rows", "rows_per_source", default=10_000, help="Rows per source table.")
+@click.option("--sources", "num_sources", default=3, help="Number of source tables.")
+@click.option("--edits", "num_edits", default=20, help="Number of saves to measure.")
+@click.option("--warmup", "warmup_edits", default=1, help="Saves to run before measuring.")
+@click.option(
+    "--dbt-runner",
+    "dbt_runner_mode",
+    default="auto",
+    type=click.Choice(DBT_RUNNER_MODES),
+    help="dbt runner the watcher uses.",
+)
+@click.option("--seed", default=42, help="Seed for the project shape and the order of edits.")
+@click.option(
+    "--project-dir",
+    default=None,
+    type=click.Path(file_okay=False, resolve_path=True),
+    help="Where to generate the project. Defaults to a temporary directory that is removed afterwards.",
+)
+@click.option(
+    "--results-db",
+    default=BENCH_RESULTS_DB_FILE,
+    type=click.Path(dir_okay=False, resolve_path=True),
+    help="DuckDB file every run is stored in, to compare against later runs.",
+)
+@click.option(
+    "--regression-threshold",
+    default=BENCH_REGRESSION_THRESHOLD,
+    type=click.FloatRange(min=0),
+    help="Relative slowdown against the baseline run that counts as a regression.",
+)
+@click.option(
+    "--fail-on-regression",
+    is_flag=True,
+    default=False,
+    help="Exit with status 1 when a regression is found, e.g. in CI.",
+)
+def bench_suite(
+    num_models: int,
+    depth: int,
+    rows_per_source: int,
+    num_sources: int,
+    num_edits: int,
+    warmup_edits: int,
+    dbt_runner_mode: str,
+    seed: int,
+    project_dir: Optional[str],
+    results_db: str,
+    regression_threshold: float,
+    fail_on_regression: bool,
+) -> None:
+    """Save-to-preview latency, CPU and RSS of `fst start` on a generated dbt project.
+
+    Each run is stored in --results-db and compared with the latest run of the same
+    scenario on another fst version.
+    """
+    import shutil
+    import tempfile
+    from fst.benchmarks.suite import describe_run, find_regressions, run_suite, save_bench_run
+    from fst.benchmarks.synthetic_project import generate_project
+
+    bench_logger = logging.getLogger(__name__)
+    temporary_dir = None
+    if project_dir is None:
+        temporary_dir = tempfile.mkdtemp(prefix="fst_bench_project_")
+        project_dir = temporary_dir
+    try:
+        file_paths = generate_project(
+            project_dir, num_models, depth, rows_per_source, num_sources, seed
+        )
+        results = run_suite(
+            project_dir, file_paths, num_edits, warmup_edits, dbt_runner_mode, seed
+        )
+    finally:
+        if temporary_dir is not None:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+
+    run = describe_run(num_models, depth, rows_per_source, num_edits, dbt_runner_mode, results)
+    save_bench_run(results_db, run)
+    bench_logger.info(
+        f"fst {run['fst_version']}, {run['scenario']}\n"
+        + tabulate([results], headers="keys", tablefmt="grid", floatfmt=".2f")
+    )
+    regressions = find_regressions(results_db, run, regression_threshold)
+    if not regressions:
+        bench_logger.info(f"No regressions against earlier runs in {results_db}.")
+        return
+    bench_logger.warning(
+        "Regressions against the baseline run\n"
+        + tabulate(regressions, headers="keys", tablefmt="grid", floatfmt=".2f")
+    )
+    if fail_on_regression:
+        raise SystemExit(1)
+
+@main.group()
+def metrics() -> None:
+    pass
+
+@metrics.command("compact")
+@click.option(
+    "--retention-days",
+    default=METRICS_RETENTION_DAYS,
+    type=click.IntRange(min=0),
+    help="Days of full iteration detail to keep in the metrics database.",
+)
+@click.option(
+    "--archive-dir",
+    default=METRICS_ARCHIVE_DIR,
+    type=click.Path(file_okay=False, resolve_path=True),
+    help="Directory of the day/model partitioned Parquet archive.",
+)
+def metrics_compact(retention_days: int, archive_dir: str) -> None:
+    """Archive old iterations to Parquet and roll them up into daily per-model aggregates."""
+    from fst.metrics_compaction import compact_metrics
+    from fst.metrics_writer import connect_metrics, run_migrations
+
+    try:
+        duckdb_conn = connect_metrics(METRICS_DB_FILE)
+    except StorageVersionError as e:
+        raise click.ClickException(str(e))
+    with duckdb_conn:
+        run_migrations(duckdb_conn)
+        result = compact_metrics(duckdb_conn, retention_days, archive_dir)
+    if result.archived_iterations == 0:
+        logging.getLogger(__name__).info(
+            f"No iterations older than {retention_days} day(s) to compact."
+        )
+
+@metrics.command("import")
+@click.argument(
+    "export_dir", type=click.Path(exists=True, file_okay=False, resolve_path=True)
+)
+def metrics_import(export_dir: str) -> None:
+    """Load a metrics history exported with `EXPORT DATABASE`, e.g. from an older DuckDB."""
+    from fst.metrics_writer import import_metrics
+
+    try:
+        moved_to = import_metrics(export_dir, METRICS_DB_FILE)
+    except FileExistsError as e:
+        raise click.ClickException(str(e))
+    if moved_to is not None:
+        logging.getLogger(__name__).info(f"Moved the old metrics database to {moved_to}.")
+    logging.getLogger(__name__).info(f"Imported {export_dir} into {METRICS_DB_FILE}.")
+
+@metrics.command("export-trace")
+@click.option(
+    "--format",
+    "trace_format",
+    default="chrome",
+    type=click.Choice(TRACE_EXPORT_FORMATS),
+    help="Chrome trace events (chrome://tracing, Perfetto) or OTLP/JSON.",
+)
+@click.option(
+    "--output",
+    "-o",
+    default=None,
+    type=click.Path(dir_okay=False, resolve_path=True),
+    help="File to write. Defaults to fst_trace.<format>.json.",
+)
+@click.option(
+    "--iterations",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of latest iterations to export.",
+)
+@click.option("--iteration-id", default=None, help="Export only this iteration.")
+@click.option(
+    "--model",
+    default=None,
+    help="Export only iterations of this model file, e.g. models/staging/orders.sql.",
+)
+def metrics_export_trace(
+    trace_format: str,
+    output: Optional[str],
+    iterations: int,
+    iteration_id: Optional[str],
+    model: Optional[str],
+) -> None:
+    """Export the per-stage spans of recent iterations as a trace file."""
+    from fst.read_server import METRICS_DATABASE, ReadClient, get_authkey
+    from fst.spans import SPAN_ROWS_QUERY, get_span_rows_params, to_trace_json
+
+    # reads through a running watcher when launched from its environment, else opens the file
+    span_rows = (
+        ReadClient(authkey=get_authkey())
+        .execute(
+            METRICS_DATABASE,
+            SPAN_ROWS_QUERY,
+            get_span_rows_params(iterations, iteration_id, model),
+        )
+        .to_pylist()
+    )
+    if not span_rows:
+        logging.getLogger(__name__).info("No spans recorded for the selected iteration(s).")
+        return
+    output = output or os.path.join(CURRENT_WORKING_DIR, f"fst_trace.{trace_format}.json")
+    with open(output, "w") as file:
+        file.write(to_trace_json(span_rows, trace_format))
+    logging.getLogger(__name__).info(
+        f"Wrote {len(span_rows)} span(s) of {len({row['iteration_id'] for row in span_rows})} iteration(s) to {output}"
+    )
+
 if __name__ == "__main__":
     main()
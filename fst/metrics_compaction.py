@@ -0,0 +1,244 @@
+import glob
+import logging
+import os
+import shutil
+import uuid
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple
+
+import duckdb
+
+from fst.change_detection import SKIPPED_UNCHANGED_STATUS
+from fst.preview import quote_literal
+
+logger = logging.getLogger(__name__)
+
+STAGING_PREFIX = ".staging_"
+# child tables whose rows belong to an iteration and are archived with it
+CHILD_TABLES = ["node_timings", "column_profiles", "spans", "performance_regressions"]
+BLOB_HASH_COLUMNS = ["compiled_query_hash", "result_preview_hash", "dbt_log_hash"]
+# rollups are keyed on the model's file, so models/staging/orders.sql and
+# models/marts/orders.sql stay apart
+MODEL_SQL = "coalesce(modified_sql_file, 'unknown')"
+# the archive partition of a model: its file name for browsing, and a hash of its path
+# because a partition value can't hold the path's slashes
+MODEL_PARTITION_SQL = (
+    r"coalesce(nullif(regexp_extract(modified_sql_file, '([^/\\]+)\.sql$', 1), ''), 'unknown')"
+    f" || '-' || left(md5({MODEL_SQL}), 8)"
+)
+
+
+class CompactionResult(NamedTuple):
+    archived_iterations: int
+    rolled_up_days: List[date]
+    archived_blobs: int
+
+
+def get_archive_glob(archive_dir: str, table: str) -> str:
+    return os.path.join(archive_dir, table, "**", "*.parquet")
+
+
+def select_blob_hashes(relation: str) -> str:
+    return " UNION ".join(
+        f"SELECT {column} FROM {relation} WHERE {column} IS NOT NULL"
+        for column in BLOB_HASH_COLUMNS
+    )
+
+
+def publish_staged_archives(archive_dir: str) -> None:
+    """Move Parquet files from staging directories into the archive.
+
+    DuckDB names the files of a partitioned COPY data_0.parquet, data_1.parquet, ...,
+    so every file gets the id of its compaction run as a prefix to avoid overwriting
+    earlier runs that wrote into the same day/model partition.
+    """
+    if not os.path.isdir(archive_dir):
+        return
+    for staging_name in os.listdir(archive_dir):
+        if not staging_name.startswith(STAGING_PREFIX):
+            continue
+        run_id = staging_name[len(STAGING_PREFIX) :]
+        staging_dir = os.path.join(archive_dir, staging_name)
+        for root, _, file_names in os.walk(staging_dir):
+            destination_dir = os.path.join(archive_dir, os.path.relpath(root, staging_dir))
+            os.makedirs(destination_dir, exist_ok=True)
+            for file_name in file_names:
+                os.replace(
+                    os.path.join(root, file_name),
+                    os.path.join(destination_dir, f"{run_id}_{file_name}"),
+                )
+        shutil.rmtree(staging_dir)
+
+
+ROLLUP_COLUMNS = [
+    "iterations",
+    "skipped_unchanged",
+    "failures",
+    "failure_rate",
+    "p50_build_time",
+    "p95_build_time",
+    "p50_query_time",
+    "p95_query_time",
+]
+
+
+def roll_up_days(
+    duckdb_conn: duckdb.DuckDBPyConnection, archive_dirs: List[str], days: List[date]
+) -> None:
+    """Recompute the daily rollups of `days` from the iterations archived in `archive_dirs`."""
+    metrics_globs = [
+        get_archive_glob(archive_dir, "metrics")
+        for archive_dir in archive_dirs
+        if glob.glob(get_archive_glob(archive_dir, "metrics"), recursive=True)
+    ]
+    if not days or not metrics_globs:
+        return
+    built = f"dbt_build_status != '{SKIPPED_UNCHANGED_STATUS}'"
+    duckdb_conn.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE fst_rollups AS
+        SELECT
+            CAST(day AS DATE) AS day,
+            {MODEL_SQL} AS model,
+            count(*) FILTER (WHERE {built}) AS iterations,
+            count(*) FILTER (WHERE NOT ({built})) AS skipped_unchanged,
+            count(*) FILTER (WHERE dbt_build_status = 'failure') AS failures,
+            count(*) FILTER (WHERE dbt_build_status = 'failure')
+                / nullif(count(*) FILTER (WHERE {built}), 0) AS failure_rate,
+            quantile_cont(dbt_build_time, 0.5) FILTER (WHERE {built}) AS p50_build_time,
+            quantile_cont(dbt_build_time, 0.95) FILTER (WHERE {built}) AS p95_build_time,
+            quantile_cont(query_time, 0.5) FILTER (WHERE {built}) AS p50_query_time,
+            quantile_cont(query_time, 0.95) FILTER (WHERE {built}) AS p95_query_time
+        FROM read_parquet(?, hive_partitioning = 1, union_by_name = 1)
+        WHERE CAST(day AS DATE) IN (SELECT unnest(?::DATE[]))
+        GROUP BY ALL
+        """,
+        [metrics_globs, days],
+    )
+    duckdb_conn.execute(
+        f"""
+        INSERT INTO metrics_daily_rollups (day, model, {', '.join(ROLLUP_COLUMNS)})
+        SELECT day, model, {', '.join(ROLLUP_COLUMNS)} FROM fst_rollups
+        ON CONFLICT (day, model) DO UPDATE SET
+            {', '.join(f"{column} = excluded.{column}" for column in ROLLUP_COLUMNS)}
+        """
+    )
+    # rows of these days under keys they no longer have, e.g. the bare file names
+    # rollups were keyed on before they were keyed on the path
+    duckdb_conn.execute(
+        """
+        DELETE FROM metrics_daily_rollups
+        WHERE day IN (SELECT day FROM fst_rollups)
+        AND NOT EXISTS (
+            SELECT 1 FROM fst_rollups
+            WHERE fst_rollups.day = metrics_daily_rollups.day
+            AND fst_rollups.model = metrics_daily_rollups.model
+        )
+        """
+    )
+
+
+def compact_metrics(
+    duckdb_conn: duckdb.DuckDBPyConnection, retention_days: int, archive_dir: str
+) -> CompactionResult:
+    """Archive iterations older than `retention_days` to Parquet and roll them up per day.
+
+    Archived iterations, their child rows and the blobs only they refer to are removed
+    from the database. The archive is partitioned by day and model, and stays
+    queryable with `read_parquet('<archive_dir>/metrics/**/*.parquet', hive_partitioning = 1)`.
+    """
+    # whole days only, so a day is never split between the database and the archive
+    cutoff = datetime.combine(
+        datetime.utcnow().date() - timedelta(days=retention_days), datetime.min.time()
+    )
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "_" + uuid.uuid4().hex[:8]
+    staging_dir = os.path.join(archive_dir, f"{STAGING_PREFIX}{run_id}")
+    # files left behind by a run that stopped between its commit and publishing
+    publish_staged_archives(archive_dir)
+
+    duckdb_conn.begin()
+    try:
+        duckdb_conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE fst_compacted AS
+            SELECT *, CAST(timestamp AS DATE) AS day, {MODEL_PARTITION_SQL} AS model
+            FROM metrics
+            WHERE timestamp < ?
+            """,
+            [cutoff],
+        )
+        (archived_iterations,) = duckdb_conn.execute(
+            "SELECT count(*) FROM fst_compacted"
+        ).fetchone()
+        if archived_iterations == 0:
+            duckdb_conn.rollback()
+            return CompactionResult(0, [], 0)
+        days = [
+            day
+            for (day,) in duckdb_conn.execute(
+                "SELECT DISTINCT day FROM fst_compacted ORDER BY day"
+            ).fetchall()
+        ]
+
+        os.makedirs(staging_dir, exist_ok=True)
+        archived_queries = {"metrics": "SELECT * FROM fst_compacted"}
+        for table in CHILD_TABLES:
+            archived_queries[table] = f"""
+                SELECT child.*, compacted.day, compacted.model
+                FROM {table} AS child
+                JOIN fst_compacted AS compacted ON child.iteration_id = compacted.iteration_id
+            """
+        for table, query in archived_queries.items():
+            duckdb_conn.execute(
+                f"COPY ({query}) TO {quote_literal(os.path.join(staging_dir, table))} "
+                "(FORMAT PARQUET, PARTITION_BY (day, model))"
+            )
+
+        # rolled up before the delete, so a failed rollup leaves the iterations in place;
+        # archived days may already hold iterations from earlier runs
+        roll_up_days(duckdb_conn, [archive_dir, staging_dir], days)
+
+        for table in CHILD_TABLES:
+            duckdb_conn.execute(
+                f"DELETE FROM {table} WHERE iteration_id IN (SELECT iteration_id FROM fst_compacted)"
+            )
+        duckdb_conn.execute("DELETE FROM metrics WHERE timestamp < ?", [cutoff])
+
+        # blobs only archived iterations refer to move along with them
+        duckdb_conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE fst_archived_blobs AS
+            SELECT hash FROM blobs
+            WHERE hash IN ({select_blob_hashes("fst_compacted")})
+            AND hash NOT IN ({select_blob_hashes("metrics")})
+            """
+        )
+        (archived_blobs,) = duckdb_conn.execute(
+            "SELECT count(*) FROM fst_archived_blobs"
+        ).fetchone()
+        if archived_blobs:
+            os.makedirs(os.path.join(staging_dir, "blobs"), exist_ok=True)
+            duckdb_conn.execute(
+                f"""
+                COPY (SELECT * FROM blobs WHERE hash IN (SELECT hash FROM fst_archived_blobs))
+                TO {quote_literal(os.path.join(staging_dir, "blobs", "data.parquet"))} (FORMAT PARQUET)
+                """
+            )
+
+        duckdb_conn.execute(
+            "DELETE FROM blobs WHERE hash IN (SELECT hash FROM fst_archived_blobs)"
+        )
+        duckdb_conn.commit()
+    except Exception:
+        duckdb_conn.rollback()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    publish_staged_archives(archive_dir)
+    # hand the space of the deleted rows back for reuse
+    duckdb_conn.execute("CHECKPOINT")
+    logger.info(
+        f"Archived {archived_iterations} iteration(s) older than {cutoff:%Y-%m-%d} "
+        f"and {archived_blobs} blob(s) to {archive_dir}, rolled up {len(days)} day(s)."
+    )
+    return CompactionResult(archived_iterations, days, archived_blobs)
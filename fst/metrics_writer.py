@@ -0,0 +1,691 @@
+import atexit
+import logging
+import os
+import queue
+import re
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from threading import RLock, Thread
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import duckdb
+
+from fst.blob_store import ARROW_MEDIA_TYPE, JSON_MEDIA_TYPE, SQL_MEDIA_TYPE, make_blob
+from fst.db_utils import STORAGE_VERSION, check_storage_version, get_storage_version
+from fst.metrics_compaction import compact_metrics
+from fst.preview import quote_literal
+from fst.spans import finish_persist_spans
+from fst.config_defaults import (
+    METRICS_ARCHIVE_DIR,
+    METRICS_CLOSE_RETRIES,
+    METRICS_COMPACTION_INTERVAL_SECONDS,
+    METRICS_DB_FILE,
+    METRICS_FLUSH_BATCH_SIZE,
+    METRICS_FLUSH_INTERVAL_SECONDS,
+    METRICS_IDLE_CLOSE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    # SQL statements, or a function for changes SQL alone can't express
+    steps: Union[List[str], Callable[[duckdb.DuckDBPyConnection], None]]
+
+
+def move_payloads_to_blobs(duckdb_conn: duckdb.DuckDBPyConnection) -> None:
+    duckdb_conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash VARCHAR PRIMARY KEY,
+            media_type VARCHAR,
+            codec VARCHAR,
+            raw_size BIGINT,
+            content BLOB
+        )
+        """
+    )
+    for column in ["compiled_query_hash", "result_preview_hash", "dbt_log_hash"]:
+        duckdb_conn.execute(f"ALTER TABLE metrics ADD COLUMN IF NOT EXISTS {column} VARCHAR")
+    # Arrow previews win over the JSON ones recorded before them
+    for payload_column, hash_column, media_type in [
+        ("compiled_query", "compiled_query_hash", SQL_MEDIA_TYPE),
+        ("result_preview_arrow", "result_preview_hash", ARROW_MEDIA_TYPE),
+        ("result_preview_json", "result_preview_hash", JSON_MEDIA_TYPE),
+    ]:
+        payloads = duckdb_conn.execute(
+            f"""
+            SELECT DISTINCT {payload_column} FROM metrics
+            WHERE {payload_column} IS NOT NULL AND {hash_column} IS NULL
+            """
+        ).fetchall()
+        for (payload,) in payloads:
+            blob = make_blob(payload, media_type)
+            duckdb_conn.execute(
+                f"INSERT OR IGNORE INTO blobs ({', '.join(blob.keys())}) VALUES (?, ?, ?, ?, ?)",
+                list(blob.values()),
+            )
+            duckdb_conn.execute(
+                f"""
+                UPDATE metrics SET {hash_column} = ?
+                WHERE {payload_column} = ? AND {hash_column} IS NULL
+                """,
+                [blob["hash"], payload],
+            )
+
+
+def add_metrics_sequence(duckdb_conn: duckdb.DuckDBPyConnection) -> None:
+    duckdb_conn.execute("ALTER TABLE metrics ADD COLUMN IF NOT EXISTS seq BIGINT")
+    # number the existing history in timestamp order, new rows continue from the sequence
+    duckdb_conn.execute(
+        """
+        UPDATE metrics SET seq = numbered.seq
+        FROM (
+            SELECT rowid AS row_id, row_number() OVER (ORDER BY timestamp) AS seq FROM metrics
+        ) AS numbered
+        WHERE metrics.rowid = numbered.row_id
+        """
+    )
+    (next_seq,) = duckdb_conn.execute(
+        "SELECT coalesce(max(seq), 0) + 1 FROM metrics"
+    ).fetchone()
+    duckdb_conn.execute(f"CREATE SEQUENCE IF NOT EXISTS metrics_seq START {next_seq}")
+    duckdb_conn.execute(
+        "CREATE INDEX IF NOT EXISTS metrics_modified_sql_file_idx ON metrics (modified_sql_file)"
+    )
+
+
+def get_altered_table(statement: str) -> Optional[str]:
+    match = re.match(r"\s*ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(\w+)", statement, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+@contextmanager
+def indexes_dropped(duckdb_conn: duckdb.DuckDBPyConnection, table: str) -> Iterator[None]:
+    """Drop the indexes of `table` and recreate them afterwards, in the same transaction.
+
+    DuckDB refuses to alter a table that has an index ("Dependency Error: Cannot
+    alter entry"), so ALTER TABLE steps run inside this, and so should migration
+    functions that alter an indexed table.
+    """
+    indexes = duckdb_conn.execute(
+        "SELECT index_name, sql FROM duckdb_indexes() WHERE table_name = ?", [table]
+    ).fetchall()
+    for index_name, _ in indexes:
+        duckdb_conn.execute(f"DROP INDEX {index_name}")
+    yield
+    for _, index_sql in indexes:
+        duckdb_conn.execute(index_sql)
+
+
+# Append only: a released migration is never edited, later changes get a new version.
+# The early steps use IF NOT EXISTS because databases created before migrations existed
+# already have some of these tables and columns.
+MIGRATIONS = [
+    Migration(
+        1,
+        "create metrics",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS metrics (
+                timestamp TIMESTAMP,
+                modified_sql_file TEXT,
+                compiled_sql_file TEXT,
+                compiled_query VARCHAR,
+                dbt_build_status TEXT,
+                duckdb_file_name TEXT,
+                dbt_build_time REAL,
+                query_time REAL,
+                result_preview_json TEXT
+            )
+            """
+        ],
+    ),
+    Migration(
+        2,
+        "split compile and preview timings, store Arrow previews",
+        [
+            f"ALTER TABLE metrics ADD COLUMN IF NOT EXISTS {column} {column_type}"
+            for column, column_type in [
+                ("compile_time", "REAL"),
+                ("preview_time", "REAL"),
+                ("iteration_id", "VARCHAR"),
+                ("preview_status", "VARCHAR"),
+                ("result_preview_arrow", "BLOB"),
+                ("preview_strategy", "VARCHAR"),
+            ]
+        ],
+    ),
+    Migration(
+        3,
+        "create node_timings",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS node_timings (
+                iteration_id VARCHAR,
+                invocation_id VARCHAR,
+                unique_id VARCHAR,
+                resource_type VARCHAR,
+                status VARCHAR,
+                thread_id VARCHAR,
+                execution_time REAL,
+                compile_time REAL,
+                execute_time REAL,
+                rows_affected BIGINT,
+                failures INTEGER,
+                adapter_response VARCHAR,
+                message VARCHAR
+            )
+            """
+        ],
+    ),
+    Migration(
+        4,
+        "create column_profiles",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS column_profiles (
+                iteration_id VARCHAR,
+                column_name VARCHAR,
+                column_type VARCHAR,
+                row_count BIGINT,
+                null_count BIGINT,
+                approx_distinct BIGINT,
+                min_value VARCHAR,
+                max_value VARCHAR,
+                top_k VARCHAR
+            )
+            """
+        ],
+    ),
+    Migration(5, "store compiled SQL, previews and logs once in blobs", move_payloads_to_blobs),
+    Migration(
+        6,
+        "drop the inline payload columns replaced by blobs",
+        [
+            "ALTER TABLE metrics DROP COLUMN compiled_query",
+            "ALTER TABLE metrics DROP COLUMN result_preview_arrow",
+            "ALTER TABLE metrics DROP COLUMN result_preview_json",
+        ],
+    ),
+    Migration(
+        7,
+        "create metrics_daily_rollups",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS metrics_daily_rollups (
+                day DATE,
+                model VARCHAR,
+                iterations BIGINT,
+                skipped_unchanged BIGINT,
+                failures BIGINT,
+                failure_rate DOUBLE,
+                p50_build_time DOUBLE,
+                p95_build_time DOUBLE,
+                p50_query_time DOUBLE,
+                p95_query_time DOUBLE,
+                PRIMARY KEY (day, model)
+            )
+            """
+        ],
+    ),
+    Migration(
+        8,
+        "number metrics rows for incremental reads and index them by model",
+        add_metrics_sequence,
+    ),
+    Migration(
+        9,
+        "create spans",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS spans (
+                iteration_id VARCHAR,
+                span_id VARCHAR,
+                parent_span_id VARCHAR,
+                name VARCHAR,
+                start_time TIMESTAMP,
+                start_offset REAL,
+                duration REAL,
+                attributes VARCHAR
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS spans_iteration_id_idx ON spans (iteration_id)",
+        ],
+    ),
+    Migration(
+        10,
+        "create performance baselines and regressions",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS model_baselines (
+                modified_sql_file VARCHAR,
+                metric VARCHAR,
+                observations BIGINT,
+                ewma DOUBLE,
+                ewm_variance DOUBLE,
+                p50 DOUBLE,
+                p95 DOUBLE,
+                p50_state VARCHAR,
+                p95_state VARCHAR,
+                last_iteration_id VARCHAR,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (modified_sql_file, metric)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS performance_regressions (
+                iteration_id VARCHAR,
+                metric VARCHAR,
+                value DOUBLE,
+                baseline_ewma DOUBLE,
+                baseline_p50 DOUBLE,
+                baseline_p95 DOUBLE,
+                change_seconds DOUBLE,
+                change_percent DOUBLE,
+                z_score DOUBLE
+            )
+            """,
+        ],
+    ),
+]
+
+# rows keyed by content, where a row that's already stored is simply skipped
+DEDUPLICATED_TABLES = {"blobs"}
+# rows holding the latest state of a key, with the key columns a new row updates
+UPSERTED_TABLES = {"model_baselines": ("modified_sql_file", "metric")}
+
+
+def get_schema_version(duckdb_conn: duckdb.DuckDBPyConnection) -> int:
+    duckdb_conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR,
+            applied_at TIMESTAMP
+        )
+        """
+    )
+    (version,) = duckdb_conn.execute(
+        "SELECT coalesce(max(version), 0) FROM schema_migrations"
+    ).fetchone()
+    return version
+
+
+def run_migrations(duckdb_conn: duckdb.DuckDBPyConnection) -> int:
+    """Apply every migration newer than the database, each in its own transaction."""
+    current_version = get_schema_version(duckdb_conn)
+    for migration in MIGRATIONS:
+        if migration.version <= current_version:
+            continue
+        duckdb_conn.begin()
+        try:
+            if callable(migration.steps):
+                migration.steps(duckdb_conn)
+            else:
+                for statement in migration.steps:
+                    table = get_altered_table(statement)
+                    with indexes_dropped(duckdb_conn, table) if table else nullcontext():
+                        duckdb_conn.execute(statement)
+            duckdb_conn.execute(
+                "INSERT INTO schema_migrations VALUES (?, ?, ?)",
+                [migration.version, migration.description, datetime.utcnow()],
+            )
+            duckdb_conn.commit()
+        except Exception:
+            duckdb_conn.rollback()
+            raise
+        logger.info(
+            f"Migrated metrics database to version {migration.version}: {migration.description}"
+        )
+        current_version = migration.version
+    return current_version
+
+
+METRICS_STORAGE_REMEDY = (
+    "Export its history with DuckDB {release} (e.g. in another virtualenv with "
+    "`pip install duckdb=={release}`, run `duckdb.connect('{db_file}')"
+    ".execute(\"EXPORT DATABASE 'fst_metrics_export'\")` in Python), then run "
+    "`fst metrics import fst_metrics_export`, which moves the old file aside and loads the export."
+)
+
+
+def connect_metrics(db_file: str) -> duckdb.DuckDBPyConnection:
+    check_storage_version(db_file, METRICS_STORAGE_REMEDY)
+    return duckdb.connect(db_file)
+
+
+def restart_metrics_sequence(duckdb_conn: duckdb.DuckDBPyConnection) -> None:
+    """Continue metrics_seq above every imported row, whatever START the export gave it."""
+    sequence = duckdb_conn.execute(
+        "SELECT start_value FROM duckdb_sequences() WHERE sequence_name = 'metrics_seq'"
+    ).fetchone()
+    if sequence is None:
+        # exported before migration 8, which numbers the rows and creates the sequence
+        return
+    (next_seq,) = duckdb_conn.execute(
+        "SELECT coalesce(max(seq), 0) + 1 FROM metrics"
+    ).fetchone()
+    if next_seq > sequence[0]:
+        duckdb_conn.execute("DROP SEQUENCE metrics_seq")
+        duckdb_conn.execute(f"CREATE SEQUENCE metrics_seq START {next_seq}")
+
+
+def import_metrics(export_dir: str, db_file: str = METRICS_DB_FILE) -> Optional[str]:
+    """Load a metrics history saved with `EXPORT DATABASE` into a new `db_file`.
+
+    This is how a history written by an older DuckDB moves to the pinned one. A
+    `db_file` in another storage format is moved aside first, and where it went is
+    returned. The import is migrated to the current schema.
+    """
+    if get_storage_version(db_file) == STORAGE_VERSION:
+        raise FileExistsError(
+            f"{db_file} is readable as it is, move it aside to import into a new one."
+        )
+    moved_to = None
+    if os.path.exists(db_file):
+        moved_to = f"{db_file}.{datetime.utcnow():%Y%m%d%H%M%S}.bak"
+        for suffix in ["", ".wal"]:
+            if os.path.exists(f"{db_file}{suffix}"):
+                os.replace(f"{db_file}{suffix}", f"{moved_to}{suffix}")
+    try:
+        with duckdb.connect(db_file) as duckdb_conn:
+            duckdb_conn.execute(f"IMPORT DATABASE {quote_literal(export_dir)}")
+            restart_metrics_sequence(duckdb_conn)
+            run_migrations(duckdb_conn)
+    except Exception:
+        # leave things as they were, rather than a half imported history
+        for suffix in ["", ".wal"]:
+            if os.path.exists(f"{db_file}{suffix}"):
+                os.remove(f"{db_file}{suffix}")
+            if moved_to is not None and os.path.exists(f"{moved_to}{suffix}"):
+                os.replace(f"{moved_to}{suffix}", f"{db_file}{suffix}")
+        raise
+    return moved_to
+
+
+class MetricsRecord(NamedTuple):
+    metrics_row: Dict[str, Any]
+    child_rows: Dict[str, List[Dict[str, Any]]]
+
+
+def group_rows(records: List[MetricsRecord]) -> Dict[Tuple[str, Tuple[str, ...]], List[list]]:
+    """Rows of a batch grouped by table and column list, ready for one executemany each."""
+    grouped: Dict[Tuple[str, Tuple[str, ...]], List[list]] = {}
+    for record in records:
+        tables = [("metrics", [record.metrics_row]), *record.child_rows.items()]
+        for table, rows in tables:
+            for row in rows:
+                grouped.setdefault((table, tuple(row.keys())), []).append(list(row.values()))
+    # a key updated more than once in a batch is only written with its last row
+    for (table, columns), values in grouped.items():
+        if table in UPSERTED_TABLES:
+            key_indexes = [columns.index(column) for column in UPSERTED_TABLES[table]]
+            latest = {tuple(value[i] for i in key_indexes): value for value in values}
+            grouped[(table, columns)] = list(latest.values())
+    return grouped
+
+
+def get_insert_statement(table: str, columns: Tuple[str, ...]) -> str:
+    insert = f"INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    if table in DEDUPLICATED_TABLES:
+        return f"INSERT OR IGNORE {insert}"
+    if table in UPSERTED_TABLES:
+        # DuckDB needs the conflict target spelled out for a composite key
+        key_columns = UPSERTED_TABLES[table]
+        updates = ", ".join(
+            f"{column} = excluded.{column}" for column in columns if column not in key_columns
+        )
+        return f"INSERT {insert} ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+    return f"INSERT {insert}"
+
+
+def insert_rows(
+    duckdb_conn: duckdb.DuckDBPyConnection,
+    grouped: Dict[Tuple[str, Tuple[str, ...]], List[list]],
+) -> None:
+    duckdb_conn.begin()
+    try:
+        for (table, columns), values in grouped.items():
+            duckdb_conn.executemany(get_insert_statement(table, columns), values)
+        duckdb_conn.commit()
+    except Exception:
+        duckdb_conn.rollback()
+        raise
+
+
+class MetricsWriter:
+    """Appends iteration metrics to the metrics database from a background thread.
+
+    `write` only enqueues, so recording an iteration never waits on the database.
+    Queued iterations are flushed in batches through one connection. The connection
+    is closed again once the queue has been idle for a while, because DuckDB lets only
+    one process open the file and the workbench needs to read it. When the workbench
+    reads through the read server instead, `idle_close_seconds=None` keeps it open.
+
+    With `retention_days` set, the writer also compacts old iterations into the
+    Parquet archive every METRICS_COMPACTION_INTERVAL_SECONDS, between flushes.
+    """
+
+    def __init__(
+        self,
+        db_file: str = METRICS_DB_FILE,
+        flush_interval: float = METRICS_FLUSH_INTERVAL_SECONDS,
+        batch_size: int = METRICS_FLUSH_BATCH_SIZE,
+        idle_close_seconds: Optional[float] = METRICS_IDLE_CLOSE_SECONDS,
+        retention_days: Optional[int] = None,
+        archive_dir: str = METRICS_ARCHIVE_DIR,
+    ):
+        self.db_file = db_file
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.last_compacted_at: Optional[float] = None
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.idle_close_seconds = idle_close_seconds
+        self.queue: "queue.Queue[Optional[MetricsRecord]]" = queue.Queue()
+        self.pending: List[MetricsRecord] = []
+        self.connection: Optional[duckdb.DuckDBPyConnection] = None
+        self.connection_lock = RLock()
+        self.last_write_at = time.time()
+        self.thread = Thread(target=self.run, name="fst-metrics-writer", daemon=True)
+
+    def start(self) -> None:
+        self.run_migrations()
+        self.thread.start()
+
+    def run_migrations(self) -> None:
+        version = run_migrations(self.connect())
+        logger.info(f"Metrics database {self.db_file} is at schema version {version}.")
+        self.close_connection()
+
+    def connect(self) -> duckdb.DuckDBPyConnection:
+        with self.connection_lock:
+            if self.connection is None:
+                self.connection = connect_metrics(self.db_file)
+            return self.connection
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """A connection of its own onto the writer's database, for reads from other threads."""
+        with self.connection_lock:
+            return self.connect().cursor()
+
+    def close_connection(self) -> None:
+        with self.connection_lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def write(
+        self,
+        metrics_row: Dict[str, Any],
+        child_rows: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    ) -> None:
+        metrics_row = {
+            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            **metrics_row,
+        }
+        self.queue.put(MetricsRecord(metrics_row, child_rows or {}))
+
+    def run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+                if record is None:
+                    stopping = True
+                else:
+                    self.pending.append(record)
+                # drain whatever else arrived so it goes into the same transaction
+                while len(self.pending) < self.batch_size:
+                    record = self.queue.get_nowait()
+                    if record is None:
+                        stopping = True
+                        break
+                    self.pending.append(record)
+            except queue.Empty:
+                pass
+            if self.pending:
+                self.flush()
+            elif self.compaction_due():
+                self.compact()
+            elif (
+                self.connection is not None
+                and self.idle_close_seconds is not None
+                and time.time() - self.last_write_at > self.idle_close_seconds
+            ):
+                self.close_connection()
+        self.close_connection()
+
+    def flush(self) -> None:
+        try:
+            duckdb_conn = self.connect()
+            # readers fetch rows newer than the last seq they've seen; taken outside the
+            # insert so a retried batch keeps its numbers (a failed one only leaves a gap)
+            seqs = duckdb_conn.execute(
+                "SELECT nextval('metrics_seq') FROM range(?)", [len(self.pending)]
+            ).fetchall()
+            flushed_at = datetime.utcnow()
+            for record, (seq,) in zip(self.pending, seqs):
+                record.metrics_row["seq"] = seq
+                # the time an iteration waited in the queue until this flush
+                finish_persist_spans(record.child_rows.get("spans", []), flushed_at)
+            grouped = group_rows(self.pending)
+            try:
+                insert_rows(duckdb_conn, grouped)
+            except duckdb.IOException:
+                raise
+            except Exception as e:
+                logger.error(
+                    f"Error while inserting data into {self.db_file}, "
+                    f"retrying one table at a time: {e}"
+                )
+                self.insert_tables_separately(duckdb_conn, grouped)
+        except duckdb.IOException as e:
+            # another process (e.g. the workbench) holds the file, keep the batch for the next flush
+            logger.debug(f"Metrics database is busy, retrying: {e}")
+            self.close_connection()
+            return
+        except Exception as e:
+            logger.error(f"Error while inserting data into {self.db_file}: {e}")
+            self.pending = []
+            return
+        logger.info(
+            f"fst metrics saved to the database: {self.db_file} ({len(self.pending)} iteration(s))"
+        )
+        self.pending = []
+        self.last_write_at = time.time()
+
+    def insert_tables_separately(
+        self,
+        duckdb_conn: duckdb.DuckDBPyConnection,
+        grouped: Dict[Tuple[str, Tuple[str, ...]], List[list]],
+    ) -> None:
+        """Insert each table's rows on their own, so one bad table doesn't lose the others."""
+        for (table, columns), values in grouped.items():
+            try:
+                insert_rows(duckdb_conn, {(table, columns): values})
+            except Exception as e:
+                logger.error(f"Dropped {len(values)} row(s) of {table} from {self.db_file}: {e}")
+
+    def compaction_due(self) -> bool:
+        if self.retention_days is None:
+            return False
+        return (
+            self.last_compacted_at is None
+            or time.time() - self.last_compacted_at > METRICS_COMPACTION_INTERVAL_SECONDS
+        )
+
+    def compact(self) -> None:
+        try:
+            compact_metrics(self.connect(), self.retention_days, self.archive_dir)
+        except duckdb.IOException as e:
+            logger.debug(f"Metrics database is busy, compacting later: {e}")
+            self.close_connection()
+            return
+        except Exception as e:
+            logger.error(f"Error while compacting {self.db_file}: {e}")
+        self.last_compacted_at = time.time()
+        self.last_write_at = time.time()
+
+    def close(self) -> None:
+        """Flush everything still queued and stop the writer thread."""
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        # the final flush can still lose the file lock to a reader, give it a few more tries
+        for _ in range(METRICS_CLOSE_RETRIES):
+            if not self.pending:
+                break
+            time.sleep(self.flush_interval)
+            self.flush()
+        self.close_connection()
+        if self.pending:
+            logger.warning(
+                f"Dropped {len(self.pending)} iteration(s) that couldn't be saved to {self.db_file}."
+            )
+
+
+metrics_writer: Optional[MetricsWriter] = None
+
+
+def configure_metrics_writer(
+    db_file: str = METRICS_DB_FILE,
+    retention_days: Optional[int] = None,
+    archive_dir: str = METRICS_ARCHIVE_DIR,
+    idle_close_seconds: Optional[float] = METRICS_IDLE_CLOSE_SECONDS,
+) -> None:
+    global metrics_writer
+    if metrics_writer is not None:
+        metrics_writer.close()
+    metrics_writer = MetricsWriter(
+        db_file,
+        idle_close_seconds=idle_close_seconds,
+        retention_days=retention_days,
+        archive_dir=archive_dir,
+    )
+    metrics_writer.start()
+    atexit.register(metrics_writer.close)
+
+
+def get_metrics_writer() -> MetricsWriter:
+    if metrics_writer is None:
+        configure_metrics_writer()
+    return metrics_writer
+
+
+def close_metrics_writer() -> None:
+    if metrics_writer is not None:
+        metrics_writer.close()
+
+
+def save_metrics(
+    metrics_row: Dict[str, Any],
+    child_rows: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+) -> None:
+    """Queue one iteration for `metrics` and its per-iteration child tables."""
+    get_metrics_writer().write(metrics_row, child_rows)
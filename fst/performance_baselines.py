@@ -0,0 +1,282 @@
+import json
+import logging
+import math
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fst.config_defaults import (
+    BASELINE_EWMA_ALPHA,
+    REGRESSION_MIN_CHANGE,
+    REGRESSION_MIN_OBSERVATIONS,
+    REGRESSION_Z_SCORE,
+)
+
+logger = logging.getLogger(__name__)
+
+# metrics columns every model keeps a baseline of
+BASELINE_METRICS = {"dbt_build_time": "`dbt build` time", "query_time": "Query time"}
+
+
+class P2Quantile:
+    """Estimate of one quantile in constant memory, with the P² algorithm of Jain and Chlamtac.
+
+    Five markers track the minimum, the quantile, the maximum and the quantiles halfway
+    to either side. Every observation moves the markers toward their desired positions,
+    adjusting their heights along a parabola through their neighbours.
+    """
+
+    def __init__(
+        self,
+        quantile: float,
+        heights: Optional[List[float]] = None,
+        positions: Optional[List[int]] = None,
+        count: int = 0,
+    ):
+        self.quantile = quantile
+        self.heights = heights or []
+        self.positions = positions or [1, 2, 3, 4, 5]
+        self.count = count
+        self.increments = [0.0, quantile / 2, quantile, (1 + quantile) / 2, 1.0]
+
+    def desired_positions(self) -> List[float]:
+        return [1 + (self.count - 1) * increment for increment in self.increments]
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if self.count <= 5:
+            self.heights = sorted(self.heights + [value])
+            return
+        heights, positions = self.heights, self.positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = max(i for i in range(4) if heights[i] <= value)
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+
+        desired = self.desired_positions()
+        for i in range(1, 4):
+            offset = desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (
+                offset <= -1 and positions[i - 1] - positions[i] < -1
+            ):
+                step = 1 if offset > 0 else -1
+                height = self.parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (
+                        positions[i + step] - positions[i]
+                    )
+                heights[i] = height
+                positions[i] += step
+
+    def parabolic(self, i: int, step: int) -> float:
+        heights, positions = self.heights, self.positions
+        return heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + step)
+            * (heights[i + 1] - heights[i])
+            / (positions[i + 1] - positions[i])
+            + (positions[i + 1] - positions[i] - step)
+            * (heights[i] - heights[i - 1])
+            / (positions[i] - positions[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if self.count <= 5:
+            # too few observations for the markers, take the nearest rank
+            return self.heights[min(len(self.heights) - 1, int(self.quantile * len(self.heights)))]
+        return self.heights[2]
+
+    def to_state(self) -> str:
+        return json.dumps({"heights": self.heights, "positions": self.positions})
+
+    @classmethod
+    def from_state(cls, quantile: float, state: Optional[str], count: int) -> "P2Quantile":
+        if not state:
+            return cls(quantile)
+        state = json.loads(state)
+        return cls(quantile, state["heights"], state["positions"], count)
+
+
+class Baseline:
+    """Running baseline of one metric of one model: an EWMA with its variance, and p50/p95.
+
+    Every statistic is updated from the previous state and the new value alone, so
+    the baseline never rereads the model's history.
+    """
+
+    def __init__(
+        self,
+        observations: int = 0,
+        ewma: Optional[float] = None,
+        ewm_variance: float = 0.0,
+        p50: Optional[P2Quantile] = None,
+        p95: Optional[P2Quantile] = None,
+    ):
+        self.observations = observations
+        self.ewma = ewma
+        self.ewm_variance = ewm_variance
+        self.p50 = p50 or P2Quantile(0.5)
+        self.p95 = p95 or P2Quantile(0.95)
+
+    def check(self, value: float) -> Optional[Dict[str, Any]]:
+        """How much slower `value` is than the baseline, if that's significant.
+
+        A value is a regression when it's above the p95 baseline, more than
+        REGRESSION_Z_SCORE exponentially weighted standard deviations above the EWMA,
+        and at least REGRESSION_MIN_CHANGE slower than it, so jitter on a fast model
+        isn't flagged.
+        """
+        if self.observations < REGRESSION_MIN_OBSERVATIONS or not self.ewma:
+            return None
+        change = value - self.ewma
+        std_dev = math.sqrt(self.ewm_variance)
+        z_score = change / std_dev if std_dev > 0 else math.inf
+        p95 = self.p95.value()
+        if (
+            value <= p95
+            or z_score < REGRESSION_Z_SCORE
+            or change < REGRESSION_MIN_CHANGE * self.ewma
+        ):
+            return None
+        return {
+            "value": value,
+            "baseline_ewma": self.ewma,
+            "baseline_p50": self.p50.value(),
+            "baseline_p95": p95,
+            "change_seconds": change,
+            "change_percent": change / self.ewma * 100,
+            "z_score": z_score if std_dev > 0 else None,
+        }
+
+    def update(self, value: float) -> None:
+        self.observations += 1
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            difference = value - self.ewma
+            increment = BASELINE_EWMA_ALPHA * difference
+            self.ewma += increment
+            self.ewm_variance = (1 - BASELINE_EWMA_ALPHA) * (
+                self.ewm_variance + difference * increment
+            )
+        self.p50.add(value)
+        self.p95.add(value)
+
+    def to_row(self, modified_sql_file: str, metric: str, iteration_id: str) -> Dict[str, Any]:
+        return {
+            "modified_sql_file": modified_sql_file,
+            "metric": metric,
+            "observations": self.observations,
+            "ewma": self.ewma,
+            "ewm_variance": self.ewm_variance,
+            "p50": self.p50.value(),
+            "p95": self.p95.value(),
+            "p50_state": self.p50.to_state(),
+            "p95_state": self.p95.to_state(),
+            "last_iteration_id": iteration_id,
+            "updated_at": datetime.utcnow(),
+        }
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "Baseline":
+        return cls(
+            row["observations"],
+            row["ewma"],
+            row["ewm_variance"],
+            P2Quantile.from_state(0.5, row["p50_state"], row["observations"]),
+            P2Quantile.from_state(0.95, row["p95_state"], row["observations"]),
+        )
+
+
+class BaselineTracker:
+    """Baselines of every model, loaded once from the metrics database and kept in memory.
+
+    Build workers record iterations concurrently, so baselines are checked and updated
+    under a lock, in the order iterations are recorded.
+    """
+
+    def __init__(self, load_rows: Callable[[], List[Dict[str, Any]]]):
+        self.load_rows = load_rows
+        self.baselines: Optional[Dict[Tuple[str, str], Baseline]] = None
+        self.lock = threading.Lock()
+
+    def load(self) -> Dict[Tuple[str, str], Baseline]:
+        if self.baselines is None:
+            try:
+                rows = self.load_rows()
+            except Exception as e:
+                logger.debug(f"Couldn't load performance baselines, starting empty: {e}")
+                rows = []
+            self.baselines = {
+                (row["modified_sql_file"], row["metric"]): Baseline.from_row(row) for row in rows
+            }
+        return self.baselines
+
+    def observe(
+        self, modified_sql_file: str, iteration_id: str, values: Dict[str, Optional[float]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Check each value against its baseline, then fold it in.
+
+        Returns the regressions found and the updated baseline rows, both ready for
+        the metrics writer.
+        """
+        regressions = []
+        baseline_rows = []
+        with self.lock:
+            baselines = self.load()
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                baseline = baselines.setdefault((modified_sql_file, metric), Baseline())
+                regression = baseline.check(value)
+                if regression is not None:
+                    regressions.append(
+                        {"iteration_id": iteration_id, "metric": metric, **regression}
+                    )
+                baseline.update(value)
+                baseline_rows.append(baseline.to_row(modified_sql_file, metric, iteration_id))
+        return regressions, baseline_rows
+
+
+def load_baseline_rows() -> List[Dict[str, Any]]:
+    from fst.metrics_writer import get_metrics_writer
+
+    cursor = get_metrics_writer().cursor()
+    try:
+        cursor.execute("SELECT * FROM model_baselines")
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+baseline_tracker = BaselineTracker(load_baseline_rows)
+
+
+def describe_regression(modified_sql_file: str, regression: Dict[str, Any]) -> str:
+    label = BASELINE_METRICS.get(regression["metric"], regression["metric"])
+    return (
+        f"{label} of {modified_sql_file} regressed: {regression['value']:.2f} seconds, "
+        f"+{regression['change_seconds']:.2f} seconds (+{regression['change_percent']:.0f}%) "
+        f"over its {regression['baseline_ewma']:.2f} second baseline "
+        f"(p95 {regression['baseline_p95']:.2f} seconds)"
+    )
+
+
+def check_performance(
+    modified_sql_file: str, iteration_id: str, values: Dict[str, Optional[float]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Compare an iteration's timings with its model's baselines and log any regression."""
+    regressions, baseline_rows = baseline_tracker.observe(
+        modified_sql_file, iteration_id, values
+    )
+    for regression in regressions:
+        logger.warning(describe_regression(modified_sql_file, regression))
+    return regressions, baseline_rows
@@ -0,0 +1,174 @@
+import logging
+from typing import List, NamedTuple, Optional
+
+import pyarrow as pa
+import sqlglot
+from sqlglot import exp
+
+from fst.config_defaults import PREVIEW_SAMPLE_PERCENT, PREVIEW_SEED
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_ALIAS = "fst_preview"
+PAGE_ROW_COLUMN = "__fst_row"
+PAGE_COLUMN_PREFIX = "__fst_column_"
+NULL_FLAG_PREFIX = "__fst_null_"
+DUPLICATE_FLAG_PREFIX = "__fst_duplicate_"
+STRATUM_ROW_COLUMN = "__fst_stratum_row"
+
+PREVIEW_STRATEGIES = ["first_n", "reservoir", "stratified", "tablesample"]
+
+
+class PreviewStrategy(NamedTuple):
+    """Which rows of a model the preview shows.
+
+    - first_n: the first rows DuckDB produces (cheapest, but biased for sorted sources)
+    - reservoir: a uniform sample of exactly `limit` rows, seeded
+    - stratified: rows spread round-robin across the values of `key_column`, seeded
+    - tablesample: a seeded system sample of `sample_percent` of the model's vectors
+    """
+
+    name: str = "first_n"
+    key_column: Optional[str] = None
+    seed: int = PREVIEW_SEED
+    sample_percent: float = PREVIEW_SAMPLE_PERCENT
+
+    def describe(self) -> str:
+        if self.name == "reservoir":
+            return f"reservoir(seed={self.seed})"
+        if self.name == "stratified":
+            return f"stratified({self.key_column}, seed={self.seed})"
+        if self.name == "tablesample":
+            return f"tablesample({self.sample_percent:g}%, seed={self.seed})"
+        return self.name
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    """A string literal, for the places DuckDB takes no parameter (e.g. a COPY's file name)."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def strip_query(query: str) -> str:
+    return query.strip().rstrip(";").strip()
+
+
+def wrap_query(query: str, suffix: str) -> str:
+    # the newline keeps a trailing `-- comment` in the model from swallowing the closing paren
+    return f"SELECT * FROM (\n{strip_query(query)}\n) AS {PREVIEW_ALIAS} {suffix}"
+
+
+def build_preview_query(
+    query: str, limit: int, strategy: PreviewStrategy = PreviewStrategy()
+) -> str:
+    """Push the preview's row selection into DuckDB so only `limit` rows leave the database."""
+    if strategy.name == "reservoir":
+        return wrap_query(
+            query, f"USING SAMPLE reservoir({limit} ROWS) REPEATABLE ({strategy.seed})"
+        )
+    if strategy.name == "tablesample":
+        return wrap_query(
+            query,
+            f"USING SAMPLE system({strategy.sample_percent}%) REPEATABLE ({strategy.seed}) LIMIT {limit}",
+        )
+    if strategy.name == "stratified" and strategy.key_column:
+        key_column = quote_identifier(strategy.key_column)
+        # the first row of every key, then the second of every key, and so on; rows past
+        # the limit within their key can never make the preview, so they skip the sort.
+        # Rows are numbered in the seeded hash order of their values, so the same data
+        # gives the same preview however DuckDB schedules the scan.
+        return f"""
+            SELECT * EXCLUDE ({STRATUM_ROW_COLUMN}) FROM (
+                SELECT *, row_number() OVER (
+                    PARTITION BY {key_column} ORDER BY hash({PREVIEW_ALIAS}, {strategy.seed})
+                ) AS {STRATUM_ROW_COLUMN}
+                FROM (
+                    {strip_query(query)}
+                ) AS {PREVIEW_ALIAS}
+                QUALIFY {STRATUM_ROW_COLUMN} <= {limit}
+            )
+            ORDER BY {STRATUM_ROW_COLUMN}, {key_column}
+            LIMIT {limit}
+        """
+    try:
+        expression = sqlglot.parse_one(strip_query(query), read="duckdb")
+        if isinstance(expression, exp.Select) and expression.args.get("limit") is None:
+            return expression.limit(limit).sql(dialect="duckdb")
+        if isinstance(expression, (exp.Select, exp.Union)):
+            return (
+                exp.select("*")
+                .from_(expression.subquery(PREVIEW_ALIAS))
+                .limit(limit)
+                .sql(dialect="duckdb")
+            )
+    except sqlglot.errors.SqlglotError as e:
+        logger.debug(f"Falling back to wrapping the preview query: {e}")
+    return wrap_query(query, f"LIMIT {limit}")
+
+
+def number_rows(table: pa.Table) -> pa.Table:
+    """Name a fetched result's columns by position and number its rows in the order they came.
+
+    Positional names keep flags apart when the result repeats a column name (e.g.
+    `SELECT a.id, b.id`), and the row numbers give every page the same order.
+    """
+    numbered = table.rename_columns(
+        [f"{PAGE_COLUMN_PREFIX}{i}" for i in range(table.num_columns)]
+    )
+    return numbered.append_column(
+        PAGE_ROW_COLUMN, pa.array(range(1, table.num_rows + 1), pa.int64())
+    )
+
+
+def build_page_query(
+    relation: str,
+    num_columns: int,
+    offset: int,
+    page_rows: int,
+    flag_nulls: bool = True,
+    flag_duplicates: bool = True,
+) -> str:
+    """One page of a result prepared by `number_rows`, with per-cell null and duplicate flags.
+
+    Duplicates are counted with a window over every row of the result, so a value
+    repeated on another page is still flagged.
+    """
+    select_list = ["*"]
+    for i in range(num_columns):
+        column = f"{PAGE_COLUMN_PREFIX}{i}"
+        if flag_nulls:
+            select_list.append(f"{column} IS NULL AS {NULL_FLAG_PREFIX}{i}")
+        if flag_duplicates:
+            select_list.append(
+                f"count(*) OVER (PARTITION BY {column}) > 1 AS {DUPLICATE_FLAG_PREFIX}{i}"
+            )
+    # flagged before the page is cut out, so the windows see the whole result
+    return f"""
+        SELECT * EXCLUDE ({PAGE_ROW_COLUMN}) FROM (
+            SELECT {", ".join(select_list)} FROM {relation}
+        )
+        WHERE {PAGE_ROW_COLUMN} > {offset}
+        ORDER BY {PAGE_ROW_COLUMN}
+        LIMIT {page_rows}
+    """
+
+
+def build_schema_query(query: str) -> str:
+    """A probe that returns the model's columns without reading any rows."""
+    return wrap_query(query, "LIMIT 0")
+
+
+def serialize_preview(table: pa.Table) -> bytes:
+    """Compact Arrow IPC stream that keeps decimals, timestamps and nested types intact."""
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def deserialize_preview(blob: bytes) -> pa.Table:
+    return pa.ipc.open_stream(pa.py_buffer(blob)).read_all()
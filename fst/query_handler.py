@@ -1,14 +1,10 @@
-from watchdog.events import FileSystemEventHandler, FileSystemEvent
-from threading import Timer
+from watchdog.events import FileSystemEventHandler, FileSystemEvent, FileModifiedEvent
 import logging
 import os
 import time
-import subprocess
 from tabulate import tabulate
-import duckdb
-import json
-from datetime import date, datetime
-from typing import Optional, Callable, Any
+import uuid
+from typing import Optional, Callable, Any, Dict, List, Union
 
 from fst.file_utils import (
     get_active_file,
@@ -16,199 +12,542 @@ from fst.file_utils import (
     find_compiled_sql_file,
     generate_test_yaml,
 )
-from fst.db_utils import get_duckdb_file_path, execute_query
+from fst.db_utils import (
+    get_duckdb_file_path,
+    execute_query,
+    describe_query,
+    target_write_lock,
+    snapshot_target,
+    QUERY_SUCCESS,
+    QUERY_TIMEOUT,
+)
+from fst.preview import PreviewStrategy, serialize_preview
+from fst.column_profile import profile_relation
+from fst.build_queue import BuildQueue, BuildJob
+from fst.dbt_runner import DbtResult, run_dbt
+from fst.dbt_artifacts import (
+    split_node_results_by_file,
+    get_selection_footprint,
+    get_worker_target_dir,
+    get_node_spans,
+    load_artifact,
+    DEFAULT_TARGET_DIR,
+)
+from fst.spans import (
+    COLUMN_PROFILE_SPAN,
+    DBT_BUILD_SPAN,
+    DBT_COMPILE_SPAN,
+    DBT_TEST_SPAN,
+    LOG_DELIVERY_SPAN,
+    PREVIEW_QUERY_SPAN,
+    QUEUE_SPAN,
+    Span,
+    Trace,
+    get_span_rows,
+)
+from fst.job_scheduler import JobScheduler
+from fst.metrics_writer import save_metrics
+from fst.performance_baselines import check_performance
+from fst.blob_store import ARROW_MEDIA_TYPE, LOG_MEDIA_TYPE, SQL_MEDIA_TYPE, make_blob
+from fst.change_detection import ContentHashCache, SKIPPED_UNCHANGED_STATUS
+from fst.config_defaults import (
+    CONTENT_HASH_CACHE_FILE,
+    PREVIEW_LOG_ROWS,
+    PREVIEW_TIMEOUT_SECONDS,
+)
 
 logger = logging.getLogger(__name__)
 
+# full builds run here so the compile-first preview isn't blocked by them
+build_scheduler = JobScheduler()
+
+
+preview_timeout_seconds: Optional[float] = PREVIEW_TIMEOUT_SECONDS
+
+
+def configure_preview_timeout(timeout: Optional[float]) -> None:
+    global preview_timeout_seconds
+    preview_timeout_seconds = timeout
+
+
+preview_strategy = PreviewStrategy()
+
+
+def configure_preview_strategy(strategy: PreviewStrategy) -> None:
+    global preview_strategy
+    preview_strategy = strategy
+
+
+def configure_build_scheduler(max_workers: int) -> None:
+    global build_scheduler
+    build_scheduler = JobScheduler(max_workers)
+    logger.info(f"Running builds on {max_workers} worker(s).")
+
 
 class DynamicQueryHandler(FileSystemEventHandler):
-    def __init__(self, callback: Callable, models_dir: str):
+    def __init__(
+        self,
+        callback: Callable,
+        models_dir: str,
+        debounce_seconds: float = 1.5,
+        normalize_sql: bool = False,
+    ):
         self.callback = callback
         self.models_dir = models_dir
-        self.debounce_timer: Optional[Timer] = None
+        self.build_queue = BuildQueue(self.run_batch, debounce_seconds)
+        self.hash_cache = ContentHashCache(CONTENT_HASH_CACHE_FILE, normalize_sql)
 
     def on_modified(self, event: FileSystemEvent) -> None:
         if event.src_path.endswith(".sql"):
             # Check if the modified file is in any subdirectory under models_dir
             if os.path.commonpath([self.models_dir, event.src_path]) == self.models_dir:
-                self.debounce()
-                self.handle_query_for_file(event.src_path)
-
-    def debounce(self) -> None:
-        if self.debounce_timer is not None:
-            self.debounce_timer.cancel()
-        self.debounce_timer = Timer(1.5, self.debounce_query)
-        self.debounce_timer.start()
-
-    def debounce_query(self) -> None:
-        if self.debounce_timer is not None:
-            self.debounce_timer.cancel()
-            self.debounce_timer = None
-
-    def handle_query_for_file(self, file_path: str) -> None:
-        with open(file_path, "r") as file:
+                if self.hash_cache.has_changed(event.src_path):
+                    self.build_queue.submit(event.src_path, get_saved_at(event.src_path))
+                else:
+                    record_skipped_file(event.src_path)
+
+    def run_batch(self, job: BuildJob) -> None:
+        self.callback(job, lambda model_results: self.finish_batch(job, model_results))
+
+    def finish_batch(self, job: BuildJob, model_results: Dict[str, Dict[str, Any]]) -> None:
+        self.build_queue.finish(job)
+        for file_path in job.file_paths:
+            # let the next save retry a failed build even if the content is the same; a
+            # file without a result is one the build raised (or was cancelled) before reaching
+            model_result = model_results.get(file_path)
+            if model_result is None or model_result.get("status") != "success":
+                self.hash_cache.forget(file_path)
+
+    def on_created(self, event: FileSystemEvent) -> None:
+        if not event.is_directory:
+            self.on_modified(event)
+
+    def on_moved(self, event: FileSystemEvent) -> None:
+        # native backends report editor "atomic saves" (write temp file, rename over) as moves
+        if not event.is_directory:
+            self.on_modified(FileModifiedEvent(event.dest_path))
+
+
+def get_saved_at(file_path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(file_path)
+    except OSError:
+        return None
+
+
+def record_skipped_file(file_path: str) -> None:
+    logger.info(f"{SKIPPED_UNCHANGED_STATUS} ({file_path})")
+    save_metrics(
+        {
+            "iteration_id": uuid.uuid4().hex,
+            "modified_sql_file": file_path,
+            "dbt_build_status": SKIPPED_UNCHANGED_STATUS,
+            "duckdb_file_name": get_duckdb_file_path(),
+        }
+    )
+
+
+def get_active_files(file_paths: List[str]) -> List[str]:
+    active_files = []
+    for file_path in file_paths:
+        active_file = get_active_file(file_path)
+        if not active_file or not os.path.exists(active_file):
+            continue
+        with open(active_file, "r") as file:
             query = file.read()
-        if query is not None and query.strip():
-            handle_query(query, file_path)
+        if query.strip():
+            active_files.append(active_file)
+        else:
+            logger.error(f"Empty query: {active_file}")
+    return active_files
 
 
-class DateEncoder(json.JSONEncoder):
-    def default(self, obj: Any) -> Any:
-        if isinstance(obj, date):
-            return obj.isoformat()
-        return super(DateEncoder, self).default(obj)
+def handle_queries(
+    job: BuildJob,
+    on_complete: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None,
+) -> None:
+    """Two-phase pipeline: compile and preview right away, then build and test in the background."""
+    started_at = time.time()
+    active_files = get_active_files(job.file_paths)
+    if not active_files:
+        if on_complete is not None:
+            on_complete({})
+        return
 
+    try:
+        previews = compile_and_preview(active_files, started_at, job)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        previews = {active_file: {} for active_file in active_files}
+    writes, reads = get_selection_footprint(active_files)
+    build_scheduler.submit(
+        build_and_record, writes, reads, active_files, previews, job, on_complete, time.time()
+    )
+
+
+def compile_and_preview(
+    active_files: List[str], started_at: float, job: Optional[BuildJob] = None
+) -> Dict[str, Dict[str, Any]]:
+    trace = job.trace if job is not None else Trace()
+    model_names = [get_model_name_from_file(active_file) for active_file in active_files]
+    logger.info(f"Compiling the modified SQL file(s) ({', '.join(active_files)})...")
+    queued_at = time.time()
+    # only dbt needs the target to itself, the preview queries are reads on cursors
+    # of their own and don't wait for a build that takes the lock after the compile
+    with target_write_lock():
+        start_time = time.time()
+        trace.add(QUEUE_SPAN, queued_at, start_time, stage="compile")
+        result = run_dbt(["compile", "--select", *model_names], job)
+        compile_time = time.time() - start_time
+    trace_dbt_invocation(
+        trace,
+        DBT_COMPILE_SPAN,
+        result,
+        start_time,
+        start_time + compile_time,
+        get_node_spans(load_artifact("run_results.json", start_time)),
+    )
+    if result.returncode != 0:
+        logger.error("Error running `dbt compile`.")
+
+    previews = {}
+    for active_file in active_files:
+        preview = run_preview(active_file, trace)
+        # one compile invocation covers the whole batch
+        preview["compile_time"] = compile_time / len(active_files)
+        if preview.get("preview_table") is not None:
+            preview["preview_time"] = time.time() - started_at
+        previews[active_file] = preview
+    return previews
+
+
+def trace_dbt_invocation(
+    trace: Trace,
+    name: str,
+    result: DbtResult,
+    start_time: float,
+    end_time: float,
+    node_spans: List[Dict[str, Any]],
+    file_path: Optional[str] = None,
+) -> str:
+    """Add a span for one dbt invocation, with its startup, parse and node steps inside it."""
+    span_id = trace.add(name, start_time, end_time, file_path=file_path)
+    trace.add_phases(result.phases, span_id, file_path)
+    for node_span in node_spans:
+        trace.add(parent_span_id=span_id, file_path=file_path, **node_span)
+    return span_id
 
-def handle_query(query, file_path):
-    if query.strip():
-        try:
-            start_time = time.time()
 
-            active_file = get_active_file(file_path)
-            if not active_file:
+def run_preview(active_file: str, trace: Optional[Trace] = None) -> Dict[str, Any]:
+    """Run the compiled query against the relations that currently exist in the target."""
+    if trace is None:
+        trace = Trace()
+    preview = {}
+    compiled_sql_file = find_compiled_sql_file(active_file)
+    if not compiled_sql_file:
+        logger.error(f"Couldn't find the compiled SQL file for {active_file}.")
+        return preview
+
+    with open(compiled_sql_file, "r") as file:
+        compiled_query = file.read()
+    preview["compiled_sql_file"] = compiled_sql_file
+    preview["compiled_query"] = compiled_query
+    duckdb_file_path = get_duckdb_file_path()
+    logger.info(f"Executing compiled query from: {compiled_sql_file}")
+    logger.info(f"Using DuckDB file: {duckdb_file_path}")
+
+    start_time = time.time()
+    try:
+        query_result = execute_query(
+            compiled_query,
+            duckdb_file_path,
+            timeout=preview_timeout_seconds,
+            strategy=preview_strategy,
+        )
+    except Exception as e:
+        logger.error(f"Error running the preview query: {e}")
+        preview["preview_status"] = "error"
+        preview["query_time"] = time.time() - start_time
+        trace.add(
+            PREVIEW_QUERY_SPAN, start_time, time.time(), file_path=active_file, status="error"
+        )
+        return preview
+    preview["query_time"] = time.time() - start_time
+    trace.add(
+        PREVIEW_QUERY_SPAN,
+        start_time,
+        time.time(),
+        file_path=active_file,
+        status=query_result.status,
+        rows=query_result.table.num_rows,
+    )
+    preview["preview_status"] = query_result.status
+    preview["preview_strategy"] = query_result.strategy
+    preview["preview_table"] = query_result.table
+    preview["column_names"] = query_result.column_names
+
+    if query_result.status == QUERY_TIMEOUT:
+        logger.warning(
+            f"Preview query timed out after {preview['query_time']:.2f} seconds "
+            f"(limit: {preview_timeout_seconds} seconds), showing the {query_result.table.num_rows} row(s) fetched so far."
+        )
+    # rendering the preview and handing it to the log listener
+    with trace.span(LOG_DELIVERY_SPAN, file_path=active_file):
+        logger.info(
+            f"Result Preview ({query_result.table.num_rows} rows fetched, {query_result.strategy})"
+            + "\n"
+            + tabulate(
+                query_result.table.slice(0, PREVIEW_LOG_ROWS).to_pylist(),
+                headers="keys",
+                tablefmt="grid",
+            )
+        )
+    return preview
+
+
+def run_column_profile(relation_name: Optional[str]) -> List[Dict[str, Any]]:
+    if not relation_name:
+        return []
+    try:
+        start_time = time.time()
+        column_profiles = profile_relation(relation_name, get_duckdb_file_path())
+        logger.info(
+            f"Profiled {len(column_profiles)} column(s) of {relation_name} in {time.time() - start_time:.2f} seconds"
+        )
+        return column_profiles
+    except Exception as e:
+        logger.error(f"Error profiling {relation_name}: {e}")
+        return []
+
+
+def build_and_record(
+    active_files: List[str],
+    previews: Dict[str, Dict[str, Any]],
+    job: BuildJob,
+    on_complete: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None,
+    queued_at: Optional[float] = None,
+    worker_slot: Optional[int] = None,
+) -> None:
+    model_results = {}
+    target_dir = get_worker_target_dir(worker_slot)
+    trace = job.trace
+    try:
+        model_names = [get_model_name_from_file(active_file) for active_file in active_files]
+        with target_write_lock():
+            trace.add(QUEUE_SPAN, queued_at or time.time(), time.time(), stage="build")
+            if job.cancelled.is_set():
+                logger.info(f"Skipping superseded build of {', '.join(active_files)}.")
                 return
-            model_name = get_model_name_from_file(active_file)
             logger.info(
-                f"Running `dbt build` with the modified SQL file ({active_file})..."
+                f"Running `dbt build` with the modified SQL file(s) ({', '.join(active_files)})..."
             )
-            result = subprocess.run(
-                ["dbt", "build", "--select", model_name, "--store-failures"],
-                capture_output=True,
-                text=True,
+            start_time = time.time()
+            result = run_dbt(
+                ["build", "--select", *model_names, "--store-failures", "--target-path", target_dir],
+                job,
+            )
+            build_time = time.time() - start_time
+            snapshot_target()
+            if job.cancelled.is_set():
+                logger.info(f"Discarded superseded build of {', '.join(active_files)}.")
+                return
+            build_span_id = trace_dbt_invocation(
+                trace, DBT_BUILD_SPAN, result, start_time, start_time + build_time, []
             )
-            compile_time = time.time() - start_time
-
-            stdout_without_finished = result.stdout.split("Finished running")[0]
 
             if result.returncode == 0:
                 logger.info("`dbt build` was successful.")
-                logger.info(result.stdout)
             else:
-                logger.error("Error running `dbt build`:")
-                logger.error(result.stdout)
-
-            if (
-                "PASS" not in stdout_without_finished
-                and "FAIL" not in stdout_without_finished
-                and "ERROR" not in stdout_without_finished
-            ):
-                compiled_sql_file = find_compiled_sql_file(file_path)
-                if compiled_sql_file:
-                    with open(compiled_sql_file, "r") as file:
-                        compiled_query = file.read()
-                    duckdb_file_path = get_duckdb_file_path()
-                    _, column_names = execute_query(compiled_query, duckdb_file_path)
-
-                    warning_message = "Warning: No tests were run with the `dbt build` command. Consider adding tests to your project."
-
-                    logger.warning(warning_message)
-
-                    test_yaml_path = generate_test_yaml(
-                        model_name, column_names, active_file
-                    )
-                    test_yaml_path_warning_message = (
-                        f"Generated test YAML file: {test_yaml_path}"
-                    )
+                logger.error("Error running `dbt build`.")
 
-                    # Verify if the newly generated test YAML file exists
-                if os.path.isfile(test_yaml_path):
-                    logger.warning(test_yaml_path_warning_message)
-                    logger.warning(
-                        "Running `dbt test` with the generated test YAML file..."
-                    )
-                    result_rerun = subprocess.run(
-                        ["dbt", "test", "--select", model_name, "--store-failures"],
-                        capture_output=True,
-                        text=True,
-                    )
-                    full_output = result_rerun.stdout + result_rerun.stderr
-                    if result_rerun.returncode == 0:
-                        logger.info(
-                            "`dbt test` with generated tests was successful."
-                        )
-                        logger.info(full_output)
-                    else:
-                        logger.error("Error running `dbt test`:")
-                        logger.error(full_output)
-                else:
-                    logger.error("Couldn't find the generated test YAML file.")
-
-            compiled_sql_file = find_compiled_sql_file(file_path)
-            if compiled_sql_file:
-                with open(compiled_sql_file, "r") as file:
-                    compiled_query = file.read()
-                    logger.info(f"Executing compiled query from: {compiled_sql_file}")
-                    duckdb_file_path = get_duckdb_file_path()
-                    logger.info(f"Using DuckDB file: {duckdb_file_path}")
-
-                    start_time = time.time()
-                    preview_result, column_names = execute_query(
-                        compiled_query, duckdb_file_path
-                    )
-                    query_time = time.time() - start_time
+            model_results = split_node_results_by_file(
+                active_files,
+                result.node_results,
+                result.returncode == 0,
+                build_time,
+                start_time,
+                target_dir,
+            )
+            for active_file in active_files:
+                # the files of a batch share one build log, which is stored once
+                model_results[active_file]["dbt_log"] = result.stdout
+                for node_span in model_results[active_file]["node_spans"]:
+                    trace.add(parent_span_id=build_span_id, file_path=active_file, **node_span)
 
-                    logger.info(f"`dbt build` time: {compile_time:.2f} seconds")
-                    logger.info(f"Query time: {query_time:.2f} seconds")
+            untested_files = [
+                active_file
+                for active_file in active_files
+                if not model_results[active_file]["tests_ran"]
+            ]
+            if untested_files:
+                generate_and_run_tests(untested_files, previews, target_dir, trace)
 
-                    logger.info(
-                        "Result Preview"
-                        + "\n"
-                        + tabulate(
-                            preview_result, headers=column_names, tablefmt="grid"
-                        )
+        # reads only, so the next build doesn't wait for them
+        for active_file in active_files:
+            # new models (or new upstream models) only have relations to preview against after the build
+            if previews[active_file].get("preview_table") is None:
+                previews[active_file].update(run_preview(active_file, trace))
+            if model_results[active_file]["status"] == "success":
+                with trace.span(COLUMN_PROFILE_SPAN, file_path=active_file):
+                    model_results[active_file]["column_profiles"] = run_column_profile(
+                        model_results[active_file].get("relation_name")
                     )
+
+        for active_file in active_files:
+            # only the latest revision of a file may write metrics
+            if job.is_current(active_file):
+                record_iteration(
+                    active_file,
+                    previews[active_file],
+                    model_results[active_file],
+                    trace.for_file(active_file),
+                )
             else:
-                logger.error("Couldn't find the compiled SQL file.")
+                logger.info(f"Discarded results of a superseded revision of {active_file}.")
+    except Exception as e:
+        logger.error(f"Error: {e}")
+    finally:
+        if on_complete is not None:
+            on_complete(model_results)
 
-            dbt_build_status = "success" if result.returncode == 0 else "failure"
-            duckdb_file_path = get_duckdb_file_path()
 
-            # Convert the result and column_names to JSON
-            result_preview_dict = [
-                dict(zip(column_names, row)) for row in preview_result
-            ]
-            # Use the custom DateEncoder to handle date objects
-            result_preview_json = json.dumps(result_preview_dict, cls=DateEncoder)
-            current_timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-            
-            try:
-                duckdb_conn = duckdb.connect("fst_metrics.duckdb")
-                duckdb_conn.execute(
-                    """
-                    INSERT INTO metrics (
-                        timestamp,
-                        modified_sql_file,
-                        compiled_sql_file,
-                        compiled_query,
-                        dbt_build_status,
-                        duckdb_file_name,
-                        dbt_build_time,
-                        query_time,
-                        result_preview_json
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                    (
-                        current_timestamp,
-                        active_file,
-                        compiled_sql_file,
-                        compiled_query,
-                        dbt_build_status,
-                        duckdb_file_path,
-                        compile_time,
-                        query_time,
-                        result_preview_json,
-                    ),
-                )
+def generate_and_run_tests(
+    active_files: List[str],
+    previews: Dict[str, Dict[str, Any]],
+    target_dir: str = DEFAULT_TARGET_DIR,
+    trace: Optional[Trace] = None,
+) -> None:
+    model_names = []
+    for active_file in active_files:
+        column_names = previews[active_file].get("column_names")
+        if column_names is None:
+            compiled_sql_file = find_compiled_sql_file(active_file)
+            if not compiled_sql_file:
+                continue
+            with open(compiled_sql_file, "r") as file:
+                compiled_query = file.read()
+            # the preview failed, so only probe for the columns
+            column_names = describe_query(compiled_query, get_duckdb_file_path())
 
-                duckdb_conn.commit()
-            except Exception as e:
-                duckdb_conn.rollback()
-                logger.error(f"Error while inserting data into fst_metrics.duckdb: {e}")
-            finally:
-                duckdb_conn.close()
-                logger.info("fst metrics saved to the database: fst_metrics.duckdb")
+        model_name = get_model_name_from_file(active_file)
+        logger.warning(
+            f"Warning: No tests were run for `{model_name}` with the `dbt build` command. Consider adding tests to your project."
+        )
+        test_yaml_path = generate_test_yaml(model_name, column_names, active_file)
 
-        except Exception as e:
-            logger.error(f"Error: {e}")
+        # Verify if the newly generated test YAML file exists
+        if os.path.isfile(test_yaml_path):
+            logger.warning(f"Generated test YAML file: {test_yaml_path}")
+            model_names.append(model_name)
+        else:
+            logger.error("Couldn't find the generated test YAML file.")
+
+    if not model_names:
+        return
+    logger.warning("Running `dbt test` with the generated test YAML file(s)...")
+    start_time = time.time()
+    result_rerun = run_dbt(
+        ["test", "--select", *model_names, "--store-failures", "--target-path", target_dir]
+    )
+    if trace is not None:
+        trace_dbt_invocation(
+            trace,
+            DBT_TEST_SPAN,
+            result_rerun,
+            start_time,
+            time.time(),
+            get_node_spans(load_artifact("run_results.json", start_time, target_dir)),
+        )
+    if result_rerun.returncode == 0:
+        logger.info("`dbt test` with generated tests was successful.")
     else:
-        logger.error("Empty query.")
+        logger.error("Error running `dbt test`.")
+
+
+def record_iteration(
+    active_file: str,
+    preview: Dict[str, Any],
+    model_result: Dict[str, Any],
+    spans: Optional[List[Span]] = None,
+) -> None:
+    build_time = model_result["build_time"]
+    compile_time = preview.get("compile_time")
+    query_time = preview.get("query_time")
+    preview_time = preview.get("preview_time")
+    if compile_time is not None:
+        logger.info(f"`dbt compile` time: {compile_time:.2f} seconds")
+    logger.info(f"`dbt build` time: {build_time:.2f} seconds")
+    if query_time is not None:
+        logger.info(f"Query time: {query_time:.2f} seconds")
+    if preview_time is not None:
+        logger.info(f"Save to preview time: {preview_time:.2f} seconds")
+
+    iteration_id = uuid.uuid4().hex
+    # failed builds and previews say nothing about how fast a model is
+    regressions: List[Dict[str, Any]] = []
+    baseline_rows: List[Dict[str, Any]] = []
+    if model_result["status"] == "success":
+        regressions, baseline_rows = check_performance(
+            active_file,
+            iteration_id,
+            {
+                "dbt_build_time": build_time,
+                "query_time": query_time
+                if preview.get("preview_status") == QUERY_SUCCESS
+                else None,
+            },
+        )
+
+    blobs: Dict[str, Dict[str, Any]] = {}
+    preview_table = preview.get("preview_table")
+    result_preview_hash = add_blob(
+        blobs,
+        serialize_preview(preview_table) if preview_table is not None else None,
+        ARROW_MEDIA_TYPE,
+    )
+
+    save_metrics(
+        {
+            "iteration_id": iteration_id,
+            "modified_sql_file": active_file,
+            "compiled_sql_file": preview.get("compiled_sql_file"),
+            "compiled_query_hash": add_blob(
+                blobs, preview.get("compiled_query"), SQL_MEDIA_TYPE
+            ),
+            "dbt_log_hash": add_blob(blobs, model_result.get("dbt_log"), LOG_MEDIA_TYPE),
+            "dbt_build_status": model_result["status"],
+            "duckdb_file_name": get_duckdb_file_path(),
+            "dbt_build_time": build_time,
+            "query_time": query_time,
+            "preview_status": preview.get("preview_status"),
+            "preview_strategy": preview.get("preview_strategy"),
+            "compile_time": compile_time,
+            "preview_time": preview_time,
+            "result_preview_hash": result_preview_hash,
+        },
+        {
+            "blobs": list(blobs.values()),
+            "node_timings": [
+                {"iteration_id": iteration_id, **node_timing}
+                for node_timing in model_result.get("node_timings", [])
+            ],
+            "column_profiles": [
+                {"iteration_id": iteration_id, **column_profile}
+                for column_profile in model_result.get("column_profiles", [])
+            ],
+            "spans": get_span_rows(iteration_id, spans or [], time.time()),
+            "performance_regressions": regressions,
+            "model_baselines": baseline_rows,
+        },
+    )
+
+
+def add_blob(
+    blobs: Dict[str, Dict[str, Any]], content: Optional[Union[str, bytes]], media_type: str
+) -> Optional[str]:
+    """Collect `content` for the blobs table and return the hash metrics refer to it by."""
+    if content is None:
+        return None
+    blob = make_blob(content, media_type)
+    blobs[blob["hash"]] = blob
+    return blob["hash"]
@@ -0,0 +1,290 @@
+import logging
+import os
+import threading
+import uuid
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, List, Optional
+
+import duckdb
+import pyarrow as pa
+
+from fst.config_defaults import (
+    METRICS_DB_FILE,
+    READ_SERVER_ADDRESS,
+    READ_SERVER_AUTHKEY_ENV,
+)
+from fst.db_utils import (
+    FETCH_CHUNK_ROWS,
+    TARGET_STORAGE_REMEDY,
+    TargetBusyError,
+    check_storage_version,
+    get_connection,
+    get_duckdb_file_path,
+)
+from fst.preview import deserialize_preview, serialize_preview
+
+logger = logging.getLogger(__name__)
+
+METRICS_DATABASE = "metrics"
+TARGET_DATABASE = "target"
+
+
+class ReadServerError(Exception):
+    """A query sent to the read server failed."""
+
+
+def get_authkey() -> Optional[bytes]:
+    authkey = os.environ.get(READ_SERVER_AUTHKEY_ENV)
+    return authkey.encode() if authkey else None
+
+
+def fetch_table(
+    cursor: duckdb.DuckDBPyConnection,
+    query: str,
+    params: Optional[List[Any]] = None,
+    max_rows: Optional[int] = None,
+) -> pa.Table:
+    reader = cursor.execute(query, params or []).fetch_record_batch(FETCH_CHUNK_ROWS)
+    batches = []
+    num_rows = 0
+    for batch in reader:
+        batches.append(batch)
+        num_rows += batch.num_rows
+        if max_rows is not None and num_rows >= max_rows:
+            break
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    return table if max_rows is None else table.slice(0, max_rows)
+
+
+class ReadServer:
+    """Serves reads of the metrics and target databases to the workbench over a local socket.
+
+    DuckDB lets only one process open a database file, so the watcher keeps both files
+    and the workbench sends it queries instead of opening them itself. Metrics reads
+    run on a cursor of the metrics writer's connection, so they never wait on a flush.
+    Target reads run alongside previews. While dbt has the file they read the snapshot
+    of the last build, or wait briefly for dbt, and are answered with a "busy" status
+    if it takes longer.
+
+    Requests are unpickled, so the server only accepts clients that know `authkey`.
+    """
+
+    def __init__(self, address: str = READ_SERVER_ADDRESS, authkey: Optional[bytes] = None):
+        if not authkey:
+            raise ValueError(
+                f"The read server needs an authkey, set {READ_SERVER_AUTHKEY_ENV} to a secret."
+            )
+        self.address = address
+        self.authkey = authkey
+        self.listener: Optional[Listener] = None
+        self.running: Dict[str, duckdb.DuckDBPyConnection] = {}
+        self.running_lock = threading.Lock()
+
+    def start(self) -> None:
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # a socket left behind by a watcher that didn't shut down cleanly
+            os.remove(self.address)
+        self.listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self.accept, name="fst-read-server", daemon=True).start()
+        logger.info(f"Serving workbench reads on {self.address}")
+
+    def accept(self) -> None:
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                # the listener was closed
+                return
+            except Exception as e:
+                logger.debug(f"Rejected a read server connection: {e}")
+                continue
+            threading.Thread(
+                target=self.serve, args=(connection,), name="fst-read-client", daemon=True
+            ).start()
+
+    def serve(self, connection: Connection) -> None:
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    return
+                # a request that fails only fails itself, never the client's connection
+                if isinstance(request, dict) and "cancel" in request:
+                    try:
+                        self.cancel(request["cancel"])
+                    except Exception as e:
+                        logger.debug(f"Couldn't cancel read {request['cancel']}: {e}")
+                    continue
+                try:
+                    table = self.execute(request)
+                    response = {"status": "ok", "arrow": serialize_preview(table)}
+                except TargetBusyError as e:
+                    response = {"status": "busy", "error": str(e)}
+                except Exception as e:
+                    response = {"status": "error", "error": str(e)}
+                try:
+                    connection.send(response)
+                except (EOFError, OSError):
+                    return
+
+    def execute(self, request: Dict[str, Any]) -> pa.Table:
+        if request["database"] == METRICS_DATABASE:
+            from fst.metrics_writer import get_metrics_writer
+
+            return self.run(get_metrics_writer().cursor(), request)
+        # a cursor of the watcher's own connection, or of the snapshot while dbt has the file
+        return self.run(get_connection(get_duckdb_file_path()), request)
+
+    def run(self, cursor: duckdb.DuckDBPyConnection, request: Dict[str, Any]) -> pa.Table:
+        request_id = request.get("request_id")
+        with self.running_lock:
+            self.running[request_id] = cursor
+        try:
+            return fetch_table(
+                cursor, request["query"], request.get("params"), request.get("max_rows")
+            )
+        finally:
+            with self.running_lock:
+                self.running.pop(request_id, None)
+            cursor.close()
+
+    def cancel(self, request_id: str) -> None:
+        with self.running_lock:
+            cursor = self.running.get(request_id)
+        if cursor is not None:
+            try:
+                cursor.interrupt()
+            except duckdb.Error as e:
+                # the read finished and closed its cursor in the meantime
+                logger.debug(f"Couldn't interrupt read {request_id}: {e}")
+
+    def close(self) -> None:
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+
+
+read_server: Optional[ReadServer] = None
+
+
+def start_read_server(address: str = READ_SERVER_ADDRESS) -> None:
+    global read_server
+    read_server = ReadServer(address, get_authkey())
+    read_server.start()
+
+
+def stop_read_server() -> None:
+    if read_server is not None:
+        read_server.close()
+
+
+class ReadClient:
+    """Runs read queries through the watcher's read server.
+
+    When no watcher is running (e.g. the workbench was started on its own), queries
+    open the database file read-only instead. A running watcher holds the files, so
+    while it listens every read goes through it.
+    """
+
+    def __init__(
+        self,
+        address: str = READ_SERVER_ADDRESS,
+        authkey: Optional[bytes] = None,
+        metrics_db_file: str = METRICS_DB_FILE,
+    ):
+        self.address = address
+        self.authkey = authkey
+        self.metrics_db_file = metrics_db_file
+        # one socket per thread, so concurrent reruns don't queue behind each other
+        self.local = threading.local()
+
+    def get_connection(self) -> Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = Client(self.address, authkey=self.authkey)
+            self.local.connection = connection
+        return connection
+
+    def drop_connection(self) -> None:
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+        self.local.connection = None
+
+    def execute(
+        self,
+        database: str,
+        query: str,
+        params: Optional[List[Any]] = None,
+        max_rows: Optional[int] = None,
+        request_id: Optional[str] = None,
+    ) -> pa.Table:
+        request = {
+            "database": database,
+            "query": query,
+            "params": params,
+            "max_rows": max_rows,
+            "request_id": request_id or uuid.uuid4().hex,
+        }
+        if self.authkey is None:
+            if self.is_server_running():
+                raise ReadServerError(
+                    f"A watcher serves reads on {self.address}, "
+                    f"set {READ_SERVER_AUTHKEY_ENV} to its key to read through it."
+                )
+            return self.execute_directly(request)
+        try:
+            response = self.send(request)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return self.execute_directly(request)
+        if response["status"] == "busy":
+            raise TargetBusyError(response["error"])
+        if response["status"] != "ok":
+            raise ReadServerError(response["error"])
+        return deserialize_preview(response["arrow"])
+
+    def send(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        error = None
+        # a cached socket may belong to a watcher that has since restarted, so retry once
+        for _ in range(2):
+            connection = self.get_connection()
+            try:
+                connection.send(request)
+                return connection.recv()
+            except (OSError, EOFError) as e:
+                self.drop_connection()
+                error = e
+        raise ReadServerError(f"Lost the connection to the read server: {error}")
+
+    def is_server_running(self) -> bool:
+        try:
+            Client(self.address).close()
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+        except Exception:
+            # e.g. the server rejected our key, so something is listening
+            return True
+        return True
+
+    def execute_directly(self, request: Dict[str, Any]) -> pa.Table:
+        if request["database"] == METRICS_DATABASE:
+            from fst.metrics_writer import METRICS_STORAGE_REMEDY
+
+            db_file, remedy = self.metrics_db_file, METRICS_STORAGE_REMEDY
+        else:
+            db_file, remedy = get_duckdb_file_path(), TARGET_STORAGE_REMEDY
+        check_storage_version(db_file, remedy)
+        with duckdb.connect(db_file, read_only=True) as duckdb_conn:
+            return fetch_table(
+                duckdb_conn, request["query"], request["params"], request["max_rows"]
+            )
+
+    def cancel(self, request_id: str) -> None:
+        if self.authkey is None:
+            return
+        try:
+            with Client(self.address, authkey=self.authkey) as connection:
+                connection.send({"cancel": request_id})
+        except (OSError, EOFError) as e:
+            logger.debug(f"Couldn't cancel read {request_id}: {e}")
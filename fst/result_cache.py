@@ -0,0 +1,67 @@
+import sys
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+def estimate_size(value: Any) -> int:
+    """Rough in-memory size of a query result made of lists/tuples of Python values."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class BoundedCache:
+    """LRU cache bounded by the total estimated size of its values rather than an entry count.
+
+    Entries older than `ttl_seconds` (if set) are treated as misses.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_seconds: Optional[float] = None,
+        sizeof: Callable[[Any], int] = estimate_size,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self.entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self.current_bytes = 0
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, _, stored_at = entry
+            if self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds:
+                self.evict(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.evict(key)
+            # a single result larger than the whole budget isn't worth keeping
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size, time.time())
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self.evict(next(iter(self.entries)))
+
+    def evict(self, key: Hashable) -> None:
+        _, size, _ = self.entries.pop(key)
+        self.current_bytes -= size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
@@ -0,0 +1,278 @@
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# stages of the save-to-preview pipeline, in the order a save goes through them
+FILE_EVENT_SPAN = "file_event"
+DEBOUNCE_SPAN = "debounce"
+QUEUE_SPAN = "queue"
+DBT_STARTUP_SPAN = "dbt_startup"
+PARSE_SPAN = "parse"
+COMPILE_SPAN = "compile"
+EXECUTE_SPAN = "execute"
+TESTS_SPAN = "tests"
+PREVIEW_QUERY_SPAN = "preview_query"
+COLUMN_PROFILE_SPAN = "column_profile"
+METRICS_PERSIST_SPAN = "metrics_persist"
+LOG_DELIVERY_SPAN = "log_delivery"
+# parents of the stages above
+ITERATION_SPAN = "iteration"
+DBT_COMPILE_SPAN = "dbt_compile"
+DBT_BUILD_SPAN = "dbt_build"
+DBT_TEST_SPAN = "dbt_test"
+
+TRACE_EXPORT_FORMATS = ["chrome", "otlp"]
+
+# spans of the latest iterations, optionally of one model file (its full or project-relative
+# path, so models/staging/orders.sql and models/marts/orders.sql stay apart), oldest first
+SPAN_ROWS_QUERY = """
+    WITH latest AS (
+        SELECT iteration_id, seq, modified_sql_file
+        FROM metrics
+        WHERE iteration_id IN (SELECT iteration_id FROM spans)
+        AND (?::VARCHAR IS NULL OR iteration_id = ?)
+        AND (?::VARCHAR IS NULL OR modified_sql_file = ? OR suffix(modified_sql_file, '/' || ?))
+        ORDER BY seq DESC
+        LIMIT ?
+    )
+    SELECT spans.*, latest.modified_sql_file
+    FROM spans
+    JOIN latest ON spans.iteration_id = latest.iteration_id
+    ORDER BY latest.seq, spans.start_time
+"""
+
+
+class Span(NamedTuple):
+    span_id: str
+    parent_span_id: Optional[str]
+    name: str
+    start_time: float
+    end_time: float
+    # None for spans all files of a batch share, like the dbt invocation
+    file_path: Optional[str] = None
+    attributes: Dict[str, Any] = {}
+
+
+def new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Trace:
+    """Spans of one batch of saves on its way through the pipeline.
+
+    The stages run on different threads (the observer, the debounce timer and the
+    build workers), so spans are added under a lock.
+    """
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+
+    def add(
+        self,
+        name: str,
+        start_time: float,
+        end_time: float,
+        parent_span_id: Optional[str] = None,
+        file_path: Optional[str] = None,
+        span_id: Optional[str] = None,
+        **attributes: Any,
+    ) -> str:
+        span = Span(
+            span_id or new_span_id(),
+            parent_span_id,
+            name,
+            start_time,
+            end_time,
+            file_path,
+            attributes,
+        )
+        with self.lock:
+            self.spans.append(span)
+        return span.span_id
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        parent_span_id: Optional[str] = None,
+        file_path: Optional[str] = None,
+        **attributes: Any,
+    ) -> Iterator[str]:
+        """Time the block as a span and yield its id, so spans inside it can name it as parent."""
+        span_id = new_span_id()
+        start_time = time.time()
+        try:
+            yield span_id
+        finally:
+            self.add(
+                name, start_time, time.time(), parent_span_id, file_path, span_id, **attributes
+            )
+
+    def add_phases(
+        self,
+        phases: List[Tuple[str, float, float]],
+        parent_span_id: str,
+        file_path: Optional[str] = None,
+    ) -> None:
+        for name, start_time, end_time in phases:
+            self.add(name, start_time, end_time, parent_span_id, file_path)
+
+    def for_file(self, file_path: str) -> List[Span]:
+        with self.lock:
+            return [span for span in self.spans if span.file_path in (None, file_path)]
+
+
+def to_utc_datetime(epoch_seconds: float) -> datetime:
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).replace(tzinfo=None)
+
+
+def to_epoch_seconds(utc_datetime: datetime) -> float:
+    return utc_datetime.replace(tzinfo=timezone.utc).timestamp()
+
+
+def get_span_rows(
+    iteration_id: str, spans: List[Span], finished_at: float
+) -> List[Dict[str, Any]]:
+    """Rows for the `spans` table, under one root span from the save to `finished_at`.
+
+    The metrics_persist span starts now and is given its duration by the metrics
+    writer when it flushes the iteration.
+    """
+    started_at = min([span.start_time for span in spans] + [finished_at])
+    root_span_id = new_span_id()
+    spans = [
+        Span(root_span_id, None, ITERATION_SPAN, started_at, finished_at),
+        *(
+            span._replace(parent_span_id=span.parent_span_id or root_span_id)
+            for span in spans
+        ),
+    ]
+    rows = [
+        {
+            "iteration_id": iteration_id,
+            "span_id": span.span_id,
+            "parent_span_id": span.parent_span_id,
+            "name": span.name,
+            "start_time": to_utc_datetime(span.start_time),
+            "start_offset": span.start_time - started_at,
+            "duration": span.end_time - span.start_time,
+            "attributes": json.dumps(span.attributes) if span.attributes else None,
+        }
+        for span in sorted(spans, key=lambda span: span.start_time)
+    ]
+    rows.append(
+        {
+            "iteration_id": iteration_id,
+            "span_id": new_span_id(),
+            "parent_span_id": root_span_id,
+            "name": METRICS_PERSIST_SPAN,
+            "start_time": to_utc_datetime(finished_at),
+            "start_offset": finished_at - started_at,
+            "duration": None,
+            "attributes": None,
+        }
+    )
+    return rows
+
+
+def finish_persist_spans(span_rows: List[Dict[str, Any]], flushed_at: datetime) -> None:
+    for row in span_rows:
+        if row["name"] == METRICS_PERSIST_SPAN:
+            row["duration"] = (flushed_at - row["start_time"]).total_seconds()
+
+
+def get_attributes(row: Dict[str, Any]) -> Dict[str, Any]:
+    return json.loads(row["attributes"]) if row.get("attributes") else {}
+
+
+def to_chrome_trace(span_rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Spans as Chrome trace events, for chrome://tracing, Perfetto or speedscope.
+
+    Every iteration gets a thread of its own, named after its model file.
+    """
+    thread_ids: Dict[str, int] = {}
+    events = []
+    for row in span_rows:
+        thread_id = thread_ids.setdefault(row["iteration_id"], len(thread_ids) + 1)
+        if row["name"] == ITERATION_SPAN:
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": thread_id,
+                    "args": {"name": row.get("modified_sql_file") or row["iteration_id"]},
+                }
+            )
+        events.append(
+            {
+                "name": row["name"],
+                "cat": "fst",
+                "ph": "X",
+                "ts": to_epoch_seconds(row["start_time"]) * 1_000_000,
+                "dur": (row["duration"] or 0.0) * 1_000_000,
+                "pid": 1,
+                "tid": thread_id,
+                "args": {"iteration_id": row["iteration_id"], **get_attributes(row)},
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def to_otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp_trace(span_rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Spans in the OTLP/JSON encoding, one trace per iteration, for any OpenTelemetry collector."""
+    spans = []
+    for row in span_rows:
+        start_nanos = int(to_epoch_seconds(row["start_time"]) * 1_000_000_000)
+        end_nanos = start_nanos + int((row["duration"] or 0.0) * 1_000_000_000)
+        spans.append(
+            {
+                # iteration ids are 32 hex characters, the length of an OTLP trace id
+                "traceId": row["iteration_id"],
+                "spanId": row["span_id"],
+                "parentSpanId": row["parent_span_id"] or "",
+                "name": row["name"],
+                # SPAN_KIND_INTERNAL
+                "kind": 1,
+                "startTimeUnixNano": str(start_nanos),
+                "endTimeUnixNano": str(end_nanos),
+                "attributes": [
+                    to_otlp_attribute(key, value)
+                    for key, value in get_attributes(row).items()
+                ],
+            }
+        )
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [to_otlp_attribute("service.name", "fst")]},
+                "scopeSpans": [{"scope": {"name": "fst"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+def get_span_rows_params(
+    iterations: int = 1, iteration_id: Optional[str] = None, model: Optional[str] = None
+) -> List[Any]:
+    return [iteration_id, iteration_id, model, model, model, iterations]
+
+
+def to_trace_json(span_rows: List[Dict[str, Any]], trace_format: str) -> str:
+    trace = to_chrome_trace(span_rows) if trace_format == "chrome" else to_otlp_trace(span_rows)
+    return json.dumps(trace)
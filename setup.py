@@ -16,7 +16,7 @@ setup(
         "pyyaml",
         "pygments",
         "colorlog",
-        "duckdb==0.7.1",
+        "duckdb==0.9.2",
         "termcolor",
         "tabulate",
         "click",
@@ -0,0 +1,52 @@
+import json
+
+import duckdb
+
+from fst.column_profile import profile_relation
+from fst.db_utils import release_connections
+
+
+def test_profile_has_top_values_without_approx_top_k(tmp_path):
+    db_file = str(tmp_path / "target.duckdb")
+    with duckdb.connect(db_file) as duckdb_conn:
+        duckdb_conn.execute(
+            """
+            CREATE TABLE orders AS
+            SELECT
+                range AS id,
+                CASE WHEN range % 10 < 6 THEN 'shipped' WHEN range % 10 < 9 THEN 'placed' END
+                    AS status,
+                {'id': range} AS details
+            FROM range(100)
+            """
+        )
+    try:
+        profiles = {
+            profile["column_name"]: profile for profile in profile_relation("orders", db_file, 2)
+        }
+    finally:
+        release_connections()
+
+    assert json.loads(profiles["status"]["top_k"]) == ["shipped", "placed"]
+    assert profiles["status"]["null_count"] == 10
+    assert len(json.loads(profiles["id"]["top_k"])) == 2
+    # no top values for a struct column, stored as NULL rather than the JSON 'null'
+    assert profiles["details"]["top_k"] is None
+
+
+def test_high_cardinality_columns_have_no_top_values(tmp_path, monkeypatch):
+    monkeypatch.setattr("fst.column_profile.TOP_K_MAX_DISTINCT", 10)
+    db_file = str(tmp_path / "target.duckdb")
+    with duckdb.connect(db_file) as duckdb_conn:
+        duckdb_conn.execute(
+            "CREATE TABLE orders AS SELECT range AS id, range % 3 AS status FROM range(100)"
+        )
+    try:
+        profiles = {
+            profile["column_name"]: profile for profile in profile_relation("orders", db_file, 2)
+        }
+    finally:
+        release_connections()
+
+    assert profiles["id"]["top_k"] is None
+    assert json.loads(profiles["status"]["top_k"]) == ["0", "1"]
@@ -0,0 +1,59 @@
+import struct
+import threading
+import time
+
+import duckdb
+import pytest
+
+from fst.db_utils import (
+    QUERY_SUCCESS,
+    QUERY_TIMEOUT,
+    StorageVersionError,
+    release_connections,
+    run_bounded_query,
+)
+
+# ten billion rows, far more than a test run can get through before the deadline
+SLOW_QUERY = "SELECT sum(a.range * b.range) AS total FROM range(100000) a, range(100000) b"
+
+
+def test_slow_query_is_cut_off_at_the_deadline(tmp_path):
+    db_file = str(tmp_path / "target.duckdb")
+    try:
+        result = run_bounded_query(SLOW_QUERY, db_file, timeout=0.5)
+    finally:
+        release_connections()
+
+    assert result.status == QUERY_TIMEOUT
+    assert result.elapsed < 5
+
+
+def test_reads_run_alongside_a_slow_query(tmp_path):
+    db_file = str(tmp_path / "target.duckdb")
+    slow_query = threading.Thread(target=run_bounded_query, args=(SLOW_QUERY, db_file, 2.0))
+    try:
+        slow_query.start()
+        time.sleep(0.2)
+        start_time = time.time()
+        result = run_bounded_query("SELECT 42 AS answer", db_file, timeout=5)
+        elapsed = time.time() - start_time
+        slow_query.join()
+    finally:
+        release_connections()
+
+    assert result.status == QUERY_SUCCESS
+    assert result.table.to_pylist() == [{"answer": 42}]
+    assert elapsed < 1
+
+
+def test_target_from_an_older_duckdb_fails_with_instructions(tmp_path):
+    db_file = str(tmp_path / "target.duckdb")
+    duckdb.connect(db_file).close()
+    with open(db_file, "r+b") as file:
+        file.seek(12)
+        file.write(struct.pack("<Q", 43))
+    try:
+        with pytest.raises(StorageVersionError, match="DuckDB 0.7.1 .*rerun `dbt build`"):
+            run_bounded_query("SELECT 1", db_file)
+    finally:
+        release_connections()
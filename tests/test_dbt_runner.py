@@ -0,0 +1,182 @@
+import json
+import os
+
+from fst.config_defaults import CURRENT_WORKING_DIR
+from fst.dbt_artifacts import split_node_results_by_file
+from fst.dbt_runner import EventStream, InProcessDbtRunner, get_node_results
+
+# structured events as dbt-core 1.5 prints them with `--log-format json`
+LOG_MODEL_RESULT = {
+    "data": {
+        "description": "sql table model main.customers",
+        "execution_time": 0.14124203,
+        "index": 1,
+        "node_info": {
+            "materialized": "table",
+            "meta": {},
+            "node_finished_at": "2023-04-12T18:30:21.495055",
+            "node_name": "customers",
+            "node_path": "customers.sql",
+            "node_relation": {
+                "alias": "customers",
+                "database": "jaffle_shop",
+                "relation_name": '"jaffle_shop"."main"."customers"',
+                "schema": "main",
+            },
+            "node_started_at": "2023-04-12T18:30:21.351523",
+            "node_status": "success",
+            "resource_type": "model",
+            "unique_id": "model.jaffle_shop.customers",
+        },
+        "status": "OK",
+        "total": 2,
+    },
+    "info": {
+        "category": "",
+        "code": "Q012",
+        "extra": {},
+        "invocation_id": "5c3548df-02a1-44ac-91d7-2114bac21f94",
+        "level": "info",
+        "msg": "1 of 2 OK created sql table model main.customers ... [\u001b[32mOK\u001b[0m in 0.14s]",
+        "name": "LogModelResult",
+        "pid": 17219,
+        "thread": "Thread-1 (worker)",
+        "ts": "2023-04-12T18:30:21.496536Z",
+    },
+}
+LOG_TEST_RESULT = {
+    "data": {
+        "execution_time": 0.101337194,
+        "index": 2,
+        "name": "not_null_customers_customer_id",
+        "node_info": {
+            "materialized": "test",
+            "meta": {},
+            "node_finished_at": "2023-04-12T18:30:21.601920",
+            "node_name": "not_null_customers_customer_id",
+            "node_path": "not_null_customers_customer_id.sql",
+            "node_relation": {
+                "alias": "not_null_customers_customer_id",
+                "database": "jaffle_shop",
+                "relation_name": "",
+                "schema": "main_dbt_test__audit",
+            },
+            "node_started_at": "2023-04-12T18:30:21.498893",
+            "node_status": "pass",
+            "resource_type": "test",
+            "unique_id": "test.jaffle_shop.not_null_customers_customer_id.363eb3b9e7",
+        },
+        "num_failures": 0,
+        "num_models": 2,
+        "status": "pass",
+    },
+    "info": {
+        "category": "",
+        "code": "Q007",
+        "extra": {},
+        "invocation_id": "5c3548df-02a1-44ac-91d7-2114bac21f94",
+        "level": "info",
+        "msg": "2 of 2 PASS not_null_customers_customer_id ... [\u001b[32mPASS\u001b[0m in 0.10s]",
+        "name": "LogTestResult",
+        "pid": 17219,
+        "thread": "Thread-3 (worker)",
+        "ts": "2023-04-12T18:30:21.602254Z",
+    },
+}
+
+
+def test_node_results_use_node_status():
+    stream = EventStream()
+    for event in [LOG_MODEL_RESULT, LOG_TEST_RESULT]:
+        stream.add_line(json.dumps(event) + "\n")
+
+    node_results = get_node_results(stream.events)
+
+    assert node_results["model.jaffle_shop.customers"] == {
+        "resource_type": "model",
+        "status": "success",
+        "message": "OK",
+        "execution_time": 0.14124203,
+    }
+    test_id = "test.jaffle_shop.not_null_customers_customer_id.363eb3b9e7"
+    assert node_results[test_id]["status"] == "pass"
+
+
+def test_successful_model_is_split_as_success(tmp_path):
+    target_dir = tmp_path / "target"
+    target_dir.mkdir()
+    manifest = {
+        "nodes": {
+            "model.jaffle_shop.customers": {
+                "resource_type": "model",
+                "original_file_path": os.path.join("models", "customers.sql"),
+            }
+        },
+        "child_map": {
+            "model.jaffle_shop.customers": [
+                "test.jaffle_shop.not_null_customers_customer_id.363eb3b9e7"
+            ]
+        },
+    }
+    (target_dir / "manifest.json").write_text(json.dumps(manifest))
+    file_path = os.path.join(CURRENT_WORKING_DIR, "models", "customers.sql")
+
+    split_results = split_node_results_by_file(
+        [file_path],
+        get_node_results([LOG_MODEL_RESULT, LOG_TEST_RESULT]),
+        succeeded=True,
+        wall_time=1.0,
+        invoked_at=0.0,
+        target_dir=str(target_dir),
+    )
+
+    assert split_results[file_path]["status"] == "success"
+    assert split_results[file_path]["tests_ran"]
+
+
+def write_file(path, content: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def compile_model(runner: InProcessDbtRunner, project_dir, model_name: str) -> str:
+    assert runner.invoke(["compile", "--select", model_name]).returncode == 0
+    return (project_dir / "target" / "compiled" / "fst_test" / "models" / f"{model_name}.sql").read_text()
+
+
+def test_in_process_runner_parses_only_when_the_manifest_is_out_of_date(tmp_path, monkeypatch):
+    write_file(
+        tmp_path / "dbt_project.yml",
+        "name: fst_test\nversion: 1.0.0\nconfig-version: 2\nprofile: fst_test\n",
+    )
+    write_file(
+        tmp_path / "profiles.yml",
+        "fst_test:\n  target: dev\n  outputs:\n    dev:\n      type: duckdb\n"
+        f"      path: {tmp_path / 'target.duckdb'}\n",
+    )
+    write_file(tmp_path / "models" / "orders.sql", "select 1 as id")
+    write_file(tmp_path / "models" / "customers.sql", "select 2 as id")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DBT_PROFILES_DIR", str(tmp_path))
+    runner = InProcessDbtRunner()
+    parses = []
+    parse = runner.parse
+    monkeypatch.setattr(runner, "parse", lambda: parses.append(1) or parse())
+
+    assert "select 2 as id" in compile_model(runner, tmp_path, "customers")
+    assert len(parses) == 1
+
+    # plain SQL edits are patched into the manifest
+    write_file(tmp_path / "models" / "customers.sql", "select 2 as id, 'ada' as name")
+    assert "'ada' as name" in compile_model(runner, tmp_path, "customers")
+    assert len(parses) == 1
+
+    # a new ref() changes the model's dependencies, which takes a parse
+    write_file(tmp_path / "models" / "customers.sql", "select * from {{ ref('orders') }}")
+    assert "orders" in compile_model(runner, tmp_path, "customers")
+    assert len(parses) == 2
+
+    # so do files other than the edited models
+    write_file(tmp_path / "models" / "schema.yml", "version: 2\nmodels:\n  - name: orders\n")
+    compile_model(runner, tmp_path, "orders")
+    assert len(parses) == 3
@@ -0,0 +1,8 @@
+from fst.job_scheduler import get_default_worker_count
+
+
+def test_builds_only_run_in_parallel_with_subprocess_dbt_on_a_warehouse():
+    assert get_default_worker_count("inprocess", "snowflake") == 1
+    assert get_default_worker_count("subprocess", "duckdb") == 1
+    assert get_default_worker_count("inprocess", "duckdb") == 1
+    assert get_default_worker_count("subprocess", "snowflake") >= 1
@@ -0,0 +1,91 @@
+import glob
+import os
+from datetime import datetime, timedelta
+
+from fst.metrics_compaction import compact_metrics
+from fst.metrics_writer import MetricsWriter
+
+
+def insert_iteration(
+    duckdb_conn,
+    timestamp: datetime,
+    status: str,
+    build_time: float,
+    modified_sql_file: str = "models/customers.sql",
+) -> None:
+    duckdb_conn.execute(
+        """
+        INSERT INTO metrics (timestamp, modified_sql_file, dbt_build_status, dbt_build_time)
+        VALUES (?, ?, ?, ?)
+        """,
+        [timestamp, modified_sql_file, status, build_time],
+    )
+
+
+def test_compaction_rolls_up_archived_days(tmp_path):
+    writer = MetricsWriter(str(tmp_path / "metrics.duckdb"))
+    writer.run_migrations()
+    duckdb_conn = writer.connect()
+    archive_dir = str(tmp_path / "archive")
+    old_day = datetime.utcnow() - timedelta(days=40)
+    insert_iteration(duckdb_conn, old_day, "success", 1.0)
+    insert_iteration(duckdb_conn, old_day, "failure", 3.0)
+    insert_iteration(duckdb_conn, datetime.utcnow(), "success", 2.0)
+
+    result = compact_metrics(duckdb_conn, 30, archive_dir)
+    # compacting again finds nothing old and leaves the rollup alone
+    compact_metrics(duckdb_conn, 30, archive_dir)
+
+    assert result.archived_iterations == 2
+    assert duckdb_conn.execute("SELECT count(*) FROM metrics").fetchone() == (1,)
+    assert duckdb_conn.execute(
+        "SELECT day, model, iterations, failures, p50_build_time FROM metrics_daily_rollups"
+    ).fetchall() == [(old_day.date(), "models/customers.sql", 2, 1, 2.0)]
+    writer.close_connection()
+
+
+def test_rollups_of_a_day_include_earlier_archives(tmp_path):
+    writer = MetricsWriter(str(tmp_path / "metrics.duckdb"))
+    writer.run_migrations()
+    duckdb_conn = writer.connect()
+    archive_dir = str(tmp_path / "archive")
+    old_day = datetime.utcnow() - timedelta(days=40)
+    insert_iteration(duckdb_conn, old_day, "success", 1.0)
+    compact_metrics(duckdb_conn, 30, archive_dir)
+    # e.g. metrics imported from another machine after the day was archived
+    insert_iteration(duckdb_conn, old_day, "success", 3.0)
+    compact_metrics(duckdb_conn, 30, archive_dir)
+
+    assert duckdb_conn.execute(
+        "SELECT iterations, p50_build_time FROM metrics_daily_rollups"
+    ).fetchall() == [(2, 2.0)]
+    writer.close_connection()
+
+
+def test_models_with_the_same_file_name_stay_apart(tmp_path):
+    writer = MetricsWriter(str(tmp_path / "metrics.duckdb"))
+    writer.run_migrations()
+    duckdb_conn = writer.connect()
+    # a quote in the path has to survive the COPY statements
+    archive_dir = str(tmp_path / "bob's archive")
+    old_day = datetime.utcnow() - timedelta(days=40)
+    insert_iteration(duckdb_conn, old_day, "success", 1.0, "models/staging/orders.sql")
+    insert_iteration(duckdb_conn, old_day, "success", 3.0, "models/marts/orders.sql")
+    # rolled up by an earlier fst that keyed rollups on the file name
+    duckdb_conn.execute(
+        "INSERT INTO metrics_daily_rollups (day, model, iterations) VALUES (?, 'orders', 2)",
+        [old_day.date()],
+    )
+
+    compact_metrics(duckdb_conn, 30, archive_dir)
+
+    assert duckdb_conn.execute(
+        "SELECT model, iterations, p50_build_time FROM metrics_daily_rollups ORDER BY model"
+    ).fetchall() == [("models/marts/orders.sql", 1, 3.0), ("models/staging/orders.sql", 1, 1.0)]
+    partitions = {
+        os.path.basename(os.path.dirname(path))
+        for path in glob.glob(os.path.join(archive_dir, "metrics", "**", "*.parquet"), recursive=True)
+    }
+    assert len(partitions) == 2
+    assert all(partition.startswith("model=orders-") for partition in partitions)
+    writer.close_connection()
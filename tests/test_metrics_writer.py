@@ -0,0 +1,140 @@
+import os
+import struct
+import uuid
+
+import duckdb
+import pytest
+
+from fst.db_utils import StorageVersionError
+from fst.metrics_writer import (
+    MIGRATIONS,
+    Migration,
+    MetricsRecord,
+    MetricsWriter,
+    import_metrics,
+)
+from fst.performance_baselines import Baseline
+
+
+def make_writer(tmp_path) -> MetricsWriter:
+    writer = MetricsWriter(str(tmp_path / "metrics.duckdb"))
+    writer.run_migrations()
+    return writer
+
+
+def make_record(child_rows) -> MetricsRecord:
+    return MetricsRecord(
+        {
+            "timestamp": "2023-04-12 18:30:21",
+            "iteration_id": uuid.uuid4().hex,
+            "modified_sql_file": "models/customers.sql",
+            "dbt_build_status": "success",
+            "dbt_build_time": 1.0,
+        },
+        child_rows,
+    )
+
+
+def write_storage_version(db_file: str, version: int) -> None:
+    # what DuckDB 0.8 writes after the checksum and the magic bytes
+    with open(db_file, "r+b") as file:
+        file.seek(12)
+        file.write(struct.pack("<Q", version))
+
+
+def test_flushing_baselines_twice_updates_them(tmp_path):
+    writer = make_writer(tmp_path)
+    baseline = Baseline()
+    for build_time in [1.0, 2.0]:
+        baseline.update(build_time)
+        writer.pending = [
+            make_record(
+                {
+                    "model_baselines": [
+                        baseline.to_row("models/customers.sql", "dbt_build_time", "iteration")
+                    ]
+                }
+            )
+        ]
+        writer.flush()
+
+    duckdb_conn = writer.connect()
+    assert duckdb_conn.execute("SELECT count(*) FROM metrics").fetchone() == (2,)
+    assert duckdb_conn.execute(
+        "SELECT modified_sql_file, metric, observations, ewma FROM model_baselines"
+    ).fetchall() == [("models/customers.sql", "dbt_build_time", 2, baseline.ewma)]
+    writer.close_connection()
+
+
+def test_failing_child_table_keeps_the_rest_of_the_batch(tmp_path):
+    writer = make_writer(tmp_path)
+    writer.pending = [
+        make_record({"node_timings": [{"iteration_id": "x", "no_such_column": 1}]})
+    ]
+    writer.flush()
+
+    duckdb_conn = writer.connect()
+    assert writer.pending == []
+    assert duckdb_conn.execute("SELECT count(*) FROM metrics").fetchone() == (1,)
+    assert duckdb_conn.execute("SELECT count(*) FROM node_timings").fetchone() == (0,)
+    writer.close_connection()
+
+
+def test_migrations_alter_indexed_tables(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "metrics.duckdb")
+    make_writer(tmp_path).close_connection()
+    # metrics has had an index since migration 8
+    monkeypatch.setattr(
+        "fst.metrics_writer.MIGRATIONS",
+        MIGRATIONS
+        + [
+            Migration(
+                MIGRATIONS[-1].version + 1,
+                "add a column to metrics",
+                ["ALTER TABLE metrics ADD COLUMN IF NOT EXISTS model_owner VARCHAR"],
+            )
+        ],
+    )
+    make_writer(tmp_path).close_connection()
+
+    with duckdb.connect(db_file) as duckdb_conn:
+        columns = [row[0] for row in duckdb_conn.execute("DESCRIBE metrics").fetchall()]
+        indexes = duckdb_conn.execute(
+            "SELECT index_name FROM duckdb_indexes() WHERE table_name = 'metrics'"
+        ).fetchall()
+    assert "model_owner" in columns
+    assert indexes == [("metrics_modified_sql_file_idx",)]
+
+
+def test_history_from_an_older_duckdb_is_imported(tmp_path):
+    db_file = str(tmp_path / "metrics.duckdb")
+    export_dir = str(tmp_path / "fst_metrics_export")
+    writer = make_writer(tmp_path)
+    writer.pending = [make_record({}), make_record({})]
+    writer.flush()
+    writer.connect().execute(f"EXPORT DATABASE '{export_dir}'")
+    writer.close_connection()
+    # older exports restart every sequence where it began
+    schema_file = os.path.join(export_dir, "schema.sql")
+    with open(schema_file) as file:
+        schema = file.read()
+    with open(schema_file, "w") as file:
+        file.write(schema.replace("START 3", "START 1"))
+    write_storage_version(db_file, 51)
+
+    with pytest.raises(StorageVersionError, match="fst metrics import"):
+        make_writer(tmp_path)
+    moved_to = import_metrics(export_dir, db_file)
+
+    assert os.path.exists(moved_to)
+    writer = make_writer(tmp_path)
+    writer.pending = [make_record({})]
+    writer.flush()
+    assert writer.connect().execute("SELECT seq FROM metrics ORDER BY seq").fetchall() == [
+        (1,),
+        (2,),
+        (3,),
+    ]
+    writer.close_connection()
+    with pytest.raises(FileExistsError):
+        import_metrics(export_dir, db_file)
@@ -0,0 +1,64 @@
+import duckdb
+
+from fst.preview import PreviewStrategy, build_page_query, build_preview_query, number_rows
+
+
+def test_stratified_preview_covers_every_key():
+    duckdb_conn = duckdb.connect()
+    duckdb_conn.execute(
+        "CREATE TABLE orders AS SELECT range AS id, range % 7 AS status FROM range(10000)"
+    )
+    query = build_preview_query(
+        "SELECT * FROM orders", 20, PreviewStrategy("stratified", key_column="status")
+    )
+    rows = duckdb_conn.execute(query).fetchall()
+
+    assert len(rows) == 20
+    assert {status for _, status in rows} == set(range(7))
+    assert [column[0] for column in duckdb_conn.description] == ["id", "status"]
+
+
+def test_stratified_preview_is_reproducible():
+    results = []
+    for seed in [42, 42, 7]:
+        duckdb_conn = duckdb.connect(config={"threads": 4})
+        duckdb_conn.execute(
+            "CREATE TABLE orders AS SELECT range AS id, range % 3 AS status FROM range(500000)"
+        )
+        query = build_preview_query(
+            # aggregated in parallel, so the rows come out in a different order every run
+            "SELECT status, id % 100000 AS id_bucket, count(*) AS orders FROM orders GROUP BY ALL",
+            30,
+            PreviewStrategy("stratified", key_column="status", seed=seed),
+        )
+        results.append(duckdb_conn.execute(query).fetchall())
+
+    assert results[0] == results[1]
+    assert results[0] != results[2]
+
+
+def test_pages_cover_the_result_once_and_flag_columns_by_position():
+    duckdb_conn = duckdb.connect()
+    result = duckdb_conn.execute(
+        """
+        SELECT a.range AS id, CASE WHEN b.range = 0 THEN NULL ELSE b.range END AS id
+        FROM range(5) a, range(2) b
+        """
+    ).arrow()
+    duckdb_conn.register("fst_result", number_rows(result))
+
+    pages = [
+        duckdb_conn.execute(build_page_query("fst_result", 2, offset, 4)).arrow().to_pylist()
+        for offset in [0, 4, 8]
+    ]
+
+    rows = [row for page in pages for row in page]
+    assert [(row["__fst_column_0"], row["__fst_column_1"]) for row in rows] == list(
+        zip(result.column(0).to_pylist(), result.column(1).to_pylist())
+    )
+    # the second `id` is the one with nulls, every id repeats in both
+    assert not any(row["__fst_null_0"] for row in rows)
+    assert [row["__fst_null_1"] for row in rows] == [
+        value is None for value in result.column(1).to_pylist()
+    ]
+    assert all(row["__fst_duplicate_0"] and row["__fst_duplicate_1"] for row in rows)
@@ -0,0 +1,101 @@
+import threading
+
+from fst.build_queue import BuildJob
+from fst.db_utils import target_lock
+from fst.dbt_runner import DbtResult
+from fst.query_handler import DynamicQueryHandler, build_and_record, compile_and_preview
+
+
+def is_target_locked() -> bool:
+    # another thread, since the lock is reentrant for the one holding it
+    locked = []
+
+    def try_lock() -> None:
+        acquired = target_lock.acquire(blocking=False)
+        if acquired:
+            target_lock.release()
+        locked.append(not acquired)
+
+    thread = threading.Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    return locked[0]
+
+
+def test_previews_run_outside_the_target_lock(monkeypatch):
+    monkeypatch.setattr("fst.db_utils.get_target_config", lambda: {"type": "duckdb"})
+    locked_during = {}
+
+    def run_dbt(args, job=None):
+        locked_during["compile"] = is_target_locked()
+        return DbtResult(0, "")
+
+    def run_preview(active_file, trace=None):
+        locked_during[active_file] = is_target_locked()
+        return {}
+
+    monkeypatch.setattr("fst.query_handler.run_dbt", run_dbt)
+    monkeypatch.setattr("fst.query_handler.run_preview", run_preview)
+    previews = compile_and_preview(["models/customers.sql", "models/orders.sql"], 0.0)
+
+    assert locked_during == {
+        "compile": True,
+        "models/customers.sql": False,
+        "models/orders.sql": False,
+    }
+    assert set(previews) == {"models/customers.sql", "models/orders.sql"}
+
+
+def test_column_profile_runs_after_the_build_releases_the_target(monkeypatch):
+    monkeypatch.setattr("fst.db_utils.get_target_config", lambda: {"type": "duckdb"})
+    locked_during = {}
+
+    def run_column_profile(relation_name):
+        locked_during["profile"] = is_target_locked()
+        return []
+
+    def split_node_results_by_file(active_files, *args):
+        return {
+            active_file: {
+                "status": "success",
+                "tests_ran": True,
+                "node_spans": [],
+                "relation_name": "customers",
+            }
+            for active_file in active_files
+        }
+
+    monkeypatch.setattr("fst.query_handler.run_dbt", lambda args, job=None: DbtResult(0, ""))
+    monkeypatch.setattr("fst.query_handler.split_node_results_by_file", split_node_results_by_file)
+    monkeypatch.setattr("fst.query_handler.run_column_profile", run_column_profile)
+    monkeypatch.setattr(
+        "fst.query_handler.snapshot_target",
+        lambda: locked_during.setdefault("snapshot", is_target_locked()),
+    )
+    monkeypatch.setattr("fst.query_handler.record_iteration", lambda *args: None)
+    job = BuildJob({"models/customers.sql": 1}, lambda file_path, revision: True)
+    build_and_record(
+        ["models/customers.sql"], {"models/customers.sql": {"preview_table": object()}}, job
+    )
+
+    # the snapshot is taken before anything else can write to the target
+    assert locked_during == {"snapshot": True, "profile": False}
+
+
+def test_builds_without_results_can_be_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "fst.query_handler.CONTENT_HASH_CACHE_FILE", str(tmp_path / "content_hashes.json")
+    )
+    built, failed = str(tmp_path / "customers.sql"), str(tmp_path / "orders.sql")
+    for file_path in [built, failed]:
+        with open(file_path, "w") as file:
+            file.write("SELECT 1 AS id")
+    handler = DynamicQueryHandler(lambda job, on_complete: None, str(tmp_path))
+    assert handler.hash_cache.has_changed(built) and handler.hash_cache.has_changed(failed)
+
+    # e.g. the build raised before it split its results per file
+    job = BuildJob({built: 1, failed: 1}, lambda file_path, revision: True)
+    handler.finish_batch(job, {built: {"status": "success"}})
+
+    assert not handler.hash_cache.has_changed(built)
+    assert handler.hash_cache.has_changed(failed)
@@ -0,0 +1,155 @@
+import threading
+import time
+from multiprocessing.connection import Client
+
+import pytest
+
+from fst.config_defaults import READ_SERVER_AUTHKEY_ENV
+from fst.db_utils import (
+    TargetBusyError,
+    get_connection,
+    hand_target_to_dbt,
+    refresh_target_snapshot,
+    release_connections,
+)
+from fst.metrics_writer import close_metrics_writer, configure_metrics_writer
+from fst.read_server import (
+    METRICS_DATABASE,
+    TARGET_DATABASE,
+    ReadClient,
+    ReadServer,
+    ReadServerError,
+)
+
+AUTHKEY = b"fst-test"
+SLOW_QUERY = "SELECT sum(a.range * b.range) AS total FROM range(100000) a, range(100000) b"
+
+
+@pytest.fixture
+def read_server(tmp_path):
+    configure_metrics_writer(str(tmp_path / "metrics.duckdb"), idle_close_seconds=None)
+    server = ReadServer(str(tmp_path / "read.sock"), AUTHKEY)
+    server.start()
+    yield server
+    server.close()
+    close_metrics_writer()
+
+
+def test_cancelled_read_keeps_the_connection(read_server):
+    client = ReadClient(read_server.address, AUTHKEY)
+    results = {}
+
+    def read() -> None:
+        try:
+            client.execute(METRICS_DATABASE, SLOW_QUERY, request_id="slow")
+        except ReadServerError as e:
+            results["error"] = str(e)
+        # the next read goes over the same connection as the cancelled one
+        results["next"] = client.execute(METRICS_DATABASE, "SELECT 42 AS answer").to_pylist()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.5)
+    client.cancel("slow")
+    reader.join(timeout=10)
+
+    assert not reader.is_alive()
+    assert "error" in results
+    assert results["next"] == [{"answer": 42}]
+
+
+def test_malformed_request_gets_an_error(read_server):
+    with Client(read_server.address, authkey=AUTHKEY) as connection:
+        connection.send(["not", "a", "request"])
+        assert connection.recv()["status"] == "error"
+        connection.send({"cancel": "no-such-read"})
+        connection.send(
+            {"database": METRICS_DATABASE, "query": "SELECT 1 AS one", "request_id": "one"}
+        )
+        assert connection.recv()["status"] == "ok"
+
+
+def test_failed_cancel_keeps_the_connection(read_server):
+    # e.g. a DuckDB without DuckDBPyConnection.interrupt()
+    read_server.running["stuck"] = object()
+    with Client(read_server.address, authkey=AUTHKEY) as connection:
+        connection.send({"cancel": "stuck"})
+        connection.send(
+            {"database": METRICS_DATABASE, "query": "SELECT 1 AS one", "request_id": "one"}
+        )
+        assert connection.recv()["status"] == "ok"
+
+
+def test_target_reads_wait_for_a_short_dbt_invocation(read_server, tmp_path, monkeypatch):
+    db_file = str(tmp_path / "target.duckdb")
+    monkeypatch.setattr("fst.read_server.get_duckdb_file_path", lambda: db_file)
+    client = ReadClient(read_server.address, AUTHKEY)
+    compiling = threading.Event()
+
+    def compile() -> None:
+        with hand_target_to_dbt():
+            compiling.set()
+            time.sleep(0.5)
+
+    try:
+        compiler = threading.Thread(target=compile)
+        compiler.start()
+        compiling.wait(timeout=10)
+        # queued behind the compile rather than refused
+        assert client.execute(TARGET_DATABASE, "SELECT 1 AS one").to_pylist() == [{"one": 1}]
+        compiler.join(timeout=10)
+    finally:
+        release_connections()
+
+
+def test_target_reads_use_the_snapshot_while_dbt_has_the_file(read_server, tmp_path, monkeypatch):
+    db_file = str(tmp_path / "target.duckdb")
+    monkeypatch.setattr("fst.read_server.get_duckdb_file_path", lambda: db_file)
+    client = ReadClient(read_server.address, AUTHKEY)
+    try:
+        get_connection(db_file).execute("CREATE TABLE orders AS SELECT 1 AS id")
+        refresh_target_snapshot(db_file)
+        get_connection(db_file).execute("INSERT INTO orders VALUES (2)")
+        with hand_target_to_dbt():
+            start_time = time.time()
+            # the qualified name still resolves, since the snapshot keeps the file name
+            rows = client.execute(TARGET_DATABASE, "SELECT id FROM target.main.orders")
+            assert time.time() - start_time < 1
+            assert rows.to_pylist() == [{"id": 1}]
+        rows = client.execute(TARGET_DATABASE, "SELECT id FROM orders ORDER BY id")
+        assert rows.to_pylist() == [{"id": 1}, {"id": 2}]
+    finally:
+        release_connections()
+
+
+def test_target_reads_report_busy_without_a_snapshot(read_server, tmp_path, monkeypatch):
+    db_file = str(tmp_path / "target.duckdb")
+    monkeypatch.setattr("fst.read_server.get_duckdb_file_path", lambda: db_file)
+    monkeypatch.setattr("fst.db_utils.TARGET_BUSY_WAIT_SECONDS", 0.2)
+    client = ReadClient(read_server.address, AUTHKEY)
+    try:
+        with hand_target_to_dbt():
+            with pytest.raises(TargetBusyError):
+                client.execute(TARGET_DATABASE, "SELECT 1 AS one")
+        assert client.execute(TARGET_DATABASE, "SELECT 1 AS one").to_pylist() == [{"one": 1}]
+    finally:
+        release_connections()
+
+
+def test_files_are_opened_directly_only_without_a_watcher(read_server, tmp_path):
+    metrics_db_file = str(tmp_path / "metrics.duckdb")
+    # the watcher holds the metrics file, so opening it would fail with a lock error
+    with pytest.raises(ReadServerError, match=READ_SERVER_AUTHKEY_ENV):
+        ReadClient(read_server.address, None, metrics_db_file).execute(
+            METRICS_DATABASE, "SELECT 1 AS one"
+        )
+    read_server.close()
+    close_metrics_writer()
+    for authkey in [None, AUTHKEY]:
+        client = ReadClient(read_server.address, authkey, metrics_db_file)
+        assert client.execute(METRICS_DATABASE, "SELECT 1 AS one").to_pylist() == [{"one": 1}]
+
+
+def test_server_needs_an_authkey(tmp_path):
+    with pytest.raises(ValueError):
+        ReadServer(str(tmp_path / "read.sock"), None)
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from fst.metrics_writer import MetricsWriter
+from fst.spans import SPAN_ROWS_QUERY, get_span_rows_params
+
+
+def test_span_rows_of_a_model_are_selected_by_path(tmp_path):
+    writer = MetricsWriter(str(tmp_path / "metrics.duckdb"))
+    writer.run_migrations()
+    duckdb_conn = writer.connect()
+    for seq, modified_sql_file in enumerate(
+        ["/project/models/staging/orders.sql", "/project/models/marts/orders.sql"]
+    ):
+        iteration_id = f"iteration_{seq}"
+        duckdb_conn.execute(
+            "INSERT INTO metrics (iteration_id, seq, modified_sql_file) VALUES (?, ?, ?)",
+            [iteration_id, seq, modified_sql_file],
+        )
+        duckdb_conn.execute(
+            "INSERT INTO spans (iteration_id, span_id, name, start_time) VALUES (?, ?, 'iteration', ?)",
+            [iteration_id, f"span_{seq}", datetime.utcnow()],
+        )
+
+    def select_files(model: str):
+        return [
+            row[-1]
+            for row in duckdb_conn.execute(
+                SPAN_ROWS_QUERY, get_span_rows_params(10, model=model)
+            ).fetchall()
+        ]
+
+    assert select_files("models/staging/orders.sql") == ["/project/models/staging/orders.sql"]
+    assert select_files("/project/models/marts/orders.sql") == ["/project/models/marts/orders.sql"]
+    assert select_files("orders") == []
+    writer.close_connection()